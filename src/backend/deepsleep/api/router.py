@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 from deepsleep.api.v1 import (chat, dialog, message, agent, history, mcp_stdio_server, mcp_chat,
-                              user, llm, tool, knowledge, knowledge_file, mcp_agent, mcp_server)
+                              user, llm, tool, knowledge, knowledge_file, mcp_agent, mcp_server, mineru)
 
 router = APIRouter(prefix="/api/v1")
 
@@ -18,3 +18,4 @@ router.include_router(mcp_server.router)
 router.include_router(mcp_stdio_server.router)
 router.include_router(mcp_chat.router)
 router.include_router(mcp_agent.router)
+router.include_router(mineru.router)
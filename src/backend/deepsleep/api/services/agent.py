@@ -162,6 +162,15 @@ class AgentService:
         except Exception as err:
             logger.error(f"select agent by id is appear error: {err}")
 
+    @classmethod
+    async def async_select_agent_by_id(cls, agent_id: str):
+        try:
+            data = await AgentDao.async_select_agent_by_id(agent_id)
+            return data
+
+        except Exception as err:
+            logger.error(f"select agent by id is appear error: {err}")
+
     # @classmethod
     # def get_parameter_by_name(cls, name: str):
     #     try:
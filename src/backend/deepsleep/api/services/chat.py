@@ -1,4 +1,5 @@
 import asyncio
+from typing import List
 from uuid import uuid4
 
 from langchain.agents import create_structured_chat_agent, AgentExecutor
@@ -16,6 +17,8 @@ from deepsleep.tools import action_Function_call, action_React
 from deepsleep.api.services.llm import LLMService
 from deepsleep.services.mcp.manager import MCPManager
 from deepsleep.api.services.mcp_stdio_server import MCPServerService
+from deepsleep.database.session import run_sync
+from deepsleep.services.chat.context import ContextAssembler
 from loguru import logger
 import inspect
 import json
@@ -39,6 +42,9 @@ class ChatService:
         self.llm = None
         self.embedding = None
         self.tools = []
+        self.context_assembler = None
+        # 最近一轮对话的上下文 token 统计
+        self.token_usage = None
 
 
     async def init_agent(self):
@@ -48,25 +54,26 @@ class ChatService:
         await self.setup_mcp_tools()
 
     async def setup_llm(self):
-        llm_config = LLMService.get_llm_by_id(llm_id=self.llm_id)
+        llm_config = await LLMService.async_get_llm_by_id(llm_id=self.llm_id)
         self.llm = ChatOpenAI(model=llm_config.model,
                               base_url=llm_config.base_url, api_key=llm_config.api_key)
 
         self.llm_call = FUNCTION_CALL_MSG if llm_config.model in Function_Call_provider else REACT_MSG
+        self.context_assembler = ContextAssembler(llm_config.model)
         # Agent支持Embedding后初始化
         if self.embedding_id:
             await self.init_embedding()
 
     async def init_embedding(self):
 
-        embedding_config = LLMService.get_llm_by_id(llm_id=self.embedding_id)
+        embedding_config = await LLMService.async_get_llm_by_id(llm_id=self.embedding_id)
         self.embedding = OpenAIEmbeddings(model=embedding_config.model,
                                           base_url=embedding_config.base_url, api_key=embedding_config.api_key)
 
     async def init_mcp(self):
         servers = []
         for mcp_id in self.mcp_ids:
-            server = MCPServerService.get_mcp_server_user(mcp_id)
+            server = await run_sync(MCPServerService.get_mcp_server_user, mcp_id)
             servers.append(server)
 
         await self.mcp_manager.connect_mcp_servers(servers)
@@ -76,7 +83,7 @@ class ChatService:
         self.mcp_tools = mcp_tools
 
     async def setup_tools(self):
-        tools_name = ToolService.get_tool_name_by_id(self.tools_id)
+        tools_name = await run_sync(ToolService.get_tool_name_by_id, self.tools_id)
         if self.llm_call == REACT_MSG:
             for name in tools_name:
                 func = action_React[name]
@@ -89,7 +96,7 @@ class ChatService:
     async def run(self, user_input: str):
 
         # 都是通过检索RAG，并发可以减少消耗时间
-        history_message, recall_knowledge_data = await asyncio.gather(
+        history_messages, recall_knowledge_data = await asyncio.gather(
             self.get_history_message(user_input=user_input, dialog_id=self.dialog_id),
             RagHandler.rag_query(user_input, self.knowledges_id)
         )
@@ -97,26 +104,39 @@ class ChatService:
         # history_message = await self.get_history_message(user_input=user_input, dialog_id=self.dialog_id)
         # recall_knowledge_data = await RagHandler.rag_query(user_input, self.knowledges_id)
 
-        if self.llm_call == 'React':
-            return self._run_react(user_input, history_message, recall_knowledge_data)
+        if self.llm_call == REACT_MSG:
+            response = self._run_react(user_input, history_messages, recall_knowledge_data)
         else:
-            return self._run_function_call(user_input, history_message, recall_knowledge_data)
+            response = self._run_function_call(user_input, history_messages, recall_knowledge_data)
+        async for chunk in response:
+            yield chunk
+
+    async def _run_react(self, user_input: str, history_messages: List[str], recall_knowledge_data: str):
+        # 历史记录和召回结果按 token 预算截断后再放进 prompt
+        history_message, recall_knowledge_data, _, self.token_usage = self.context_assembler.assemble(
+            history_messages, recall_knowledge_data)
 
-    async def _run_react(self, user_input: str, history_message: str, recall_knowledge_data: str):
         agent = create_structured_chat_agent(llm=self.llm, tools=self.tools, prompt=react_prompt_en)
         agent_executor = AgentExecutor(agent=agent, tools=self.tools, verbose=True, handle_parsing_errors=True)
 
         async for chunk in agent_executor.astream({'input': user_input, 'history': history_message, 'recall_knowledge_data': recall_knowledge_data}):
             yield chunk.json(ensure_ascii=False, include=INCLUDE_MSG)
 
-    async def _run_function_call(self, user_input: str, history_message: str, recall_knowledge_text: str):
+    async def _run_function_call(self, user_input: str, history_messages: List[str], recall_knowledge_text: str):
+        # 选择工具时还没有工具结果，历史记录和召回结果先按没有工具结果的预算截断
+        history_message, tool_recall_text, _, _ = self.context_assembler.assemble(
+            history_messages, recall_knowledge_text)
 
         # 并发执行不同类型的工具
-        tools_result, mcp_tools_result = asyncio.gather(
-            self.call_common_tool(user_input, history_message),
-            self.call_mcp_tool(user_input, history_message)
+        tools_result, mcp_tools_result = await asyncio.gather(
+            self.call_common_tool(user_input, history_message, tool_recall_text),
+            self.call_mcp_tool(user_input, history_message, tool_recall_text)
         )
 
+        # 工具结果也放进同一个预算，重新分配三部分的 token；召回结果使用未截断的原文，避免截断两次
+        history_message, recall_knowledge_text, (tools_result, mcp_tools_result), self.token_usage = \
+            self.context_assembler.assemble(history_messages, recall_knowledge_text, [tools_result, mcp_tools_result])
+
 
         prompt_template = PromptTemplate.from_template(function_call_prompt)
 
@@ -124,18 +144,20 @@ class ChatService:
         async for chunk in chain.astream({'input': user_input, 'history': history_message, 'tools_result': tools_result, "mcp_tools_result": mcp_tools_result, "knowledge_result": recall_knowledge_text}):
             yield chunk.json(ensure_ascii=False, include=INCLUDE_MSG)
 
-    async def call_common_tool(self, user_input, history_message):
+    async def call_common_tool(self, user_input, history_message, recall_knowledge_data):
         # 普通的插件调用
-        func_prompt = function_call_template.format(input=user_input, history=history_message)
+        func_prompt = function_call_template.format(input=user_input, history=history_message,
+                                                    recall_knowledge_data=recall_knowledge_data)
         fun_name, args = await self._function_call(user_input=func_prompt)
-        tools_result = self.exec_tools(fun_name, args)
+        tools_result = await self.exec_tools(fun_name, args)
         return tools_result
 
-    async def call_mcp_tool(self, user_input, history_message):
+    async def call_mcp_tool(self, user_input, history_message, recall_knowledge_data):
         # MCP 插件调用
-        mcp_tool_prompt = function_call_template.format(input=user_input, history=history_message)
+        mcp_tool_prompt = function_call_template.format(input=user_input, history=history_message,
+                                                        recall_knowledge_data=recall_knowledge_data)
         mcp_tool_name, mcp_tool_args = await self._mcp_function_call(user_input=mcp_tool_prompt)
-        mcp_tool_result = self.exec_mcp_tools(mcp_tool_name, mcp_tool_args)
+        mcp_tool_result = await self.exec_mcp_tools(mcp_tool_name, mcp_tool_args)
         return mcp_tool_result
 
     async def _function_call(self, user_input: str):
@@ -181,7 +203,7 @@ class ChatService:
             "tool_name": mcp_tool_name,
             "tool_args": mcp_tool_args
         }
-        mcp_tool_results = self.mcp_manager.call_mcp_tools([mcp_tools_info])
+        mcp_tool_results = await self.mcp_manager.call_mcp_tools([mcp_tools_info])
         return mcp_tool_results
 
     async def exec_tools(self, func_name, args):
@@ -194,22 +216,19 @@ class ChatService:
             return fail_action_prompt
 
 
-    async def get_history_message(self, user_input: str, dialog_id: str, top_k: int = 5) -> str:
+    async def get_history_message(self, user_input: str, dialog_id: str, top_k: int = 5) -> List[str]:
+        # 返回按时间正序的历史消息文本列表，由 context_assembler 按 token 预算截断
         # 如果绑定了Embedding模型，默认走RAG检索聊天记录
         if self.embedding:
             messages = await self._retrieval_history(user_input, dialog_id, top_k)
-            return messages
+            return [messages]
         else:
             messages = await self._direct_history(dialog_id, top_k)
-
-            result = ''
-            for message in messages:
-                result += message.to_str()
-            return result
+            return [message.to_str() for message in messages]
 
     @staticmethod
     async def _direct_history(dialog_id: str, top_k: int):
-        messages = HistoryService.select_history(dialog_id=dialog_id, top_k=top_k)
+        messages = await HistoryService.get_recent_history(dialog_id=dialog_id, top_k=top_k)
         result = []
         for message in messages:
             result.append(message)
@@ -1,22 +1,24 @@
 from deepsleep.database.dao.dialog import DialogDao
 from deepsleep.database.dao.history import HistoryDao
+from deepsleep.services.conversation_cache import conversation_cache
+from deepsleep.services.history_writer import history_writer
 from loguru import logger
 
 
 class DialogService:
 
     @classmethod
-    def create_dialog(cls, name: str, agent_id: str, agent_type: str, user_id: str):
+    async def create_dialog(cls, name: str, agent_id: str, agent_type: str, user_id: str):
         try:
-            dialog_id = DialogDao.create_dialog(name, agent_id, agent_type, user_id)
+            dialog_id = await DialogDao.async_create_dialog(name, agent_id, agent_type, user_id)
             return dialog_id
         except Exception as err:
             logger.error(f"add dialog is appear error: {err}")
 
     @classmethod
-    def select_dialog(cls, dialog_id: str):
+    async def select_dialog(cls, dialog_id: str):
         try:
-            data = DialogDao.select_dialog(dialog_id)
+            data = await DialogDao.async_select_dialog(dialog_id)
             result = []
             for item in data:
                 result.append(item[0])
@@ -25,9 +27,9 @@ class DialogService:
             logger.error(f"select dialog is appear error: {err}")
 
     @classmethod
-    def get_list_dialog(cls, user_id: str):
+    async def get_list_dialog(cls, user_id: str):
         try:
-            data = DialogDao.get_dialog_by_user(user_id=user_id)
+            data = await DialogDao.async_get_dialog_by_user(user_id=user_id)
             result = []
             for item in data:
                 result.append(item[0])
@@ -36,9 +38,9 @@ class DialogService:
             logger.error(f"get list dialog is appear error: {err}")
 
     @classmethod
-    def get_agent_by_dialog_id(cls, dialog_id: str):
+    async def get_agent_by_dialog_id(cls, dialog_id: str):
         try:
-            data = DialogDao.get_agent_by_dialog_id(dialog_id)
+            data = await DialogDao.async_get_agent_by_dialog_id(dialog_id)
             result = []
             for item in data:
                 result.append(item[0])
@@ -47,24 +49,27 @@ class DialogService:
             logger.error(f"select dialog is appear error: {err}")
 
     @classmethod
-    def update_dialog_time(cls, dialog_id: str):
+    async def update_dialog_time(cls, dialog_id: str):
         try:
-            DialogDao.update_dialog_time(dialog_id=dialog_id)
+            await DialogDao.async_update_dialog_time(dialog_id=dialog_id)
         except Exception as err:
             logger.error(f"update dialog create time appear error: {err}")
 
     @classmethod
-    def delete_dialog(cls, dialog_id: str):
+    async def delete_dialog(cls, dialog_id: str):
         try:
-            DialogDao.delete_dialog_by_id(dialog_id=dialog_id)
-            HistoryDao.delete_history_by_dialog_id(dialog_id=dialog_id)
+            # 先丢弃写入缓冲区中的消息，否则删除之后后台任务又会把它们写回来
+            await history_writer.discard(dialog_id)
+            await DialogDao.async_delete_dialog_by_id(dialog_id=dialog_id)
+            await HistoryDao.async_delete_history_by_dialog_id(dialog_id=dialog_id)
+            await conversation_cache.invalidate(dialog_id)
         except Exception as err:
             logger.error(f"delete dialog appear error: {err}")
 
     @classmethod
-    def check_dialog_iscustom(cls, dialog_id: str):
+    async def check_dialog_iscustom(cls, dialog_id: str):
         try:
-            result = DialogDao.check_dialog_iscustom(dialog_id=dialog_id)
+            result = await DialogDao.async_check_dialog_iscustom(dialog_id=dialog_id)
             for data in result:
                 if data[0].is_custom:
                     return True
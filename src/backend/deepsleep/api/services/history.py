@@ -1,3 +1,5 @@
+import base64
+from datetime import datetime
 from typing import List
 from uuid import uuid4
 
@@ -5,35 +7,59 @@ from uuid import uuid4
 from deepsleep.database.dao.history import HistoryDao
 from deepsleep.schema.message import Message
 from loguru import logger
-from deepsleep.services.rag.es_client import client as es_client
-from deepsleep.services.rag.milvus_client import client as milvus_client
+from deepsleep.services.rag.backend import get_vector_store, get_lexical_store
+from deepsleep.services.history_writer import history_writer
+from deepsleep.services.conversation_cache import conversation_cache
 from deepsleep.schema.chunk import ChunkModel
 from deepsleep.utils.helpers import get_now_beijing_time
 
 class HistoryService:
 
     @classmethod
-    def create_history(cls, role: str, content: str, dialog_id: str):
+    async def create_history(cls, role: str, content: str, dialog_id: str):
         try:
-            HistoryDao.create_history(role, content, dialog_id)
+            await HistoryDao.async_create_history(role, content, dialog_id)
         except Exception as err:
             logger.error(f"add history data appear error: {err}")
 
     @classmethod
-    def select_history(cls, dialog_id: str, top_k: int = 5) -> List[Message]:
+    async def select_history(cls, dialog_id: str, top_k: int = 5) -> List[Message]:
         try:
-            result = HistoryDao.select_history(dialog_id, top_k)
+            # 先取缓冲区的快照再查询数据库：查询期间写入完成的消息一定能在数据库中查到，
+            # 快照中已经写入的消息按 id 去重
+            pending = history_writer.pending_messages(dialog_id)
+            result = await HistoryDao.async_select_history(dialog_id, top_k)
+            histories = [data[0] for data in result]
+            history_ids = {history.id for history in histories}
+            histories += [history for history in pending if history.id not in history_ids]
+
             message_sql: List[Message] = []
-            for data in result:
-                message_sql.append(Message(content=data[0].content, role=data[0].role))
+            for history in histories[-top_k:]:
+                message_sql.append(Message(content=history.content, role=history.role))
             return message_sql
         except Exception as err:
             logger.error(f"select history is appear error: {err}")
 
     @classmethod
-    def get_dialog_history(cls, dialog_id: str):
+    async def get_recent_history(cls, dialog_id: str, top_k: int = 5) -> List[Message]:
+        """最近 top_k 条消息，优先读取对话窗口缓存，未命中时从数据库读取整个窗口并写入缓存"""
+        messages = await conversation_cache.get(dialog_id, top_k)
+        if messages is not None:
+            return messages
+
+        window = max(top_k, conversation_cache.window)
+        # 先取追加序号再读数据库，读取期间其他请求追加的消息不会被缺失的窗口覆盖
+        token = await conversation_cache.fill_token(dialog_id)
+        messages = await cls.select_history(dialog_id, window)
+        if messages is None:
+            return []
+        await conversation_cache.fill(dialog_id, messages, complete=len(messages) < window, token=token)
+        return messages[-top_k:] if top_k else []
+
+    @classmethod
+    async def get_dialog_history(cls, dialog_id: str):
         try:
-            result = HistoryDao.get_dialog_history(dialog_id)
+            result = await HistoryDao.async_get_dialog_history(dialog_id)
             message_sql: List[Message] = []
             for data in result:
                 message_sql.append(Message(content=data[0].content, role=data[0].role))
@@ -41,6 +67,33 @@ class HistoryService:
         except Exception as err:
             logger.error(f"get dialog history is appear error: {err}")
 
+    @staticmethod
+    def encode_cursor(history):
+        value = f"{history.create_time.isoformat()}|{history.id}"
+        return base64.urlsafe_b64encode(value.encode('utf-8')).decode('utf-8')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            create_time, history_id = base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8').split('|', 1)
+            return datetime.fromisoformat(create_time), history_id
+        except Exception:
+            raise ValueError(f"invalid history cursor: {cursor}")
+
+    @classmethod
+    async def get_history_page(cls, dialog_id: str, limit: int = 50, cursor: str = None):
+        """按时间正序分页读取对话记录，返回 (记录列表, 下一页的游标)，没有下一页时游标为 None"""
+        after = cls.decode_cursor(cursor) if cursor else None
+        result = await HistoryDao.async_get_history_page(dialog_id, limit, after)
+        histories = [data[0] for data in result]
+        next_cursor = cls.encode_cursor(histories[-1]) if len(histories) == limit else None
+        return histories, next_cursor
+
+    @classmethod
+    async def iter_dialog_history(cls, dialog_id: str, batch_size: int = 500):
+        async for data in HistoryDao.async_iter_dialog_history(dialog_id, batch_size):
+            yield data[0]
+
     @classmethod
     async def save_es_documents(cls, index_name, content):
         chunks = [ChunkModel(chunk_id=uuid4().hex,
@@ -51,7 +104,7 @@ class HistoryService:
                              update_time=get_now_beijing_time(),
                              file_name='history_rag')]
 
-        await es_client.index_documents(index_name, chunks)
+        await get_lexical_store().index_documents(index_name, chunks)
 
     @classmethod
     async def save_milvus_documents(cls, collection_name, content):
@@ -63,16 +116,13 @@ class HistoryService:
                              summary="history_rag",
                              file_name='history_rag')]
 
-        await milvus_client.insert(collection_name, chunks)
+        await get_vector_store().insert(collection_name, chunks)
 
     # 历史记录都存milvus 和 es一份，开启RAG召回历史记录
+    # 消息先进入写入缓冲区，由 history_writer 批量写入 MySQL、ES 和 Milvus，对话不等待三个存储
     @classmethod
     async def save_chat_history(cls, role, content, knowledge_id):
-        documents = f"{role}: \n {content}"
-
-        cls.create_history(role, content, knowledge_id)
-
-        await cls.save_es_documents(knowledge_id, documents)
-        await cls.save_milvus_documents(knowledge_id, documents)
+        await history_writer.enqueue(role, content, knowledge_id)
+        await conversation_cache.append(knowledge_id, role, content)
 
 
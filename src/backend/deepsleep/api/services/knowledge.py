@@ -2,6 +2,7 @@ from loguru import logger
 from deepsleep.config.service_config import SUCCESS_RESP, FAIL_RESP
 from deepsleep.database.dao.knowledge import KnowledgeDao
 from deepsleep.database.models.user import AdminUser
+from deepsleep.database.session import run_sync
 
 
 class KnowledgeService:
@@ -9,7 +10,7 @@ class KnowledgeService:
     @classmethod
     async def create_knowledge(cls, knowledge_name, knowledge_desc, user_id):
         try:
-            KnowledgeDao.create_knowledge(knowledge_name, knowledge_desc, user_id)
+            await run_sync(KnowledgeDao.create_knowledge, knowledge_name, knowledge_desc, user_id)
             logger.info(f'Success Create knowledge')
             return SUCCESS_RESP
         except Exception as err:
@@ -23,7 +24,7 @@ class KnowledgeService:
             if user_id == AdminUser:
                 return await cls._select_all_knowledge()
 
-            datas = KnowledgeDao.get_knowledge_by_user(user_id)
+            datas = await run_sync(KnowledgeDao.get_knowledge_by_user, user_id)
             result = []
             for data in datas:
                 result.append(data[0])
@@ -36,7 +37,7 @@ class KnowledgeService:
     @classmethod
     async def _select_all_knowledge(cls):
         try:
-            datas = KnowledgeDao.get_all_knowledge()
+            datas = await run_sync(KnowledgeDao.get_all_knowledge)
             result = []
             for data in datas:
                 result.append(data[0])
@@ -51,7 +52,7 @@ class KnowledgeService:
             if user_id != knowledge_user_id and user_id != AdminUser:
                 raise ValueError(f'User id: {user_id} update knowledge, but no permission')
 
-            KnowledgeDao.delete_knowledge_by_id(knowledge_id)
+            await run_sync(KnowledgeDao.delete_knowledge_by_id, knowledge_id)
             logger.info(f'Success Delete Knowledge ID: {knowledge_id}')
             return SUCCESS_RESP
         except Exception as err:
@@ -65,7 +66,7 @@ class KnowledgeService:
             if user_id != knowledge_user_id and user_id != AdminUser:
                 raise ValueError(f'User id: {user_id} update knowledge, but no permission')
 
-            KnowledgeDao.update_knowledge_by_id(knowledge_id, knowledge_name, knowledge_desc)
+            await run_sync(KnowledgeDao.update_knowledge_by_id, knowledge_id, knowledge_name, knowledge_desc)
             logger.info(f'Success Update Knowledge ID: {knowledge_id}')
             return SUCCESS_RESP
         except Exception as err:
@@ -75,7 +76,7 @@ class KnowledgeService:
     @classmethod
     async def select_user_by_id(cls, knowledge_id):
         try:
-            knowledge = KnowledgeDao.select_user_by_id(knowledge_id)
+            knowledge = await run_sync(KnowledgeDao.select_user_by_id, knowledge_id)
             return knowledge.user_id
         except Exception as err:
             logger.error(f'select user id error :{err}')
@@ -1,7 +1,9 @@
 from uuid import uuid4
 
 from deepsleep.database.dao.knowledge_file import KnowledgeFileDao
+from deepsleep.services.ingest import ingest_manager, MODE_UPDATE
 from deepsleep.services.rag_handler import RagHandler
+from deepsleep.services.rag.summary import summary_generator
 
 
 class KnowledgeFileService:
@@ -12,7 +14,7 @@ class KnowledgeFileService:
 
     @classmethod
     async def get_knowledge_file(cls, knowledge_id):
-        results = KnowledgeFileDao.select_knowledge_file(knowledge_id)
+        results = await KnowledgeFileDao.async_select_knowledge_file(knowledge_id)
         result = []
         for data in results:
             result.append(data[0])
@@ -21,19 +23,45 @@ class KnowledgeFileService:
     @classmethod
     async def create_knowledge_file(cls, file_path, knowledge_id, user_id, oss_url):
         knowledge_file_id = uuid4().hex
-        # 将上传的文件解析成chunks 放到ES 和 Milvus
-        await RagHandler.index_es_documents(knowledge_id, knowledge_file_id, file_path, knowledge_id)
-        await RagHandler.index_milvus_documents(knowledge_id, knowledge_file_id, file_path, knowledge_id)
-        KnowledgeFileDao.create_knowledge_file(knowledge_file_id, file_path, knowledge_id, user_id, oss_url)
+
+        async def on_success():
+            await KnowledgeFileDao.async_create_knowledge_file(knowledge_file_id, file_path, knowledge_id, user_id, oss_url)
+
+        # 将上传的文件解析成chunks 放到ES 和 Milvus，由后台任务完成
+        job = await ingest_manager.submit(knowledge_file_id, file_path, knowledge_id, on_success)
+        return job.to_dict()
+
+    @classmethod
+    async def update_knowledge_file(cls, knowledge_file_id, file_path, oss_url):
+        knowledge_file = await cls.select_knowledge_file_by_id(knowledge_file_id)
+
+        async def on_success():
+            await KnowledgeFileDao.async_update_knowledge_file(knowledge_file_id, file_path, oss_url)
+
+        # 增量更新：只对新增的 chunks 生成摘要和向量，删除已经不存在的 chunks
+        job = await ingest_manager.submit(knowledge_file_id, file_path, knowledge_file.knowledge_id,
+                                          on_success, MODE_UPDATE)
+        return job.to_dict()
+
+    @classmethod
+    async def get_ingest_status(cls, job_id):
+        job = ingest_manager.get_job(job_id)
+        if job is None:
+            raise ValueError(f"ingest job: {job_id} not exist")
+        return job.to_dict()
 
     @classmethod
     async def delete_knowledge_file(cls, knowledge_file_id):
         knowledge_file = await cls.select_knowledge_file_by_id(knowledge_file_id)
-        await RagHandler.delete_documents_es_milvus(knowledge_file.file_id, knowledge_file.knowledge_id)
+        # 删除 ES 和 Milvus 中的 chunks，同时失效该知识库的语义缓存
+        await RagHandler.delete_documents_es_milvus(knowledge_file.id, knowledge_file.knowledge_id)
+        summary_generator.clear_checkpoint(knowledge_file.id)
 
-        KnowledgeFileDao.delete_knowledge_file(knowledge_file_id)
+        await KnowledgeFileDao.async_delete_knowledge_file(knowledge_file_id)
 
     @classmethod
     async def select_knowledge_file_by_id(cls, knowledge_file_id):
-        knowledge_file = await KnowledgeFileDao.select_knowledge_file_by_id(knowledge_file_id)[0][0]
-        return knowledge_file
\ No newline at end of file
+        results = await KnowledgeFileDao.async_select_knowledge_file_by_id(knowledge_file_id)
+        if not results:
+            raise ValueError(f"knowledge file: {knowledge_file_id} not exist")
+        return results[0][0]
\ No newline at end of file
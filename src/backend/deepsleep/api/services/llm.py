@@ -127,6 +127,14 @@ class LLMService:
         except Exception as err:
             logger.error(f'get llm by id appear Err: {err}')
 
+    @classmethod
+    async def async_get_llm_by_id(cls, llm_id: str):
+        try:
+            llm = await LLMDao.async_get_llm_by_id(llm_id)
+            return llm
+        except Exception as err:
+            logger.error(f'get llm by id appear Err: {err}')
+
     @classmethod
     def get_one_llm(cls):
         try:
@@ -6,6 +6,7 @@ from deepsleep.services.mcp_openai.mcp_manager import MCPManager
 from deepsleep.core.models.anthropic import DeepAsyncAnthropic
 from deepsleep.api.services.llm import LLMService
 from deepsleep.services.rag_handler import RagHandler
+from deepsleep.database.session import run_sync
 
 
 class MCPChatAgent:
@@ -27,7 +28,7 @@ class MCPChatAgent:
 
     async def init_MCP_Server(self):
         for server_id in self.mcp_servers_id:
-            mcp_server = MCPServerService.get_mcp_server_user(server_id)
+            mcp_server = await run_sync(MCPServerService.get_mcp_server_user, server_id)
             await self.mcp_manager.enter_mcp_server(mcp_server.mcp_server_path, mcp_server.mcp_server_env)
 
         await self.mcp_manager.connect_client()
@@ -73,7 +74,7 @@ class MCPChatAgent:
 
 
     async def _direct_history(self, dialog_id: str, top_k: int):
-        messages = HistoryService.select_history(dialog_id, top_k)
+        messages = await HistoryService.get_recent_history(dialog_id, top_k)
         return messages
 
     async def _retrieval_history(self, user_input: str, dialog_id: str, top_k: int):
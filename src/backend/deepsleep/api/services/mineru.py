@@ -1,45 +1,108 @@
 import os
 import shutil
+import asyncio
 import tempfile
+import multiprocessing
 from pathlib import Path
+from uuid import uuid4
+from concurrent.futures import ProcessPoolExecutor
 
-import fitz
 from loguru import logger
-from magic_pdf.data.data_reader_writer import FileBasedDataReader
-from magic_pdf.tools.cli import ms_office_suffixes, image_suffixes, pdf_suffixes
-from magic_pdf.tools.common import do_parse
-from magic_pdf.utils.office_to_pdf import convert_file_to_pdf
+from deepsleep.settings import app_settings
+from deepsleep.utils.hash import sha256_file
 
 
-def convert_pdf_to_markdown(path, output_dir, method="auto", lang=None, debug_able=False, start_page_id=0, end_page_id=None):
-    os.makedirs(output_dir, exist_ok=True)
-    temp_dir = tempfile.mkdtemp()
+# 以下函数在解析进程中执行，magic_pdf 只在解析进程中导入，API 进程不需要加载模型
+def prepare_pdf(path, temp_dir):
+    """Office 文档和图片先转换成 PDF，返回 PDF 文件路径"""
+    import fitz
+    from magic_pdf.tools.cli import ms_office_suffixes, image_suffixes, pdf_suffixes
+    from magic_pdf.utils.office_to_pdf import convert_file_to_pdf
+
+    path = Path(path)
+    if path.suffix in ms_office_suffixes:
+        convert_file_to_pdf(str(path), temp_dir)
+        fn = os.path.join(temp_dir, f"{path.stem}.pdf")
+    elif path.suffix in image_suffixes:
+        with open(str(path), 'rb') as f:
+            bits = f.read()
+        pdf_bytes = fitz.open(stream=bits).convert_to_pdf()
+        fn = os.path.join(temp_dir, f"{path.stem}.pdf")
+        with open(fn, 'wb') as f:
+            f.write(pdf_bytes)
+    elif path.suffix in pdf_suffixes:
+        fn = str(path)
+    else:
+        raise Exception(f"Unknown file suffix: {path.suffix}")
+    return fn
+
+
+def count_pdf_pages(pdf_path):
+    import fitz
+
+    with fitz.open(pdf_path) as document:
+        return document.page_count
+
 
+def convert_page_range(pdf_path, output_dir, file_name, method, lang, start_page_id, end_page_id):
+    """转换 [start_page_id, end_page_id] 范围内的页面，返回 Markdown 和图片所在的目录"""
+    from magic_pdf.data.data_reader_writer import FileBasedDataReader
+    from magic_pdf.tools.common import do_parse
 
-    def read_fn(path: Path):
-        if path.suffix in ms_office_suffixes:
-            convert_file_to_pdf(str(path), temp_dir)
-            fn = os.path.join(temp_dir, f"{path.stem}.pdf")
-        elif path.suffix in image_suffixes:
-            with open(str(path), 'rb') as f:
-                bits = f.read()
-            pdf_bytes = fitz.open(stream=bits).convert_to_pdf()
-            fn = os.path.join(temp_dir, f"{path.stem}.pdf")
-            with open(fn, 'wb') as f:
-                f.write(pdf_bytes)
-        elif path.suffix in pdf_suffixes:
-            fn = str(path)
-        else:
-            raise Exception(f"Unknown file suffix: {path.suffix}")
+    disk_rw = FileBasedDataReader(os.path.dirname(pdf_path))
+    pdf_data = disk_rw.read(os.path.basename(pdf_path))
+    do_parse(
+        output_dir,
+        file_name,
+        pdf_data,
+        [],
+        method,
+        False,
+        start_page_id=start_page_id,
+        end_page_id=end_page_id,
+        lang=lang
+    )
+    return os.path.join(output_dir, file_name, method)
 
-        disk_rw = FileBasedDataReader(os.path.dirname(fn))
-        return disk_rw.read(os.path.basename(fn))
+
+def merge_page_ranges(part_dirs, output_dir, file_name):
+    """按页码顺序合并各个分段的 Markdown，图片统一移动到 images 目录"""
+    images_dir = os.path.join(output_dir, "images")
+    os.makedirs(images_dir, exist_ok=True)
+
+    markdown_path = os.path.join(output_dir, f"{file_name}.md")
+    with open(markdown_path, 'w', encoding='utf-8') as out:
+        for part_dir in part_dirs:
+            part_name = os.path.basename(os.path.dirname(part_dir))
+            part_markdown = os.path.join(part_dir, f"{part_name}.md")
+            if os.path.exists(part_markdown):
+                with open(part_markdown, 'r', encoding='utf-8') as f:
+                    shutil.copyfileobj(f, out)
+                out.write("\n\n")
+
+            # MinerU 的图片以内容 hash 命名，不同分段之间不会重名
+            part_images = os.path.join(part_dir, "images")
+            if os.path.isdir(part_images):
+                for image in os.listdir(part_images):
+                    shutil.move(os.path.join(part_images, image), os.path.join(images_dir, image))
+    return markdown_path
+
+
+def convert_pdf_to_markdown(path, output_dir, method="auto", lang=None, debug_able=False, start_page_id=0, end_page_id=None):
+    from magic_pdf.data.data_reader_writer import FileBasedDataReader
+    from magic_pdf.tools.cli import ms_office_suffixes, image_suffixes, pdf_suffixes
+    from magic_pdf.tools.common import do_parse
+
+    os.makedirs(output_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp()
 
 
     def parse_doc(doc_path: Path):
         try:
             file_name = str(Path(doc_path).stem)
-            pdf_data = read_fn(doc_path)
+            fn = prepare_pdf(doc_path, temp_dir)
+            disk_rw = FileBasedDataReader(os.path.dirname(fn))
+            pdf_data = disk_rw.read(os.path.basename(fn))
             do_parse(
                 output_dir,
                 file_name,
@@ -66,5 +129,126 @@ def convert_pdf_to_markdown(path, output_dir, method="auto", lang=None, debug_ab
     shutil.rmtree(temp_dir)
 
 
-if __name__ == '__main__':
-    convert_pdf_to_markdown()
\ No newline at end of file
+class MineruService:
+    """
+    MinerU 文档转换服务：
+    1. 转换任务在有界的进程池中执行，不占用 API 进程
+    2. 大文件按页拆分成多个任务并行转换，完成一段返回一段进度
+    3. 转换结果按文件内容 hash 缓存，相同文件不会重复转换
+    """
+    def __init__(self):
+        self.workers = app_settings.mineru.get('workers', 2)
+        self.pages_per_task = app_settings.mineru.get('pages_per_task', 16)
+        self.method = app_settings.mineru.get('method', 'auto')
+        self.cache_dir = app_settings.mineru.get('cache_dir', 'deepsleep/data/mineru_cache')
+        self.executor = None
+        # 等待进程池中仍在运行的页面转换结束后再删除临时目录的后台任务
+        self._cleanup_tasks = set()
+
+    def _get_executor(self):
+        if self.executor is None:
+            # 每个进程只加载一次模型，spawn 避免 fork 复制 API 进程的线程状态
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+            logger.info(f"MinerU pool start {self.workers} processes")
+        return self.executor
+
+    def page_ranges(self, pages):
+        return [(start, min(start + self.pages_per_task, pages) - 1)
+                for start in range(0, pages, self.pages_per_task)]
+
+    async def iter_convert(self, file_path, method=None, lang=None):
+        """
+        转换文档并逐段返回进度：
+            {"event": "start", "pages": ..., "tasks": ...}
+            {"event": "page", "start_page": ..., "end_page": ..., "done_pages": ..., "pages": ...}
+            {"event": "done", "cached": bool, "markdown_path": ..., "images_dir": ...}
+        """
+        method = method or self.method
+        content_hash = await asyncio.to_thread(sha256_file, file_path)
+        cache_key = f"{content_hash}_{method}_{lang or 'auto'}"
+        cache_dir = os.path.join(self.cache_dir, cache_key)
+        markdown_path = os.path.join(cache_dir, f"{content_hash}.md")
+
+        if os.path.exists(markdown_path):
+            logger.info(f"MinerU cache hit: {file_path}")
+            yield {"event": "done", "cached": True, "markdown_path": markdown_path,
+                   "images_dir": os.path.join(cache_dir, "images")}
+            return
+
+        executor = self._get_executor()
+        temp_dir = tempfile.mkdtemp()
+        tasks = []
+        # 提交到进程池的任务，客户端断开时取消还没开始的，已经在运行的需要等待结束
+        futures = []
+
+        def submit(fn, *args):
+            future = executor.submit(fn, *args)
+            futures.append(future)
+            return asyncio.wrap_future(future)
+
+        try:
+            pdf_path = await submit(prepare_pdf, file_path, temp_dir)
+            pages = await asyncio.to_thread(count_pdf_pages, pdf_path)
+            ranges = self.page_ranges(pages)
+            yield {"event": "start", "pages": pages, "tasks": len(ranges)}
+
+            async def run(index, start_page, end_page):
+                part_dir = await submit(convert_page_range, pdf_path, temp_dir,
+                                        f"part_{index}", method, lang, start_page, end_page)
+                return index, start_page, end_page, part_dir
+
+            tasks = [asyncio.create_task(run(index, start_page, end_page))
+                     for index, (start_page, end_page) in enumerate(ranges)]
+            part_dirs = [None] * len(ranges)
+            done_pages = 0
+            for task in asyncio.as_completed(tasks):
+                index, start_page, end_page, part_dir = await task
+                part_dirs[index] = part_dir
+                done_pages += end_page - start_page + 1
+                yield {"event": "page", "start_page": start_page, "end_page": end_page,
+                       "done_pages": done_pages, "pages": pages}
+
+            # 先写到临时目录再改名，避免并发转换同一个文件时读到不完整的缓存
+            build_dir = f"{cache_dir}.{uuid4().hex}"
+            await asyncio.to_thread(merge_page_ranges, part_dirs, build_dir, content_hash)
+            try:
+                os.rename(build_dir, cache_dir)
+            except OSError:
+                shutil.rmtree(build_dir, ignore_errors=True)
+
+            yield {"event": "done", "cached": False, "markdown_path": markdown_path,
+                   "images_dir": os.path.join(cache_dir, "images")}
+        finally:
+            for task in tasks:
+                task.cancel()
+            # cancel 只能取消还在排队的任务，正在运行的进程仍然会写入临时目录
+            running = [future for future in futures if not future.cancel() and not future.done()]
+            if running:
+                cleanup = asyncio.create_task(self._remove_after(running, temp_dir))
+                self._cleanup_tasks.add(cleanup)
+                cleanup.add_done_callback(self._cleanup_tasks.discard)
+            else:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+    @staticmethod
+    async def _remove_after(futures, temp_dir):
+        await asyncio.wait([asyncio.wrap_future(future) for future in futures])
+        logger.info(f"MinerU abandoned {len(futures)} running tasks finished, remove {temp_dir}")
+        await asyncio.to_thread(shutil.rmtree, temp_dir, True)
+
+    async def convert(self, file_path, method=None, lang=None):
+        """转换文档，返回 Markdown 文件路径"""
+        markdown_path = None
+        async for event in self.iter_convert(file_path, method, lang):
+            if event["event"] == "done":
+                markdown_path = event["markdown_path"]
+        return markdown_path
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+mineru_service = MineruService()
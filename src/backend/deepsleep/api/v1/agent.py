@@ -8,6 +8,7 @@ from deepsleep.api.services.user import UserPayload, get_login_user
 from typing import List
 from loguru import logger
 from uuid import uuid4
+from deepsleep.database.session import run_sync
 
 router = APIRouter()
 
@@ -23,7 +24,7 @@ async def create_agent(name: str = Form(...),
                        login_user: UserPayload = Depends(get_login_user)):
     try:
         # 判断Agent名字是否重复
-        if AgentService.check_repeat_name(name=name, user_id=login_user.user_id):
+        if await run_sync(AgentService.check_repeat_name, name=name, user_id=login_user.user_id):
             return resp_500(message="The Agent name is repeated, please change it")
 
         uid = uuid4().hex
@@ -34,15 +35,15 @@ async def create_agent(name: str = Form(...),
         else:
             logo = app_settings.logo.get('agent')
 
-        AgentService.create_agent(name=name,
-                                  description=description,
-                                  logo=logo,
-                                  tools_id=tools_id,
-                                  llm_id=llm_id,
-                                  mcp_ids=mcp_ids,
-                                  user_id=login_user.user_id,
-                                  knowledges_id=knowledges_id,
-                                  use_embedding=use_embedding)
+        await run_sync(AgentService.create_agent, name=name,
+                       description=description,
+                       logo=logo,
+                       tools_id=tools_id,
+                       llm_id=llm_id,
+                       mcp_ids=mcp_ids,
+                       user_id=login_user.user_id,
+                       knowledges_id=knowledges_id,
+                       use_embedding=use_embedding)
         return resp_200()
     except Exception as err:
         logger.error(f"create agent API error: {err}")
@@ -52,7 +53,7 @@ async def create_agent(name: str = Form(...),
 @router.get("/agent", response_model=UnifiedResponseModel)
 async def get_agent(login_user: UserPayload = Depends(get_login_user)):
     try:
-        data = AgentService.get_all_agent_by_user_id(user_id=login_user.user_id)
+        data = await run_sync(AgentService.get_all_agent_by_user_id, user_id=login_user.user_id)
         result = []
         for item in data:
             result.append({"id": item.id,
@@ -76,7 +77,7 @@ async def get_agent(login_user: UserPayload = Depends(get_login_user)):
 async def delete_agent(agent_id: str = Form(...),
                        login_user: UserPayload = Depends(get_login_user)):
     try:
-        return AgentService.delete_agent_by_id(id=agent_id, user_id=login_user.user_id)
+        return await run_sync(AgentService.delete_agent_by_id, id=agent_id, user_id=login_user.user_id)
     except Exception as err:
         logger.error(f"delete agent API error: {err}")
         return resp_500(message=str(err))
@@ -94,7 +95,7 @@ async def update_agent(agent_id: str = Form(...),
                        logoFile: UploadFile = File(None),
                        login_user: UserPayload = Depends(get_login_user)):
     try:
-        if name and AgentService.check_repeat_name(name, login_user.user_id):
+        if name and await run_sync(AgentService.check_repeat_name, name, login_user.user_id):
             return resp_500(message='agent name repeated')
 
         uid = uuid4().hex
@@ -105,16 +106,16 @@ async def update_agent(agent_id: str = Form(...),
         else:
             logo = None
 
-        return AgentService.update_agent_by_id(id=agent_id,
-                                        name=name,
-                                        description=description,
-                                        logo=logo,
-                                        knowledges_id=knowledges_id,
-                                        user_id=login_user.user_id,
-                                        tools_id=tools_id,
-                                        llm_id=llm_id,
-                                        mcp_ids=mcp_ids,
-                                        use_embedding=use_embedding)
+        return await run_sync(AgentService.update_agent_by_id, id=agent_id,
+                              name=name,
+                              description=description,
+                              logo=logo,
+                              knowledges_id=knowledges_id,
+                              user_id=login_user.user_id,
+                              tools_id=tools_id,
+                              llm_id=llm_id,
+                              mcp_ids=mcp_ids,
+                              use_embedding=use_embedding)
 
     except Exception as err:
         logger.error(f"update agent API error: {err}")
@@ -125,7 +126,7 @@ async def update_agent(agent_id: str = Form(...),
 async def search_agent(name: str = Form(...),
                        login_user: UserPayload = Depends(get_login_user)):
     try:
-        data = AgentService.search_agent_name(name=name, user_id=login_user.user_id)
+        data = await run_sync(AgentService.search_agent_name, name=name, user_id=login_user.user_id)
         result = []
         for item in data:
             result.append({"id": item.id,
@@ -17,6 +17,7 @@ async def chat(file: UploadFile = File(None),
     """与助手进行对话"""
 
     chat_client = ChatClient(dialog_id=dialog_id)
+    await chat_client.init_chat_service()
 
     if file:
         file_path = await save_upload_file(file)
@@ -36,5 +37,5 @@ async def chat(file: UploadFile = File(None),
     # 将用户问题存放到MySQL数据库
     await HistoryService.save_chat_history("user", user_input, dialog_id)
     # 更新对话窗口的最近使用时间
-    DialogService.update_dialog_time(dialog_id=dialog_id)
+    await DialogService.update_dialog_time(dialog_id=dialog_id)
     return StreamingResponse(general_generate(), media_type="text/event-stream")
@@ -12,10 +12,10 @@ router = APIRouter()
 @router.get("/dialog/list", response_model=UnifiedResponseModel)
 async def get_dialog(login_user: UserPayload = Depends(get_login_user)):
     try:
-        data = DialogService.get_list_dialog(user_id=login_user.user_id)
+        data = await DialogService.get_list_dialog(user_id=login_user.user_id)
         result = []
         for msg in data:
-            msg_agent = AgentService.select_agent_by_id(agent_id=msg.agent_id)
+            msg_agent = await AgentService.async_select_agent_by_id(agent_id=msg.agent_id)
             result.append({"name": msg.name,
                            "user_id": msg.user_id,
                            "agent_id": msg.agent_id,
@@ -36,7 +36,7 @@ async def create_dialog(name: str = Body(description='对话Agent名称'),
                         agent_type: str = Body(description="Agent的类型，仅支持MCPAgent or Agent"),
                         login_user: UserPayload = Depends(get_login_user)):
     try:
-        dialog_id = DialogService.create_dialog(name=name, agent_id=agent_id, agent_type=agent_type,
+        dialog_id = await DialogService.create_dialog(name=name, agent_id=agent_id, agent_type=agent_type,
                                                 user_id=login_user.user_id)
         return resp_200(data={"dialog_id": dialog_id})
     except Exception as err:
@@ -47,7 +47,7 @@ async def create_dialog(name: str = Body(description='对话Agent名称'),
 @router.delete("/dialog", response_model=UnifiedResponseModel)
 async def delete_dialog(dialog_id: str = Body(description='对话ID')):
     try:
-        DialogService.delete_dialog(dialog_id=dialog_id)
+        await DialogService.delete_dialog(dialog_id=dialog_id)
         return resp_200()
     except Exception as err:
         logger.error(f"delete dialog API error: {err}")
@@ -1,4 +1,6 @@
-from fastapi import Request, APIRouter, Depends
+import json
+from fastapi import Request, APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from deepsleep.api.services.history import HistoryService
 from deepsleep.api.services.user import get_login_user, UserPayload
 from deepsleep.schema.schemas import resp_200, resp_500, UnifiedResponseModel
@@ -12,7 +14,7 @@ async def get_dialog_history(request: Request,
     try:
         body = await request.json()
         dialog_id = body.get('dialog_id')
-        data = HistoryService.get_dialog_history(dialog_id=dialog_id)
+        data = await HistoryService.get_dialog_history(dialog_id=dialog_id)
 
         result = []
         for item in data:
@@ -23,3 +25,33 @@ async def get_dialog_history(request: Request,
     except Exception as err:
         logger.error(f"get dialog history API error: {err}")
         return resp_500(message=str(err))
+
+
+@router.get("/history", response_model=UnifiedResponseModel)
+async def get_history_page(dialog_id: str = Query(description='对话ID'),
+                           limit: int = Query(50, ge=1, le=500, description='每页条数'),
+                           cursor: str = Query(None, description='上一页返回的 next_cursor，为空时从第一条开始'),
+                           login_user: UserPayload = Depends(get_login_user)):
+    try:
+        histories, next_cursor = await HistoryService.get_history_page(dialog_id, limit, cursor)
+        result = [{"role": item.role, "content": item.content, "create_time": item.create_time}
+                  for item in histories]
+        return resp_200(data={"items": result, "next_cursor": next_cursor})
+    except Exception as err:
+        logger.error(f"get history page API error: {err}")
+        return resp_500(message=str(err))
+
+
+@router.get("/history/export", description="按 NDJSON 流式导出一个对话的全部记录")
+async def export_dialog_history(dialog_id: str = Query(description='对话ID'),
+                                login_user: UserPayload = Depends(get_login_user)):
+    async def general_generate():
+        try:
+            async for item in HistoryService.iter_dialog_history(dialog_id):
+                yield json.dumps({"role": item.role, "content": item.content,
+                                  "create_time": item.create_time.isoformat()}, ensure_ascii=False) + "\n"
+        except Exception as err:
+            logger.error(f"export dialog history API error: {err}")
+            yield json.dumps({"error": str(err)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(general_generate(), media_type="application/x-ndjson")
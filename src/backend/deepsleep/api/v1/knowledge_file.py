@@ -22,8 +22,34 @@ async def upload_file(knowledge_id: str = Body(...),
             oss_client.upload_local_file(object_name, file_path)
         else:
             object_name = None
-        await KnowledgeFileService.create_knowledge_file(file_path, knowledge_id, login_user.user_id, object_name)
-        return resp_200()
+        job = await KnowledgeFileService.create_knowledge_file(file_path, knowledge_id, login_user.user_id, object_name)
+        return resp_200(data=job)
+    except Exception as err:
+        return resp_500(message=str(err))
+
+@router.put('/knowledge_file/update', response_model=UnifiedResponseModel)
+async def update_file(knowledge_file_id: str = Body(...),
+                      file: UploadFile = File(...),
+                      login_user: UserPayload = Depends(get_login_user)):
+    try:
+        knowledge_file = await KnowledgeFileService.select_knowledge_file_by_id(knowledge_file_id)
+        file_path = await save_upload_file(file)
+        if app_settings.use_oss:
+            object_name = await get_oss_object_name(file_path, knowledge_file.knowledge_id)
+            oss_client.upload_local_file(object_name, file_path)
+        else:
+            object_name = None
+        job = await KnowledgeFileService.update_knowledge_file(knowledge_file_id, file_path, object_name)
+        return resp_200(data=job)
+    except Exception as err:
+        return resp_500(message=str(err))
+
+@router.get('/knowledge_file/status', response_model=UnifiedResponseModel)
+async def get_knowledge_file_status(job_id: str,
+                                    login_user: UserPayload = Depends(get_login_user)):
+    try:
+        result = await KnowledgeFileService.get_ingest_status(job_id)
+        return resp_200(data=result)
     except Exception as err:
         return resp_500(message=str(err))
 
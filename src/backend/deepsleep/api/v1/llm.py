@@ -5,6 +5,7 @@ from deepsleep.api.services.user import get_login_user, UserPayload
 from deepsleep.schema.schemas import UnifiedResponseModel, resp_200
 
 from deepsleep.api.services.llm import LLMService, Function_Call_provider, React_provider, LLM_Types
+from deepsleep.database.session import run_sync
 
 router = APIRouter()
 
@@ -16,13 +17,13 @@ async def create_llm(model: str = Body(description='大模型的名称'),
                      provider: str = Body(description='大模型的提供商'),
                      login_user: UserPayload = Depends(get_login_user)):
 
-    return LLMService.create_llm(model=model, api_key=api_key, base_url=base_url,
-                                 user_id=login_user.user_id, provider=provider, llm_type=llm_type)
+    return await run_sync(LLMService.create_llm, model=model, api_key=api_key, base_url=base_url,
+                          user_id=login_user.user_id, provider=provider, llm_type=llm_type)
 
 @router.delete('/llm/delete', response_model=UnifiedResponseModel)
 async def delete_llm(llm_id: str = Body(embed=True, description='大模型的ID'),
                      login_user: UserPayload = Depends(get_login_user)):
-    return LLMService.delete_llm(llm_id=llm_id, user_id=login_user.user_id)
+    return await run_sync(LLMService.delete_llm, llm_id=llm_id, user_id=login_user.user_id)
 
 @router.put('/llm/update', response_model=UnifiedResponseModel)
 async def update_llm(model: Optional[str] = Body(description='大模型的名称'),
@@ -33,20 +34,20 @@ async def update_llm(model: Optional[str] = Body(description='大模型的名称
                      llm_id: str = Body(description='大模型的ID'),
                      login_user: UserPayload = Depends(get_login_user)):
 
-    return LLMService.update_llm(user_id=login_user.user_id, model=model, api_key=api_key,
-                                 llm_id=llm_id, provider=provider, base_url=base_url, llm_type=llm_type)
+    return await run_sync(LLMService.update_llm, user_id=login_user.user_id, model=model, api_key=api_key,
+                          llm_id=llm_id, provider=provider, base_url=base_url, llm_type=llm_type)
 
 @router.get('/llm/all', response_model=UnifiedResponseModel)
 async def get_all_llm(login_user: UserPayload = Depends(get_login_user)):
-    return LLMService.get_all_llm()
+    return await run_sync(LLMService.get_all_llm)
 
 @router.post('/llm/personal', response_model=UnifiedResponseModel)
 async def get_personal_llm(login_user: UserPayload = Depends(get_login_user)):
-    return LLMService.get_personal_llm(user_id=login_user.user_id)
+    return await run_sync(LLMService.get_personal_llm, user_id=login_user.user_id)
 
 @router.post('/llm/visible', response_model=UnifiedResponseModel)
 async def get_visible_llm(login_user: UserPayload = Depends(get_login_user)):
-    return LLMService.get_visible_llm(user_id=login_user.user_id)
+    return await run_sync(LLMService.get_visible_llm, user_id=login_user.user_id)
 
 @router.get('/llm/provider', response_model=UnifiedResponseModel)
 async def get_provider(login_user: UserPayload = Depends(get_login_user)):
@@ -8,6 +8,7 @@ from deepsleep.api.services.user import UserPayload, get_login_user
 from typing import List
 from loguru import logger
 from uuid import uuid4
+from deepsleep.database.session import run_sync
 
 router = APIRouter()
 
@@ -23,7 +24,7 @@ async def create_mcp_agent(name: str = Form(...),
                            login_user: UserPayload = Depends(get_login_user)):
     try:
         # 判断Agent名字是否重复
-        if MCPAgentService.check_repeat_name(name=name, user_id=login_user.user_id):
+        if await run_sync(MCPAgentService.check_repeat_name, name=name, user_id=login_user.user_id):
             return resp_500(message="The Agent name is repeated, please change it")
 
         uid = uuid4().hex
@@ -34,14 +35,14 @@ async def create_mcp_agent(name: str = Form(...),
         else:
             logo = app_settings.logo.get('mcp_agent')
 
-        MCPAgentService.create_mcp_agent(name=name,
-                                         description=description,
-                                         logo=logo,
-                                         mcp_servers_id=mcp_servers_id,
-                                         llm_id=llm_id,
-                                         user_id=login_user.user_id,
-                                         knowledges_id=knowledges_id,
-                                         use_embedding=use_embedding)
+        await run_sync(MCPAgentService.create_mcp_agent, name=name,
+                       description=description,
+                       logo=logo,
+                       mcp_servers_id=mcp_servers_id,
+                       llm_id=llm_id,
+                       user_id=login_user.user_id,
+                       knowledges_id=knowledges_id,
+                       use_embedding=use_embedding)
         return resp_200()
     except Exception as err:
         logger.error(f"create agent API error: {err}")
@@ -51,7 +52,7 @@ async def create_mcp_agent(name: str = Form(...),
 @router.get("/mcp_agent", response_model=UnifiedResponseModel)
 async def get_mcp_agent(login_user: UserPayload = Depends(get_login_user)):
     try:
-        data = MCPAgentService.get_all_mcp_agent_by_user(user_id=login_user.user_id)
+        data = await run_sync(MCPAgentService.get_all_mcp_agent_by_user, user_id=login_user.user_id)
         result = []
         for item in data:
             result.append({"id": item.id,
@@ -74,7 +75,7 @@ async def get_mcp_agent(login_user: UserPayload = Depends(get_login_user)):
 async def delete_mcp_agent(agent_id: str = Form(...),
                            login_user: UserPayload = Depends(get_login_user)):
     try:
-        return MCPAgentService.delete_mcp_agent_by_id(id=agent_id, user_id=login_user.user_id)
+        return await run_sync(MCPAgentService.delete_mcp_agent_by_id, id=agent_id, user_id=login_user.user_id)
     except Exception as err:
         logger.error(f"delete agent API error: {err}")
         return resp_500(message=str(err))
@@ -91,7 +92,7 @@ async def update_mcp_agent(agent_id: str = Form(...),
                            logoFile: UploadFile = File(None),
                            login_user: UserPayload = Depends(get_login_user)):
     try:
-        if name and MCPAgentService.check_repeat_name(name, login_user.user_id):
+        if name and await run_sync(MCPAgentService.check_repeat_name, name, login_user.user_id):
             return resp_500(message='agent name repeated')
 
         uid = uuid4().hex
@@ -102,15 +103,15 @@ async def update_mcp_agent(agent_id: str = Form(...),
         else:
             logo = None
 
-        return MCPAgentService.update_mcp_agent_by_id(id=agent_id,
-                                                      name=name,
-                                                      description=description,
-                                                      logo=logo,
-                                                      knowledges_id=knowledges_id,
-                                                      user_id=login_user.user_id,
-                                                      mcp_servers_id=mcp_servers_id,
-                                                      llm_id=llm_id,
-                                                      use_embedding=use_embedding)
+        return await run_sync(MCPAgentService.update_mcp_agent_by_id, id=agent_id,
+                              name=name,
+                              description=description,
+                              logo=logo,
+                              knowledges_id=knowledges_id,
+                              user_id=login_user.user_id,
+                              mcp_servers_id=mcp_servers_id,
+                              llm_id=llm_id,
+                              use_embedding=use_embedding)
 
     except Exception as err:
         logger.error(f"update agent API error: {err}")
@@ -121,7 +122,7 @@ async def update_mcp_agent(agent_id: str = Form(...),
 async def search_mcp_agent(name: str = Form(...),
                            login_user: UserPayload = Depends(get_login_user)):
     try:
-        data = MCPAgentService.search_mcp_agent_name(name=name, user_id=login_user.user_id)
+        data = await run_sync(MCPAgentService.search_mcp_agent_name, name=name, user_id=login_user.user_id)
         result = []
         for item in data:
             result.append({"id": item.id,
@@ -5,6 +5,7 @@ from deepsleep.api.services.user import UserPayload, get_login_user
 from deepsleep.schema.schemas import resp_500, resp_200
 from deepsleep.services.mcp.manager import MCPManager
 from loguru import logger
+from deepsleep.database.session import run_sync
 
 router = APIRouter()
 
@@ -28,8 +29,8 @@ async def create_mcp_server(mcp_server_name: str = Body(..., description="MCP Se
         for key, tools in tools_params.items():
             for tool in tools:
                 tools_name_str.append(tool["name"])
-        MCPService.create_mcp_server(mcp_server_name, login_user.user_id, login_user.user_name,
-                                     url, type, config, ",".join(tools_name_str), tools_params)
+        await run_sync(MCPService.create_mcp_server, mcp_server_name, login_user.user_id, login_user.user_name,
+                       url, type, config, ",".join(tools_name_str), tools_params)
         return resp_200()
     except Exception as err:
         logger.error(err)
@@ -39,7 +40,7 @@ async def create_mcp_server(mcp_server_name: str = Body(..., description="MCP Se
 @router.get("/mcp_server")
 async def get_mcp_servers(login_user: UserPayload = Depends(get_login_user)):
     try:
-        mcp_servers = MCPService.get_all_servers(login_user.user_id)
+        mcp_servers = await run_sync(MCPService.get_all_servers, login_user.user_id)
         return resp_200(data=mcp_servers)
     except Exception as err:
         logger.error(err)
@@ -49,7 +50,7 @@ async def get_mcp_servers(login_user: UserPayload = Depends(get_login_user)):
 async def delete_mcp_server(mcp_server_id: str = Body(..., description="MCP Server 的ID"),
                             login_user: UserPayload = Depends(get_login_user)):
     try:
-        MCPService.delete_server_from_id(mcp_server_id)
+        await run_sync(MCPService.delete_server_from_id, mcp_server_id)
         return resp_200()
     except Exception as err:
         logger.error(err)
@@ -4,6 +4,7 @@ from loguru import logger
 from deepsleep.api.services.mcp_stdio_server import MCPServerService
 from deepsleep.api.services.user import UserPayload, get_login_user
 from deepsleep.schema.schemas import resp_200, resp_500
+from deepsleep.database.session import run_sync
 
 router = APIRouter()
 
@@ -16,8 +17,8 @@ async def create_mcp_server(
         mcp_server_command: str = Body(),
         login_user: UserPayload = Depends(get_login_user)):
     try:
-        MCPServerService.create_mcp_server(name, mcp_server_path,
-                                           login_user.user_id, mcp_server_command, mcp_server_env)
+        await run_sync(MCPServerService.create_mcp_server, name, mcp_server_path,
+                       login_user.user_id, mcp_server_command, mcp_server_env)
         return resp_200()
     except Exception as err:
         logger.error(f"Create MCP Server Error: {err}")
@@ -27,7 +28,7 @@ async def create_mcp_server(
 @router.get("/mcp_stdio_server")
 async def get_mcp_servers(login_user: UserPayload = Depends(get_login_user)):
     try:
-        mcp_servers = MCPServerService.get_mcp_servers(login_user.user_id)
+        mcp_servers = await run_sync(MCPServerService.get_mcp_servers, login_user.user_id)
         results = []
         for server in mcp_servers:
             results.append({
@@ -49,7 +50,7 @@ async def get_mcp_servers(login_user: UserPayload = Depends(get_login_user)):
 async def delete_mcp_server(mcp_server_id: str = Body(embed=True),
                             login_user: UserPayload = Depends(get_login_user)):
     try:
-        MCPServerService.delete_mcp_server(login_user.user_id, mcp_server_id)
+        await run_sync(MCPServerService.delete_mcp_server, login_user.user_id, mcp_server_id)
         return resp_200()
     except Exception as err:
         logger.error(f"Delete MCP Server Error: {err}")
@@ -65,8 +66,8 @@ async def update_mcp_server(
         mcp_server_env: str = Body(None),
         login_user: UserPayload = Depends(get_login_user)):
     try:
-        MCPServerService.update_mcp_server(mcp_server_id, mcp_server_path, name,
-                                           login_user.user_id, mcp_server_command, mcp_server_env)
+        await run_sync(MCPServerService.update_mcp_server, mcp_server_id, mcp_server_path, name,
+                       login_user.user_id, mcp_server_command, mcp_server_env)
         return resp_200()
     except Exception as err:
         logger.error(f"Update MCP Server Error: {err}")
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Request
 from deepsleep.api.services.message import MessageLikeService, MessageDownService
 from deepsleep.schema.schemas import resp_200
+from deepsleep.database.session import run_sync
 
 router = APIRouter()
 
@@ -11,8 +12,8 @@ async def insert_message_like(request: Request):
 
     user_input = body.get('user_input')
     agent_output = body.get('agent_output')
-    MessageLikeService.create_message_like(user_input=user_input,
-                                           agent_output=agent_output)
+    await run_sync(MessageLikeService.create_message_like, user_input=user_input,
+                   agent_output=agent_output)
 
     return resp_200()
 
@@ -23,8 +24,8 @@ async def insert_message_down(request: Request):
 
     user_input = body.get('user_input')
     agent_output = body.get('agent_output')
-    MessageDownService.create_message_down(user_input=user_input,
-                                           agent_output=agent_output)
+    await run_sync(MessageDownService.create_message_down, user_input=user_input,
+                   agent_output=agent_output)
 
     return resp_200()
 
@@ -1,13 +1,39 @@
+import os
+import json
+import shutil
+from pathlib import Path
+
 from fastapi import APIRouter, UploadFile, Form, File, Depends
+from fastapi.responses import StreamingResponse
+from loguru import logger
 
+from deepsleep.api.services.mineru import mineru_service
+from deepsleep.api.services.knowledge_file import KnowledgeFileService
 from deepsleep.api.services.user import UserPayload, get_login_user
-from deepsleep.schema.schemas import UnifiedResponseModel
+from deepsleep.utils.file_utils import save_upload_file
 
-router = APIRouter
+router = APIRouter()
 
-@router.post("/doc_parse", response_model=UnifiedResponseModel)
+@router.post("/doc_parse", description="使用 MinerU 将 PDF 转换为 Markdown，按 NDJSON 逐段返回转换进度")
 async def doc_parse(file: UploadFile = File(...),
-                    knowledge_id: str = Form(...),
-                    output_dir: str = Form(...),
+                    knowledge_id: str = Form(None),
+                    method: str = Form("auto"),
+                    lang: str = Form(None),
                     login_user: UserPayload = Depends(get_login_user)):
-    pass
\ No newline at end of file
+    file_path = await save_upload_file(file)
+
+    async def general_generate():
+        try:
+            async for event in mineru_service.iter_convert(file_path, method, lang):
+                # 传入知识库ID时，转换完成后提交知识库文件的解析任务
+                if event["event"] == "done" and knowledge_id:
+                    markdown_path = os.path.join(os.path.dirname(file_path), f"{Path(file_path).stem}.md")
+                    shutil.copyfile(event["markdown_path"], markdown_path)
+                    event["job"] = await KnowledgeFileService.create_knowledge_file(
+                        markdown_path, knowledge_id, login_user.user_id, None)
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as err:
+            logger.error(f"doc parse error: {err}")
+            yield json.dumps({"event": "error", "message": str(err)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(general_generate(), media_type="application/x-ndjson")
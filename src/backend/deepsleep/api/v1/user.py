@@ -14,6 +14,7 @@ from deepsleep.schema.schemas import UnifiedResponseModel
 from loguru import logger
 from deepsleep.api.services.user import get_user_jwt
 from deepsleep.utils.constants import USER_CURRENT_SESSION
+from deepsleep.database.session import run_sync
 
 router = APIRouter()
 
@@ -27,19 +28,19 @@ async def register(user_name: str = Body(description='用户名'),
     #         raise HTTPException(status_code=500, detail='验证码错误')
 
 
-    exist_user = UserDao.get_user_by_username(user_name)
+    exist_user = await run_sync(UserDao.get_user_by_username, user_name)
     if exist_user:
         raise HTTPException(status_code=500, detail='用户名重复')
     if len(user_name) > 20:
         raise HTTPException(status_code=500, detail='用户名长度不应该超过20')
     try:
         user_password = UserService.encrypt_sha256_password(user_password)
-        admin = UserDao.get_user(AdminUser)
+        admin = await run_sync(UserDao.get_user, AdminUser)
         if admin:
-            UserDao.add_user_and_default_role(user_name, user_email, user_password)
+            await run_sync(UserDao.add_user_and_default_role, user_name, user_email, user_password)
         else:
             user_id = AdminUser
-            UserDao.add_user_and_admin_role(user_id, user_name, user_email, user_password)
+            await run_sync(UserDao.add_user_and_admin_role, user_id, user_name, user_email, user_password)
     except Exception as e:
         logger.error(f'register user is appear error: {e}')
         raise HTTPException(status_code=500, detail=f'register user is appear error: {e}')
@@ -54,7 +55,7 @@ async def login(user_name: str = Body(description='用户名'),
     #     if not user.captcha_key or not await verify_captcha(user.captcha, user.captcha_key):
     #         raise HTTPException(status_code=500, detail='验证码错误')
 
-    db_user = UserDao.get_user_by_username(user_name)[0]
+    db_user = (await run_sync(UserDao.get_user_by_username, user_name))[0]
     # 检查密码
     if not db_user or not UserService.verify_password(user_password, db_user.user_password):
         return UserValidateError.return_resp()
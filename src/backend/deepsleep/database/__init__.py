@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 from deepsleep.database.models.agent import AgentTable
 from deepsleep.database.models.history import HistoryTable
 from deepsleep.database.models.user import SystemUser
@@ -20,5 +21,39 @@ from dotenv import load_dotenv
 # 加载本地的env
 load_dotenv(override=True)
 
-engine = create_engine(app_settings.mysql.get('endpoint'), connect_args={"charset": "utf8mb4"})
+
+
+def get_pool_options(sync=False):
+    """
+    连接池配置；同步引擎只服务于启动初始化和 run_sync 兼容层，使用单独的较小连接池，
+    避免每个 worker 的最大连接数翻倍
+    """
+    if sync:
+        pool_size = app_settings.mysql.get('sync_pool_size', 5)
+        max_overflow = app_settings.mysql.get('sync_max_overflow', 5)
+    else:
+        pool_size = app_settings.mysql.get('pool_size', 10)
+        max_overflow = app_settings.mysql.get('max_overflow', 20)
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": app_settings.mysql.get('pool_timeout', 30),
+        # MySQL 默认 8 小时断开空闲连接，回收时间要小于 wait_timeout
+        "pool_recycle": app_settings.mysql.get('pool_recycle', 3600),
+        "pool_pre_ping": app_settings.mysql.get('pool_pre_ping', True),
+    }
+
+
+def get_async_endpoint():
+    # 没有单独配置时使用同步地址，驱动换成 aiomysql
+    return app_settings.mysql.get('async_endpoint') or \
+        app_settings.mysql.get('endpoint').replace('mysql+pymysql://', 'mysql+aiomysql://', 1)
+
+
+engine = create_engine(app_settings.mysql.get('endpoint'), connect_args={"charset": "utf8mb4"},
+                       **get_pool_options(sync=True))
+
+# 异步引擎，请求链路上的 DAO 使用，不阻塞事件循环
+async_engine = create_async_engine(get_async_endpoint(), connect_args={"charset": "utf8mb4"},
+                                   **get_pool_options())
 
@@ -6,6 +6,7 @@ from sqlmodel import Session
 from sqlalchemy import select, and_, update, desc, delete
 from deepsleep.utils.helpers import delete_img
 from deepsleep.database import engine
+from deepsleep.database.session import async_session
 
 class AgentDao:
 
@@ -119,6 +120,13 @@ class AgentDao:
             result = session.exec(sql).first()
             return result
 
+    @classmethod
+    async def async_select_agent_by_id(cls, agent_id):
+        async with async_session() as session:
+            sql = select(AgentTable).where(AgentTable.id == agent_id)
+            result = (await session.execute(sql)).first()
+            return result
+
     @classmethod
     def update_agent_by_id(cls, id: str, name: str, description: str, knowledges_id: List[str],
                            logo: str, llm_id: str, tools_id: List[str], use_embedding: bool, mcp_ids: List[str]):
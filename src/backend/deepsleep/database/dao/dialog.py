@@ -2,6 +2,7 @@ from deepsleep.database.models.dialog import DialogTable
 from sqlmodel import Session
 from sqlalchemy import select, update, desc, delete
 from deepsleep.database import engine
+from deepsleep.database.session import async_session
 from datetime import datetime
 
 class DialogDao:
@@ -63,3 +64,47 @@ class DialogDao:
             result = session.exec(sql).all()
 
             return result
+
+    @classmethod
+    async def async_create_dialog(cls, name: str, agent_id: str, agent_type: str, user_id: str):
+        async with async_session() as session:
+            dialog = cls._get_dialog_sql(name, agent_id, agent_type, user_id)
+            session.add(dialog)
+            await session.commit()
+            return dialog.dialog_id
+
+    @classmethod
+    async def async_select_dialog(cls, dialog_id: str):
+        async with async_session() as session:
+            sql = select(DialogTable).where(DialogTable.dialog_id == dialog_id)
+            result = (await session.execute(sql)).all()
+            return result
+
+    @classmethod
+    async def async_get_dialog_by_user(cls, user_id: str):
+        async with async_session() as session:
+            sql = select(DialogTable).where(DialogTable.user_id == user_id).order_by(desc(DialogTable.create_time))
+            result = (await session.execute(sql)).all()
+            return result
+
+    @classmethod
+    async def async_get_agent_by_dialog_id(cls, dialog_id: str):
+        return await cls.async_select_dialog(dialog_id)
+
+    @classmethod
+    async def async_update_dialog_time(cls, dialog_id: str):
+        async with async_session() as session:
+            sql = update(DialogTable).where(DialogTable.dialog_id == dialog_id).values(create_time=datetime.utcnow())
+            await session.execute(sql)
+            await session.commit()
+
+    @classmethod
+    async def async_delete_dialog_by_id(cls, dialog_id: str):
+        async with async_session() as session:
+            sql = delete(DialogTable).where(DialogTable.dialog_id == dialog_id)
+            await session.execute(sql)
+            await session.commit()
+
+    @classmethod
+    async def async_check_dialog_iscustom(cls, dialog_id: str):
+        return await cls.async_select_dialog(dialog_id)
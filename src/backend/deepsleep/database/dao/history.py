@@ -1,7 +1,8 @@
 from deepsleep.database.models.history import HistoryTable
 from sqlmodel import Session
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, desc, and_, or_
 from deepsleep.database import engine
+from deepsleep.database.session import async_session
 
 class HistoryDao:
 
@@ -10,6 +11,22 @@ class HistoryDao:
         history = HistoryTable(content=content, role=role, dialog_id=dialog_id)
         return history
 
+    @classmethod
+    def _latest_history_sql(cls, dialog_id: str, k: int):
+        # 每次最多取当前会话最近的k条历史记录，倒序取出后由调用方翻转成时间正序
+        return select(HistoryTable).where(HistoryTable.dialog_id == dialog_id) \
+            .order_by(desc(HistoryTable.create_time), desc(HistoryTable.id)).limit(k)
+
+    @classmethod
+    def _history_page_sql(cls, dialog_id: str, limit: int, after=None):
+        """按 (create_time, id) 正序的 keyset 分页，after 为上一页最后一条记录的 (create_time, id)"""
+        sql = select(HistoryTable).where(HistoryTable.dialog_id == dialog_id)
+        if after is not None:
+            create_time, history_id = after
+            sql = sql.where(or_(HistoryTable.create_time > create_time,
+                                and_(HistoryTable.create_time == create_time, HistoryTable.id > history_id)))
+        return sql.order_by(HistoryTable.create_time, HistoryTable.id).limit(limit)
+
     @classmethod
     def create_history(cls, role: str, content: str, dialog_id: str):
         with Session(engine) as session:
@@ -19,13 +36,8 @@ class HistoryDao:
     @classmethod
     def select_history(cls, dialog_id: str, k: int):
         with Session(engine) as session:
-            sql = select(HistoryTable).where(HistoryTable.dialog_id == dialog_id)
-            result = session.exec(sql).all()
-
-            # 每次最多取当前会话的k条历史记录
-            if len(result) > k:
-                result = result[-k:]
-            return result
+            result = session.exec(cls._latest_history_sql(dialog_id, k)).all()
+            return result[::-1]
 
     @classmethod
     def get_dialog_history(cls, dialog_id: str):
@@ -39,4 +51,54 @@ class HistoryDao:
         with Session(engine) as session:
             sql = delete(HistoryTable).where(HistoryTable.dialog_id == dialog_id)
             session.exec(sql)
-            session.commit()
\ No newline at end of file
+            session.commit()
+
+    @classmethod
+    async def async_create_history(cls, role: str, content: str, dialog_id: str):
+        async with async_session() as session:
+            session.add(cls._get_history_sql(role, content, dialog_id))
+            await session.commit()
+
+    @classmethod
+    async def async_create_histories(cls, histories):
+        async with async_session() as session:
+            session.add_all(histories)
+            await session.commit()
+
+    @classmethod
+    async def async_select_history(cls, dialog_id: str, k: int):
+        async with async_session() as session:
+            result = (await session.execute(cls._latest_history_sql(dialog_id, k))).all()
+            return result[::-1]
+
+    @classmethod
+    async def async_get_dialog_history(cls, dialog_id: str):
+        async with async_session() as session:
+            sql = select(HistoryTable).where(HistoryTable.dialog_id == dialog_id).order_by(HistoryTable.create_time)
+            result = (await session.execute(sql)).all()
+            return result
+
+    @classmethod
+    async def async_delete_history_by_dialog_id(cls, dialog_id: str):
+        async with async_session() as session:
+            sql = delete(HistoryTable).where(HistoryTable.dialog_id == dialog_id)
+            await session.execute(sql)
+            await session.commit()
+
+    @classmethod
+    async def async_get_history_page(cls, dialog_id: str, limit: int, after=None):
+        async with async_session() as session:
+            result = (await session.execute(cls._history_page_sql(dialog_id, limit, after))).all()
+            return result
+
+    @classmethod
+    async def async_iter_dialog_history(cls, dialog_id: str, batch_size: int = 500):
+        """逐批读取一个对话的全部记录，每批一个短查询，不会一次把长对话全部加载到内存"""
+        after = None
+        while True:
+            rows = await cls.async_get_history_page(dialog_id, batch_size, after)
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1][0].create_time, rows[-1][0].id)
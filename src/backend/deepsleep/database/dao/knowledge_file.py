@@ -1,7 +1,11 @@
+from datetime import datetime
+
+import pytz
 from deepsleep.database import engine
+from deepsleep.database.session import async_session
 from deepsleep.database.models.knowledge_file import KnowledgeFileTable
 from sqlmodel import Session
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, update
 
 class KnowledgeFileDao:
 
@@ -12,6 +16,24 @@ class KnowledgeFileDao:
                                            user_id=user_id, oss_url=oss_url, id=knowledge_file_id))
             session.commit()
 
+    @classmethod
+    def _update_knowledge_file_sql(cls, knowledge_file_id, file_name=None, oss_url=None):
+        # 替换文件时同时更新文件名（与创建时一致，保存的是文件路径）、OSS 地址和更新时间
+        update_values = {
+            'update_time': datetime.now(pytz.timezone('Asia/Shanghai'))
+        }
+        if file_name:
+            update_values['file_name'] = file_name
+        if oss_url:
+            update_values['oss_url'] = oss_url
+        return update(KnowledgeFileTable).where(KnowledgeFileTable.id == knowledge_file_id).values(**update_values)
+
+    @classmethod
+    def update_knowledge_file(cls, knowledge_file_id, file_name=None, oss_url=None):
+        with Session(engine) as session:
+            session.exec(cls._update_knowledge_file_sql(knowledge_file_id, file_name, oss_url))
+            session.commit()
+
     @classmethod
     def delete_knowledge_file(cls, knowledge_file_id):
         with Session(engine) as session:
@@ -26,8 +48,45 @@ class KnowledgeFileDao:
             return results
 
     @classmethod
-    async def select_knowledge_file_by_id(cls, knowledge_file_id):
+    def select_knowledge_file_by_id(cls, knowledge_file_id):
         with Session(engine) as session:
             sql = select(KnowledgeFileTable).where(KnowledgeFileTable.id == knowledge_file_id)
             results = session.exec(sql).all()
             return results
+
+    # 以下为异步版本，供 ingest 回调等运行在事件循环中的调用方使用
+
+    @classmethod
+    async def async_create_knowledge_file(cls, knowledge_file_id, file_name, knowledge_id, user_id, oss_url):
+        async with async_session() as session:
+            session.add(KnowledgeFileTable(file_name=file_name, knowledge_id=knowledge_id,
+                                           user_id=user_id, oss_url=oss_url, id=knowledge_file_id))
+            await session.commit()
+
+    @classmethod
+    async def async_update_knowledge_file(cls, knowledge_file_id, file_name=None, oss_url=None):
+        async with async_session() as session:
+            await session.execute(cls._update_knowledge_file_sql(knowledge_file_id, file_name, oss_url))
+            await session.commit()
+
+    @classmethod
+    async def async_delete_knowledge_file(cls, knowledge_file_id):
+        async with async_session() as session:
+            sql = delete(KnowledgeFileTable).where(KnowledgeFileTable.id == knowledge_file_id)
+            await session.execute(sql)
+            await session.commit()
+
+    @classmethod
+    async def async_select_knowledge_file(cls, knowledge_id):
+        async with async_session() as session:
+            sql = select(KnowledgeFileTable).where(KnowledgeFileTable.knowledge_id == knowledge_id)
+            results = (await session.execute(sql)).all()
+            return results
+
+    @classmethod
+    async def async_select_knowledge_file_by_id(cls, knowledge_file_id):
+        async with async_session() as session:
+            sql = select(KnowledgeFileTable).where(KnowledgeFileTable.id == knowledge_file_id)
+            results = (await session.execute(sql)).all()
+            return results
+
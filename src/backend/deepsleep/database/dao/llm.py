@@ -2,6 +2,7 @@ from sqlmodel import Session
 from sqlalchemy import select, and_, update, desc, delete
 from typing import List
 from deepsleep.database import engine
+from deepsleep.database.session import async_session
 from deepsleep.database.models.llm import LLMTable
 from datetime import datetime
 
@@ -87,3 +88,10 @@ class LLMDao:
             sql = select(LLMTable).where(LLMTable.llm_type == llm_type)
             result = session.exec(sql).all()
             return result
+
+    @classmethod
+    async def async_get_llm_by_id(cls, llm_id: str):
+        async with async_session() as session:
+            sql = select(LLMTable).where(LLMTable.llm_id == llm_id)
+            result = (await session.execute(sql)).first()
+            return result
@@ -2,6 +2,7 @@ import os
 import json
 
 from sqlmodel import SQLModel
+from sqlalchemy import text
 
 from deepsleep.database import engine, SystemUser
 from deepsleep.api.services.agent import AgentService
@@ -20,6 +21,34 @@ def init_database():
     except Exception as err:
         logger.error(f"create mysql table appear error: {err}")
 
+    init_indexes()
+    init_history_time_precision()
+
+
+# create_all 不会给已经存在的表补建索引，升级后的旧表在这里补上
+def init_indexes():
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except Exception as err:
+                logger.error(f"create mysql index {index.name} appear error: {err}")
+
+
+# 旧版本的 history.create_time 只精确到秒，同一秒内的消息顺序不确定，升级为微秒精度
+def init_history_time_precision():
+    try:
+        with engine.begin() as conn:
+            precision = conn.execute(text(
+                "SELECT DATETIME_PRECISION FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'history' AND COLUMN_NAME = 'create_time'"
+            )).scalar()
+            if precision is not None and precision < 6:
+                conn.execute(text("ALTER TABLE history MODIFY create_time DATETIME(6) NOT NULL"))
+                logger.info("upgrade history.create_time to DATETIME(6)")
+    except Exception as err:
+        logger.error(f"upgrade history.create_time precision appear error: {err}")
+
 
 # 初始化默认工具
 def init_default_agent():
@@ -2,7 +2,8 @@ from sqlmodel import Field, SQLModel
 from typing import Literal
 from datetime import datetime
 from uuid import uuid4
-from sqlalchemy import Text, Column
+from sqlalchemy import Text, Column, Index
+from sqlalchemy.dialects.mysql import DATETIME
 import pytz
 
 from deepsleep.database.models.base import SQLModelSerializable
@@ -11,10 +12,14 @@ from deepsleep.database.models.base import SQLModelSerializable
 # 每条消息
 class HistoryTable(SQLModelSerializable, table=True):
     __tablename__ = "history"
+    # 按对话读取最近的记录、分页和导出都走 (dialog_id, create_time) 索引
+    __table_args__ = (Index("idx_history_dialog_time", "dialog_id", "create_time"),)
 
     id: str = Field(default_factory=lambda: uuid4().hex, primary_key=True)
     content: str = Field(sa_column=Column(Text))
     dialog_id: str
     role: str = Literal["assistant", "system", "user"]
-    create_time: datetime = Field(default_factory=lambda: datetime.now(pytz.timezone('Asia/Shanghai')))
+    # 精确到微秒，同一秒内的提问和回答按写入顺序排列，不依赖随机的 id
+    create_time: datetime = Field(default_factory=lambda: datetime.now(pytz.timezone('Asia/Shanghai')),
+                                  sa_column=Column(DATETIME(fsp=6), nullable=False))
 
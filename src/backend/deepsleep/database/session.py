@@ -0,0 +1,39 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel.ext.asyncio.session import AsyncSession
+from deepsleep.database import async_engine
+from deepsleep.settings import app_settings
+
+# commit 之后对象仍然可以读取属性，不会再次触发查询
+async_session_factory = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+@asynccontextmanager
+async def async_session():
+    async with async_session_factory() as session:
+        yield session
+
+
+# run_sync 专用的线程池，不和 Milvus / Redis / Embedding 缓存共用默认线程池；
+# 线程数默认与同步引擎的最大连接数一致，多出的调用在线程池中排队而不是等待数据库连接
+_sync_executor = ThreadPoolExecutor(
+    max_workers=app_settings.mysql.get('sync_workers') or
+    app_settings.mysql.get('sync_pool_size', 5) + app_settings.mysql.get('sync_max_overflow', 5),
+    thread_name_prefix="db-sync")
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    兼容层：还没有异步版本的同步 DAO / Service 方法放到专用线程池中执行，避免阻塞事件循环
+    迁移完成后直接调用对应的 async_ 方法
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_sync_executor, partial(func, *args, **kwargs))
+
+
+def shutdown_sync_executor():
+    _sync_executor.shutdown(wait=True)
@@ -31,6 +31,35 @@ def register_middleware(app: FastAPI):
 
     return app
 
+def register_lifecycle(app: FastAPI):
+    from deepsleep.services.rag.backend import get_lexical_store
+
+    @app.on_event("startup")
+    async def startup():
+        # ES 连接池在应用启动时建立，所有请求共享
+        await get_lexical_store().start()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        from deepsleep.services.ingest import ingest_manager
+        from deepsleep.services.history_writer import history_writer
+        from deepsleep.services.rag.rerank import Reranker
+        from deepsleep.services.rag.doc_split.registry import parser_pool
+        from deepsleep.api.services.mineru import mineru_service
+        from deepsleep.database import engine, async_engine
+        from deepsleep.database.session import shutdown_sync_executor
+
+        # 先写完缓冲区中的聊天记录，再关闭 ES / MySQL 连接
+        await history_writer.stop()
+        await ingest_manager.stop()
+        await Reranker.close()
+        await get_lexical_store().close()
+        parser_pool.shutdown()
+        mineru_service.shutdown()
+        await async_engine.dispose()
+        shutdown_sync_executor()
+        engine.dispose()
+
 def init_config():
     initialize_app_settings()
 
@@ -49,6 +78,7 @@ def create_app():
 
     register_router(app)
     register_middleware(app)
+    register_lifecycle(app)
 
     # 配置 AuthJWT
     @AuthJWT.load_config
@@ -65,7 +95,20 @@ def create_app():
 
     return app
 
-app = create_app()
+_app = None
+
+def get_app():
+    global _app
+    if _app is None:
+        _app = create_app()
+    return _app
+
+def __getattr__(name):
+    # app 在第一次访问时才创建（uvicorn 加载 main:app 时）：
+    # 解析 / MinerU 进程池以 spawn 方式启动，子进程会重新导入 __main__，导入时不能初始化数据库和默认 Agent
+    if name == "app":
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def main():
     import uvicorn
@@ -1 +1,11 @@
-user_query_write = "请把问题转成意思相近的三个问题，输出Json格式 \n {user_input}"
\ No newline at end of file
+user_query_write = "请把问题转成意思相近的三个问题，输出Json格式 \n {user_input}"
+
+user_chunk_summary = """
+你是一个专业的摘要生成助手，请根据以下要求为文本生成一段摘要：
+## 需要总结的文本：
+{content}
+## 要求：
+1. 摘要字数控制在 100 字左右。
+2. 摘要中仅包含文字和字母，不得出现链接或其他特殊符号。
+3. 只输出摘要部分，不准输出 `以下是文本的摘要` 等字段
+"""
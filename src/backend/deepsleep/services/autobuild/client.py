@@ -20,6 +20,7 @@ from deepsleep.api.services.tool import ToolService
 from deepsleep.api.services.user import UserPayload
 from deepsleep.api.services.llm import LLMService, React_provider
 from deepsleep.tools import action_Function_call
+from deepsleep.database.session import run_sync
 
 
 class State(TypedDict):
@@ -84,7 +85,7 @@ class AutoBuildClient:
 
     async def check_model_exist(self):
         # 获得可用的模型
-        llm = LLMService.get_one_llm()
+        llm = await run_sync(LLMService.get_one_llm)
         if llm is None:
             await self.send_message(message='没找到可用的大模型')
             raise ValueError(f'No large models available')
@@ -110,7 +111,7 @@ class AutoBuildClient:
         return resp.content
 
     async def create_agent(self, name: str, description: str):
-        llm = LLMService.get_one_llm()
+        llm = await run_sync(LLMService.get_one_llm)
 
         tools = []
         tools_name = []
@@ -130,11 +131,12 @@ class AutoBuildClient:
         tools_id = []
         for func in funcs:
             # 根据工具名称去查ID
-            tool_id = ToolService.get_id_by_tool_name(func, self.login_user.user_id)
+            tool_id = await run_sync(ToolService.get_id_by_tool_name, func, self.login_user.user_id)
             tools_id.append(tool_id)
             
         
-        AgentService.create_agent(
+        await run_sync(
+            AgentService.create_agent,
             name=name,
             logo='img/agent/assistant.png',
             description=description,
@@ -256,7 +258,7 @@ class AutoBuildClient:
         # LangGraph循环图中的判断条件
         async def check_repeat_name(state):
             """pass"""
-            if AgentService.check_repeat_name(name=state['user_input'], user_id=self.login_user.user_id):
+            if await run_sync(AgentService.check_repeat_name, name=state['user_input'], user_id=self.login_user.user_id):
                 await self.send_message(message='应用名称已经存在，请更换一个应用名称')
                 return 'receive_input_name'
             else:
@@ -0,0 +1,154 @@
+import re
+
+from loguru import logger
+from deepsleep.settings import app_settings
+from deepsleep.utils.cache import TTLLRUCache
+from deepsleep.utils.hash import md5_hash
+
+# 上下文的组成部分，预算不够时按这个顺序优先满足
+SEGMENT_RECALL = "recall"
+SEGMENT_HISTORY = "history"
+SEGMENT_TOOLS = "tools"
+SEGMENT_PRIORITY = [SEGMENT_RECALL, SEGMENT_HISTORY, SEGMENT_TOOLS]
+
+DEFAULT_BUDGET_RATIOS = {SEGMENT_HISTORY: 0.3, SEGMENT_RECALL: 0.5, SEGMENT_TOOLS: 0.2}
+TRUNCATED_MARK = "..."
+CJK_PATTERN = re.compile(r'[　-〿一-鿿＀-￯]')
+
+
+class TokenCounter:
+    """
+    按模型计算 token 数：优先使用 tiktoken，未安装或者不认识的模型使用 cl100k_base；
+    没有 tiktoken 时按字符估算（中文每字 1 个 token，其他字符每 4 个 1 个 token）
+    历史消息、召回文档等稳定的片段在多轮对话中反复出现，计数结果按文本 hash 缓存
+    """
+    _cache = TTLLRUCache(max_size=app_settings.context.get('token_cache_size', 50000))
+
+    def __init__(self, model_name=None):
+        self.encoding = self._get_encoding(model_name)
+        self.encoding_name = self.encoding.name if self.encoding is not None else "estimate"
+
+    @staticmethod
+    def _get_encoding(model_name):
+        try:
+            import tiktoken
+        except ImportError:
+            return None
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except Exception:
+            return tiktoken.get_encoding("cl100k_base")
+
+    @staticmethod
+    def estimate(text):
+        cjk = len(CJK_PATTERN.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def count(self, text):
+        if not text:
+            return 0
+        key = (self.encoding_name, md5_hash(text))
+        tokens = self._cache.get(key)
+        if tokens is None:
+            tokens = len(self.encoding.encode(text)) if self.encoding is not None else self.estimate(text)
+            self._cache.set(key, tokens)
+        return tokens
+
+    def truncate(self, text, max_tokens):
+        """保留开头的 token，连同截断标记不超过 max_tokens；预算放不下标记时只截断不加标记"""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        mark = TRUNCATED_MARK if self.count(TRUNCATED_MARK) < max_tokens else ""
+        keep = max_tokens - self.count(mark)
+        if self.encoding is not None:
+            return self.encoding.decode(self.encoding.encode(text)[:keep]) + mark
+
+        # 按估算的比例截断，再逐步缩短直到连同标记满足预算
+        end = max(1, len(text) * keep // self.count(text))
+        while end > 0 and self.estimate(text[:end] + mark) > max_tokens:
+            end -= max(1, end // 10)
+        return text[:max(end, 0)] + mark
+
+
+class ContextAssembler:
+    """
+    把历史记录、知识库召回和工具结果放进同一个 token 预算：
+    1. 预算按 context.budget_ratios 分给各部分，某部分用不完的预算按优先级（召回 > 历史 > 工具）让给其他部分
+    2. 历史记录超出预算时丢弃最早的消息，召回和工具结果超出预算时截断末尾（召回文档已经按相关性排好序）
+    3. 每轮记录各部分截断前后的 token 数，用于统计 prompt 消耗
+    """
+    def __init__(self, model_name=None):
+        self.model_name = model_name
+        self.counter = TokenCounter(model_name)
+        model_tokens = app_settings.context.get('model_context_tokens') or {}
+        self.max_tokens = model_tokens.get(model_name) or app_settings.context.get('max_context_tokens', 6000)
+        self.ratios = {**DEFAULT_BUDGET_RATIOS, **(app_settings.context.get('budget_ratios') or {})}
+
+    def allocate(self, needs):
+        """needs: {部分: 需要的 token 数}，返回 {部分: 分配的 token 数}"""
+        total_ratio = sum(self.ratios[segment] for segment in needs) or 1
+        budgets = {segment: min(need, int(self.max_tokens * self.ratios[segment] / total_ratio))
+                   for segment, need in needs.items()}
+
+        remaining = self.max_tokens - sum(budgets.values())
+        for segment in SEGMENT_PRIORITY:
+            if segment not in needs or remaining <= 0:
+                continue
+            extra = min(remaining, needs[segment] - budgets[segment])
+            budgets[segment] += extra
+            remaining -= extra
+        return budgets
+
+    def fit_messages(self, messages, budget):
+        """从最新的消息开始保留，放不下的最早消息整条丢弃；最新一条放不下时截断它"""
+        kept, used = [], 0
+        for message in reversed(messages):
+            tokens = self.counter.count(message)
+            if used + tokens > budget:
+                if not kept:
+                    kept.append(self.counter.truncate(message, budget))
+                break
+            kept.append(message)
+            used += tokens
+        return kept[::-1]
+
+    def assemble(self, history=None, recall="", tools=None):
+        """
+        :param history: 按时间正序的历史消息文本列表
+        :param recall: 知识库召回的文本
+        :param tools: 工具调用结果列表，结果为 None 时按空文本处理
+        :return: (history 文本, recall 文本, 与 tools 等长的工具结果文本列表, 本轮的 token 统计)
+        """
+        history = [message for message in (history or []) if message]
+        tools = ["" if result is None else str(result) for result in (tools or [])]
+
+        needs = {SEGMENT_HISTORY: sum(self.counter.count(message) for message in history),
+                 SEGMENT_RECALL: self.counter.count(recall),
+                 SEGMENT_TOOLS: sum(self.counter.count(result) for result in tools)}
+        budgets = self.allocate(needs)
+
+        history = self.fit_messages(history, budgets[SEGMENT_HISTORY])
+        recall = self.counter.truncate(recall, budgets[SEGMENT_RECALL]) if recall else recall
+        # 工具结果平分预算，每个结果截断末尾
+        tool_budget = budgets[SEGMENT_TOOLS] // max(1, sum(1 for result in tools if result))
+        tools = [self.counter.truncate(result, tool_budget) if result else result for result in tools]
+
+        usage = {
+            "model": self.model_name,
+            "encoding": self.counter.encoding_name,
+            "max_tokens": self.max_tokens,
+            SEGMENT_HISTORY: {"tokens": needs[SEGMENT_HISTORY], "budget": budgets[SEGMENT_HISTORY],
+                              "used": sum(self.counter.count(message) for message in history)},
+            SEGMENT_RECALL: {"tokens": needs[SEGMENT_RECALL], "budget": budgets[SEGMENT_RECALL],
+                             "used": self.counter.count(recall)},
+            SEGMENT_TOOLS: {"tokens": needs[SEGMENT_TOOLS], "budget": budgets[SEGMENT_TOOLS],
+                            "used": sum(self.counter.count(result) for result in tools)},
+        }
+        usage["total"] = sum(usage[segment]["used"] for segment in SEGMENT_PRIORITY)
+        logger.info(f"Context tokens: {usage['total']}/{self.max_tokens}, "
+                    f"history: {usage[SEGMENT_HISTORY]['used']}/{needs[SEGMENT_HISTORY]}, "
+                    f"recall: {usage[SEGMENT_RECALL]['used']}/{needs[SEGMENT_RECALL]}, "
+                    f"tools: {usage[SEGMENT_TOOLS]['used']}/{needs[SEGMENT_TOOLS]}")
+        return "".join(history), recall, tools, usage
@@ -0,0 +1,196 @@
+import pickle
+import asyncio
+
+from loguru import logger
+from deepsleep.schema.message import Message
+from deepsleep.settings import app_settings
+from deepsleep.utils.cache import TTLLRUCache
+
+CONVERSATION_CACHE_PREFIX = 'conversation:'
+
+# Redis 中每个对话三个 key（hash tag 保证在同一个 slot）：
+# messages 为窗口中的消息列表，count 为对话的消息总数（未知时为 window + 1），count 存在表示已缓存；
+# seq 为对话的追加序号，没有缓存时也会递增，从数据库加载窗口期间有新消息追加时放弃写入缓存
+SEQUENCE_SCRIPT = """
+return redis.call('GET', KEYS[3]) or '0'
+"""
+
+LOAD_SCRIPT = """
+local count = redis.call('GET', KEYS[2])
+if not count then return false end
+return {count, redis.call('LRANGE', KEYS[1], 0, -1)}
+"""
+
+FILL_SCRIPT = """
+if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[3] then return 0 end
+redis.call('DEL', KEYS[1])
+if #ARGV > 3 then redis.call('RPUSH', KEYS[1], unpack(ARGV, 4)) end
+redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# 追加、截断窗口和计数在一个脚本中完成，多个 worker 同时追加不会互相覆盖；没有缓存的对话只递增追加序号
+APPEND_SCRIPT = """
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+if redis.call('EXISTS', KEYS[2]) == 0 then return 0 end
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 1
+"""
+
+# 失效时同样递增追加序号，失效前开始的加载不会把旧窗口写回缓存
+INVALIDATE_SCRIPT = """
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[1])
+return 1
+"""
+
+
+class ConversationCache:
+    """
+    每个对话最近 history.cache_window 条消息的缓存，key 为 dialog_id
+    一级：进程内 LRU；二级：多个 worker 共享的 Redis（history.cache_backend 配置为 redis / none）
+    缓存内容为 {"messages": [(role, content), ...], "complete": bool}，
+    complete 表示窗口中已经是对话的全部消息，任意 top_k 都可以直接返回
+    Redis 中的窗口保存为列表，追加通过 Lua 脚本原子执行，不做读-改-写
+    未命中时调用方先取追加序号（fill_token）再读数据库，fill 时序号变化说明读取期间有新消息，放弃写入缓存
+    """
+    def __init__(self):
+        self.window = app_settings.history.get('cache_window', 20)
+        self.ttl = app_settings.history.get('cache_ttl', 3600)
+        self.backend = app_settings.history.get('cache_backend', 'none')
+        # 开启 Redis 时其他 worker 也会写入同一个对话，进程内的副本只保留很短的时间
+        memory_ttl = app_settings.history.get('cache_memory_ttl', 5) if self.backend == 'redis' else self.ttl
+        self.memory = TTLLRUCache(max_size=app_settings.history.get('cache_size', 10000), ttl=memory_ttl)
+        # 进程内每个对话的追加序号，对话没有缓存时 append 也会递增
+        self.sequences = TTLLRUCache(max_size=app_settings.history.get('cache_size', 10000), ttl=self.ttl)
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @staticmethod
+    def _shared_keys(dialog_id):
+        key = CONVERSATION_CACHE_PREFIX + '{' + dialog_id + '}'
+        return [key + ':messages', key + ':count', key + ':seq']
+
+    def _get_shared(self, dialog_id):
+        from deepsleep.services.redis import redis_client
+        result = redis_client.eval(LOAD_SCRIPT, self._shared_keys(dialog_id), [])
+        if not result:
+            return None
+        count, messages = result
+        return {"messages": [pickle.loads(message) for message in messages], "complete": int(count) <= self.window}
+
+    def _get_shared_sequence(self, dialog_id):
+        from deepsleep.services.redis import redis_client
+        sequence = redis_client.eval(SEQUENCE_SCRIPT, self._shared_keys(dialog_id), [])
+        return sequence.decode('utf-8') if isinstance(sequence, bytes) else str(sequence)
+
+    def _set_shared(self, dialog_id, entry, sequence):
+        """追加序号与 sequence 不一致时不写入，返回是否写入"""
+        from deepsleep.services.redis import redis_client
+        count = len(entry["messages"]) if entry["complete"] else self.window + 1
+        return bool(redis_client.eval(FILL_SCRIPT, self._shared_keys(dialog_id),
+                                      [count, self.ttl, sequence] + [pickle.dumps(message) for message in entry["messages"]]))
+
+    def _append_shared(self, dialog_id, message):
+        from deepsleep.services.redis import redis_client
+        redis_client.eval(APPEND_SCRIPT, self._shared_keys(dialog_id), [pickle.dumps(message), self.window, self.ttl])
+
+    def _delete_shared(self, dialog_id):
+        from deepsleep.services.redis import redis_client
+        redis_client.eval(INVALIDATE_SCRIPT, self._shared_keys(dialog_id), [self.ttl])
+
+    async def _load(self, dialog_id):
+        entry = self.memory.get(dialog_id)
+        if entry is not None or self.backend == 'none':
+            return entry
+
+        try:
+            entry = await asyncio.to_thread(self._get_shared, dialog_id)
+        except Exception as err:
+            logger.error(f"conversation shared cache lookup error: {err}")
+            return None
+
+        if entry is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        self.memory.set(dialog_id, entry)
+        return entry
+
+    async def _store(self, dialog_id, entry, token):
+        memory_sequence, shared_sequence = token
+        if self.backend != 'none' and shared_sequence is not None:
+            try:
+                if not await asyncio.to_thread(self._set_shared, dialog_id, entry, shared_sequence):
+                    logger.debug(f"conversation cache skip fill dialog: {dialog_id}, appended during load")
+                    return
+            except Exception as err:
+                logger.error(f"conversation shared cache store error: {err}")
+        if self.sequences.get(dialog_id, 0) == memory_sequence:
+            self.memory.set(dialog_id, entry)
+
+    async def get(self, dialog_id, top_k):
+        """返回最近 top_k 条消息，缓存中的消息不够时返回 None，由调用方从数据库读取"""
+        entry = await self._load(dialog_id)
+        if entry is None or (len(entry["messages"]) < top_k and not entry["complete"]):
+            return None
+        messages = entry["messages"][-top_k:] if top_k else []
+        return [Message(content=content, role=role) for role, content in messages]
+
+    async def fill_token(self, dialog_id):
+        """从数据库读取窗口之前调用，返回当前的追加序号，传给 fill"""
+        shared_sequence = None
+        if self.backend != 'none':
+            try:
+                shared_sequence = await asyncio.to_thread(self._get_shared_sequence, dialog_id)
+            except Exception as err:
+                logger.error(f"conversation shared cache sequence error: {err}")
+        return self.sequences.get(dialog_id, 0), shared_sequence
+
+    async def fill(self, dialog_id, messages, complete, token):
+        """用数据库中读取的最近消息初始化窗口，读取期间有新消息追加时不写入缓存"""
+        await self._store(dialog_id, {"messages": [(message.role, message.content) for message in messages][-self.window:],
+                                      "complete": complete and len(messages) <= self.window}, token)
+
+    async def append(self, dialog_id, role, content):
+        # 只追加到已经缓存的窗口，没有缓存的对话在下次读取时从数据库加载完整的窗口
+        self.sequences.set(dialog_id, self.sequences.get(dialog_id, 0) + 1)
+        entry = self.memory.get(dialog_id)
+        if entry is not None:
+            messages = entry["messages"] + [(role, content)]
+            self.memory.set(dialog_id, {"messages": messages[-self.window:],
+                                        "complete": entry["complete"] and len(messages) <= self.window})
+
+        if self.backend != 'none':
+            try:
+                await asyncio.to_thread(self._append_shared, dialog_id, (role, content))
+            except Exception as err:
+                logger.error(f"conversation shared cache append error: {err}")
+
+    async def invalidate(self, dialog_id):
+        self.sequences.set(dialog_id, self.sequences.get(dialog_id, 0) + 1)
+        self.memory.pop(dialog_id)
+        if self.backend != 'none':
+            try:
+                await asyncio.to_thread(self._delete_shared, dialog_id)
+            except Exception as err:
+                logger.error(f"conversation shared cache delete error: {err}")
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "window": self.window,
+            "memory": self.memory.stats(),
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses
+        }
+
+
+conversation_cache = ConversationCache()
@@ -0,0 +1,249 @@
+import asyncio
+import time
+from uuid import uuid4
+
+from loguru import logger
+from deepsleep.database.dao.history import HistoryDao
+from deepsleep.schema.chunk import ChunkModel
+from deepsleep.services.rag.backend import get_vector_store, get_lexical_store
+from deepsleep.services.rag.semantic_cache import semantic_cache
+from deepsleep.settings import app_settings
+from deepsleep.utils.cache import TTLLRUCache
+from deepsleep.utils.helpers import get_now_beijing_time
+
+
+class HistoryWriter:
+    """
+    聊天记录的异步批量写入：消息先放到内存缓冲区，由后台任务按批次写入
+    MySQL（一次 add_all）-> ES（bulk）和 Milvus（一次 insert，不 flush）
+    Milvus 按 history.flush_interval 统一 flush，应用关闭时写完缓冲区中的所有消息
+    ES / Milvus 写入失败的批次分别保留，按 history.index_retry_interval 重试
+    """
+    def __init__(self):
+        # 消息在缓冲区中停留的最长时间（秒）
+        self.max_lag = app_settings.history.get('max_lag', 1.0)
+        self.batch_size = app_settings.history.get('batch_size', 200)
+        # 缓冲区达到这个数量时，写入方先等待缓冲区有空位，避免内存无限增长
+        self.max_pending = app_settings.history.get('max_pending', 5000)
+        # MySQL 不可用时写入方最多等待的时间（秒），超时后拒绝写入
+        self.enqueue_timeout = app_settings.history.get('enqueue_timeout', 30)
+        self.index_retry_interval = app_settings.history.get('index_retry_interval', 30)
+        # 最多保留的建索引失败的批次数，超过后丢弃最早的批次
+        self.max_failed_index = app_settings.history.get('max_failed_index', 1000)
+        self.flush_interval = app_settings.history.get('flush_interval', 10)
+        self.pending = []
+        # 正在写入 MySQL 的消息，写入完成前查询历史记录时仍然可见
+        self.inflight = []
+        self._dirty_collections = set()
+        # 建索引失败的批次：(store, dialog_id, chunks)，store 为 lexical / vector
+        self._failed_index = []
+        self.index_failures = 0
+        # 已经删除的对话，正在写入的批次完成后不再为这些对话建索引
+        self._discarded = TTLLRUCache(max_size=10000, ttl=app_settings.history.get('discard_ttl', 600))
+        self._last_flush = time.monotonic()
+        self._last_retry = time.monotonic()
+        self._wakeup = None
+        self._lock = None
+        self._task = None
+        self._stopping = False
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = self._wakeup or asyncio.Event()
+        self._lock = self._lock or asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"History writer start, max lag: {self.max_lag}s, batch size: {self.batch_size}")
+
+    async def stop(self):
+        """停止后台任务，写完缓冲区中剩余的消息并 flush Milvus"""
+        if self._task is not None:
+            # 不取消后台任务，等当前批次写完后由循环自己退出
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self.pending:
+            if not await self.write_batch():
+                logger.error(f"History writer stop with {len(self.pending)} messages not written")
+                break
+        await self.retry_index()
+        if self._failed_index:
+            logger.error(f"History writer stop with {len(self._failed_index)} batches not indexed")
+        await self.flush_vectors()
+
+    async def enqueue(self, role, content, dialog_id):
+        if dialog_id in self._discarded:
+            # 对话已经删除，还在进行中的回答不再写入
+            return
+        self.start()
+        await self._wait_for_space()
+        self.pending.append(HistoryDao._get_history_sql(role, content, dialog_id))
+        if len(self.pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _wait_for_space(self):
+        """缓冲区满时由写入方写入一批；MySQL 写入失败时退避重试，超过 enqueue_timeout 仍然没有空位则拒绝写入"""
+        deadline = time.monotonic() + self.enqueue_timeout
+        delay = 0.1
+        while len(self.pending) >= self.max_pending:
+            if await self.write_batch():
+                continue
+            if time.monotonic() + delay > deadline:
+                raise ValueError(f"history buffer is full ({len(self.pending)} messages) and MySQL write failed")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 2)
+
+    async def discard(self, dialog_id):
+        """删除对话前调用：丢弃该对话还没有写入的消息和建索引失败的批次，正在写入 MySQL 的批次等待其完成"""
+        self._discarded.set(dialog_id, True)
+        if self._lock is None:
+            return
+        async with self._lock:
+            self.pending = [history for history in self.pending if history.dialog_id != dialog_id]
+        self._failed_index = [item for item in self._failed_index if item[1] != dialog_id]
+        self._dirty_collections.discard(dialog_id)
+
+    def pending_messages(self, dialog_id):
+        """还没有写入 MySQL 的消息，按写入顺序返回"""
+        return [history for history in self.inflight + self.pending if history.dialog_id == dialog_id]
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.max_lag)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+
+            try:
+                while self.pending:
+                    if not await self.write_batch():
+                        break
+                if self._failed_index and time.monotonic() - self._last_retry >= self.index_retry_interval:
+                    await self.retry_index()
+                if time.monotonic() - self._last_flush >= self.flush_interval:
+                    await self.flush_vectors()
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.error(f"History writer error: {err}")
+
+    async def write_batch(self):
+        """写入一批消息，MySQL 写入失败时消息放回缓冲区，下一轮重试"""
+        async with self._lock:
+            if not self.pending:
+                return True
+            self.inflight, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            batch = self.inflight
+            insert = asyncio.ensure_future(HistoryDao.async_create_histories(batch))
+            try:
+                await asyncio.shield(insert)
+            except asyncio.CancelledError:
+                # 被取消时 MySQL 写入可能已经提交，等写入结束再传递取消：成功的批次留给 stop() 重试建索引，
+                # 失败的批次放回缓冲区，既不丢失也不重复写入
+                await self._settle_cancelled_insert(insert, batch)
+                raise
+            except Exception as err:
+                logger.error(f"History writer insert {len(batch)} messages error: {err}")
+                self.pending = batch + self.pending
+                return False
+            finally:
+                self.inflight = []
+
+        await self.index_batch(batch)
+        return True
+
+    async def _settle_cancelled_insert(self, insert, batch):
+        await asyncio.wait([insert])
+        if insert.exception() is not None:
+            self.pending = batch + self.pending
+            return
+        for dialog_id, chunks in self._dialog_chunks(batch).items():
+            self._failed_index.extend((store, dialog_id, chunks) for store in ("lexical", "vector"))
+
+    @staticmethod
+    def _build_chunk(history):
+        return ChunkModel(chunk_id=uuid4().hex,
+                          content=f"{history.role}: \n {history.content}",
+                          file_id='history_rag',
+                          knowledge_id=history.dialog_id,
+                          summary="history_rag",
+                          update_time=get_now_beijing_time(),
+                          file_name='history_rag')
+
+    def _dialog_chunks(self, batch):
+        dialog_chunks = {}
+        for history in batch:
+            if history.dialog_id in self._discarded:
+                continue
+            dialog_chunks.setdefault(history.dialog_id, []).append(self._build_chunk(history))
+        return dialog_chunks
+
+    async def index_batch(self, batch):
+        # 历史记录按 dialog_id 建索引，每个对话一次 bulk 和一次 insert
+        indexing = asyncio.gather(*[self._index_dialog(dialog_id, chunks)
+                                    for dialog_id, chunks in self._dialog_chunks(batch).items()])
+        try:
+            await asyncio.shield(indexing)
+        except asyncio.CancelledError:
+            # 这一批已经写入 MySQL，取消时仍然等建索引结束，失败的部分会进入重试列表
+            await asyncio.wait([indexing])
+            raise
+
+    async def _index_dialog(self, dialog_id, chunks):
+        results = await asyncio.gather(*[self._index(store, dialog_id, chunks) for store in ("lexical", "vector")])
+        if any(results):
+            # 至少写入了一个存储后才失效该对话的召回缓存，每个对话只失效一次
+            await semantic_cache.invalidate(dialog_id)
+
+    async def _index(self, store, dialog_id, chunks):
+        """
+        写入一个存储，返回是否写入成功；失败时保留这一批等待重试，
+        ES 和 Milvus 分开记录，重试时不会重复写入成功的一方
+        """
+        if dialog_id in self._discarded:
+            return False
+        try:
+            if store == "lexical":
+                await get_lexical_store().index_documents(dialog_id, chunks)
+            else:
+                await get_vector_store().insert(dialog_id, chunks, flush=False)
+                self._dirty_collections.add(dialog_id)
+            return True
+        except Exception as err:
+            self.index_failures += 1
+            logger.error(f"History writer index dialog: {dialog_id} to {store} store error: {err}")
+            if dialog_id in self._discarded:
+                return False
+            self._failed_index.append((store, dialog_id, chunks))
+            if len(self._failed_index) > self.max_failed_index:
+                store, dialog_id, chunks = self._failed_index.pop(0)
+                logger.error(f"History writer drop {len(chunks)} {store} chunks of dialog: {dialog_id}")
+            return False
+
+    async def retry_index(self):
+        self._last_retry = time.monotonic()
+        if not self._failed_index:
+            return
+        failed, self._failed_index = self._failed_index, []
+        logger.info(f"History writer retry {len(failed)} failed index batches")
+        results = await asyncio.gather(*[self._index(store, dialog_id, chunks) for store, dialog_id, chunks in failed])
+        indexed = {dialog_id for (_, dialog_id, _), ok in zip(failed, results) if ok}
+        await asyncio.gather(*[semantic_cache.invalidate(dialog_id) for dialog_id in indexed])
+
+    async def flush_vectors(self):
+        self._last_flush = time.monotonic()
+        if not self._dirty_collections:
+            return
+        collections, self._dirty_collections = list(self._dirty_collections), set()
+        try:
+            await get_vector_store().flush(collections)
+        except Exception as err:
+            logger.error(f"History writer flush {len(collections)} collections error: {err}")
+
+
+history_writer = HistoryWriter()
@@ -0,0 +1,175 @@
+import asyncio
+from uuid import uuid4
+
+from loguru import logger
+from deepsleep.services.rag.parser import doc_parser
+from deepsleep.services.rag.summary import summary_generator
+from deepsleep.services.rag_handler import RagHandler
+from deepsleep.settings import app_settings
+from deepsleep.utils.cache import TTLLRUCache
+from deepsleep.utils.helpers import get_now_beijing_time
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCESS = "success"
+JOB_FAILED = "failed"
+
+# 任务类型：新建文件全量索引 / 更新文件增量索引
+MODE_CREATE = "create"
+MODE_UPDATE = "update"
+
+# 任务阶段
+STAGE_PARSE = "parse"
+STAGE_DIFF = "diff"
+STAGE_SUMMARY = "summary"
+STAGE_INDEX = "index"
+
+
+class IngestJob:
+    def __init__(self, knowledge_file_id, file_path, knowledge_id, on_success=None, mode=MODE_CREATE):
+        self.job_id = uuid4().hex
+        self.mode = mode
+        self.knowledge_file_id = knowledge_file_id
+        self.file_path = file_path
+        self.knowledge_id = knowledge_id
+        # 索引完成后的回调，例如写入知识库文件记录
+        self.on_success = on_success
+        self.status = JOB_PENDING
+        self.stage = None
+        self.progress = {STAGE_PARSE: 0, STAGE_SUMMARY: 0, STAGE_INDEX: 0}
+        self.chunks = 0
+        self.added_chunks = 0
+        self.removed_chunks = 0
+        self.error = None
+        self.create_time = get_now_beijing_time()
+        self.update_time = self.create_time
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self.update_time = get_now_beijing_time()
+
+    def set_progress(self, stage, done, total):
+        self.progress[stage] = round(done / total * 100, 2) if total else 100
+        self.update_time = get_now_beijing_time()
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "knowledge_file_id": self.knowledge_file_id,
+            "knowledge_id": self.knowledge_id,
+            "mode": self.mode,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "chunks": self.chunks,
+            "added_chunks": self.added_chunks,
+            "removed_chunks": self.removed_chunks,
+            "error": self.error,
+            "create_time": self.create_time,
+            "update_time": self.update_time
+        }
+
+
+class IngestManager:
+    """
+    知识库文件的后台解析任务：上传接口只负责提交任务，由本地的 worker 池完成
+    解析 -> 摘要 -> 同时写入 ES 和 Milvus，文件只解析一次
+    """
+    def __init__(self):
+        self.workers = app_settings.rag.get('ingest_workers', 2)
+        # 已完成的任务只保留一段时间，用于查询状态
+        self.jobs = TTLLRUCache(max_size=app_settings.rag.get('ingest_job_size', 10000),
+                                ttl=app_settings.rag.get('ingest_job_ttl', 24 * 3600))
+        self.queue = None
+        self._worker_tasks = []
+
+    def start(self):
+        if self._worker_tasks and not all(task.done() for task in self._worker_tasks):
+            return
+
+        self.queue = self.queue or asyncio.Queue()
+        self._worker_tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Ingest manager start {self.workers} workers")
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def submit(self, knowledge_file_id, file_path, knowledge_id, on_success=None, mode=MODE_CREATE):
+        self.start()
+        job = IngestJob(knowledge_file_id, file_path, knowledge_id, on_success, mode)
+        self.jobs.set(job.job_id, job)
+        await self.queue.put(job)
+        logger.info(f"Submit ingest job: {job.job_id}, file: {file_path}")
+        return job
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def _worker(self, index):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                job.status = JOB_FAILED
+                job.error = str(err)
+                job.update_time = get_now_beijing_time()
+                logger.error(f"Ingest job: {job.job_id} failed in stage {job.stage}: {err}")
+                if job.mode == MODE_CREATE:
+                    await self._rollback(job)
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    async def _rollback(job: IngestJob):
+        """
+        新建文件的任务失败时还没有知识库文件记录，已经写入 ES / Milvus 的 chunks 无法再通过文件删除，
+        这里清理掉这些 chunks 和摘要 checkpoint
+        """
+        try:
+            await RagHandler.delete_documents_es_milvus(job.knowledge_file_id, job.knowledge_id)
+            summary_generator.clear_checkpoint(job.knowledge_file_id)
+        except Exception as err:
+            logger.error(f"Ingest job: {job.job_id} rollback file: {job.knowledge_file_id} error: {err}")
+
+    async def _process(self, job: IngestJob):
+        job.status = JOB_RUNNING
+
+        job.set_stage(STAGE_PARSE)
+        chunks = await doc_parser.split_doc_into_chunks(job.knowledge_file_id, job.file_path, job.knowledge_id)
+        job.chunks = len(chunks)
+        job.set_progress(STAGE_PARSE, 1, 1)
+
+        removed_chunk_ids = set()
+        if job.mode == MODE_UPDATE:
+            # 增量更新：只处理新增的 chunks，删除已经不存在的 chunks
+            job.set_stage(STAGE_DIFF)
+            chunks, removed_chunk_ids = await RagHandler.diff_documents(job.knowledge_id, job.knowledge_file_id, chunks)
+        job.added_chunks = len(chunks)
+        job.removed_chunks = len(removed_chunk_ids)
+
+        job.set_stage(STAGE_SUMMARY)
+        chunks = await summary_generator.generate_summaries(
+            chunks, job.knowledge_file_id,
+            on_progress=lambda done, total: job.set_progress(STAGE_SUMMARY, done, total))
+        job.set_progress(STAGE_SUMMARY, len(chunks), len(chunks))
+
+        job.set_stage(STAGE_INDEX)
+        await RagHandler.update_documents(job.knowledge_id, chunks, removed_chunk_ids)
+        job.set_progress(STAGE_INDEX, 1, 1)
+
+        if job.on_success is not None:
+            await job.on_success()
+
+        job.status = JOB_SUCCESS
+        job.update_time = get_now_beijing_time()
+        logger.info(f"Ingest job: {job.job_id} success, chunks: {job.chunks}")
+
+
+ingest_manager = IngestManager()
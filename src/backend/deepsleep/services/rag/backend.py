@@ -0,0 +1,45 @@
+"""
+检索后端的选择，由 rag.backend 配置：
+    remote（默认）: Milvus + Elasticsearch
+    local: 进程内的本地向量索引 + BM25 倒排索引，不依赖外部服务
+后端在第一次使用时才创建，导入本模块不会连接 Milvus / ES
+"""
+from deepsleep.settings import app_settings
+from deepsleep.services.rag.store import VectorStore, LexicalStore
+
+REMOTE_BACKEND = "remote"
+LOCAL_BACKEND = "local"
+
+_vector_store = None
+_lexical_store = None
+
+
+def get_backend():
+    backend = app_settings.rag.get('backend', REMOTE_BACKEND)
+    if backend not in (REMOTE_BACKEND, LOCAL_BACKEND):
+        raise ValueError(f"unsupported rag backend: {backend}, supported: {[REMOTE_BACKEND, LOCAL_BACKEND]}")
+    return backend
+
+
+def get_vector_store() -> VectorStore:
+    global _vector_store
+    if _vector_store is None:
+        if get_backend() == LOCAL_BACKEND:
+            from deepsleep.services.rag.local_store import LocalVectorStore
+            _vector_store = LocalVectorStore()
+        else:
+            from deepsleep.services.rag.milvus_client import client
+            _vector_store = client
+    return _vector_store
+
+
+def get_lexical_store() -> LexicalStore:
+    global _lexical_store
+    if _lexical_store is None:
+        if get_backend() == LOCAL_BACKEND:
+            from deepsleep.services.rag.local_store import LocalLexicalStore
+            _lexical_store = LocalLexicalStore()
+        else:
+            from deepsleep.services.rag.es_client import client
+            _lexical_store = client
+    return _lexical_store
@@ -1,24 +1,60 @@
-import os
-
-import pandas as pd
-from langchain_community.document_loaders import CSVLoader
-from langchain_text_splitters import TextSplitter
-
-
-def excel_loader(path: str, text_splitter: TextSplitter):
-    csv_path = path.replace('xlsx', 'csv')
-    df = pd.read_excel(path)
-    df.to_csv(csv_path)
-
-    loader = CSVLoader(csv_path, encoding='utf-8')
-
-    # 删除CSV的缓存文件
-    delete_cache_file(csv_path)
-    result = loader.load_and_split(text_splitter=text_splitter)
-    return result
-
-def delete_cache_file(path: str):
-    if os.path.exists(path):
-        os.remove(path)
-
-
+from itertools import zip_longest
+
+
+def _format_cell(value):
+    return "" if value is None else str(value).strip()
+
+
+def iter_xlsx_rows(path: str):
+    """
+    使用 openpyxl 的只读模式逐行读取，不需要先转成 CSV
+    返回 (sheet 名, 表头, 行) ，每个 sheet 的第一行作为表头
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            header = None
+            for row in sheet.iter_rows(values_only=True):
+                cells = [_format_cell(value) for value in row]
+                if not any(cells):
+                    continue
+                if header is None:
+                    header = cells
+                    continue
+                yield sheet.title, header, cells
+    finally:
+        workbook.close()
+
+
+def iter_xlsx_chunks(path: str, chunk_size: int, overlap_size: int = 0):
+    """
+    按行批量组成 chunk，每行输出为 `列名: 值`，每个 chunk 都带上 sheet 名，行与行之间不需要重叠
+    """
+    current_sheet = None
+    current_prefix = ""
+    current_rows = []
+    current_length = 0
+
+    for sheet_title, header, cells in iter_xlsx_rows(path):
+        if sheet_title != current_sheet:
+            if current_rows:
+                yield current_prefix + "\n".join(current_rows)
+            current_sheet = sheet_title
+            current_prefix = f"{sheet_title}\n"
+            current_rows = []
+            current_length = len(current_prefix)
+
+        row_text = " | ".join(f"{name}: {value}" if name else value
+                              for name, value in zip_longest(header, cells, fillvalue="") if value)
+        if current_rows and current_length + len(row_text) > chunk_size:
+            yield current_prefix + "\n".join(current_rows)
+            current_rows = []
+            current_length = len(current_prefix)
+
+        current_rows.append(row_text)
+        current_length += len(row_text) + 1
+
+    if current_rows:
+        yield current_prefix + "\n".join(current_rows)
@@ -1,35 +1,61 @@
 import os.path
 import re
+import asyncio
+from bisect import bisect_left
 from datetime import datetime, timedelta
 from uuid import uuid4
 from deepsleep.schema.chunk import ChunkModel
+from deepsleep.utils.file_utils import iter_file_lines, LineSegment
 
 class MarkdownParser:
-    def __init__(self, chunk_size=500, overlap_size=100):
+    def __init__(self, chunk_size=500, overlap_size=100, buffer_chunks=64):
         self.chunk_size = chunk_size
         self.overlap_size = overlap_size
+        # 同一标题下积累的文本超过 buffer_chunks 个 chunk 时先切分一部分，内存占用只和该值有关
+        self.buffer_size = chunk_size * buffer_chunks
         self.header_pattern = r'^(#{1,5})\s+(.+)$'
         self.link_pattern = r'\[([^\]]+)\]\(([^)]+)\)'
         self.img_pattern = r'!\[([^\]]+)\]\(([^)]+)\)'
-
-    async def split_text_with_headers(self, text, header_path):
+        self.header_regex = re.compile(self.header_pattern)
+        self.span_regexes = [re.compile(self.link_pattern), re.compile(self.img_pattern)]
+
+    def _find_spans(self, text):
+        """每段文本只扫描一次链接和图片，返回按起始位置排序的 [(starts, ends), ...]"""
+        spans = []
+        for regex in self.span_regexes:
+            matches = [(match.start(), match.end()) for match in regex.finditer(text)]
+            spans.append(([start for start, _ in matches], [end for _, end in matches]))
+        return spans
+
+    @staticmethod
+    def _cut_link_end(spans, start, end):
+        # 同一个正则的匹配互不重叠，跨过 end 的只可能是起始位置在 end 之前的最后一个匹配
+        for starts, ends in spans:
+            i = bisect_left(starts, end) - 1
+            if i >= 0 and start < starts[i] < end < ends[i]:
+                end = starts[i]
+        return end
+
+    def iter_split_text(self, text, header_path, final=True):
         """
         将文本切分成块，每块都包含完整的标题路径
+        final 为 False 时表示后面还有同一标题下的文本，末尾不完整的窗口不切分，
+        切分结束后通过 StopIteration.value 返回下一个窗口的起始位置
         """
-        chunks = []
+        spans = self._find_spans(text)
         start = 0
         text_length = len(text)
 
         while start < text_length:
+            # 保留一个 chunk 的余量，保证链接、句子边界的判断不受缓冲区末尾的影响
+            if not final and start + 2 * self.chunk_size > text_length:
+                break
+
             end = start + self.chunk_size
 
             # 检查链接和图片是否被切断
             if end < text_length:
-                for pattern in [self.link_pattern, self.img_pattern]:
-                    matches = list(re.finditer(pattern, text))
-                    for match in matches:
-                        if start < match.start() < end < match.end():
-                            end = match.start()
+                end = self._cut_link_end(spans, start, end)
 
                 # 调整到句子边界
                 while end > start and end < text_length and text[end] not in '.!?\n':
@@ -39,35 +65,36 @@ class MarkdownParser:
 
             chunk_text = text[start:end].strip()
             if chunk_text:
-                full_chunk = f"{header_path}\n\n{chunk_text}"
-                chunks.append(full_chunk)
+                yield f"{header_path}\n\n{chunk_text}"
 
-            # 更新起始位置，考虑重叠区域
-            start = end - self.overlap_size
+            # 更新起始位置，考虑重叠区域；重叠不小于窗口时直接跳到窗口末尾，避免死循环
+            next_start = end - self.overlap_size
+            start = next_start if next_start > start else end
 
-        return chunks
+        return start
 
-    async def parse_markdown_headers(self, text):
+    def iter_markdown_chunks(self, lines):
         """
-        解析Markdown文件的标题结构，并按标题切分文本内容
+        按行解析Markdown文件的标题结构，并按标题切分文本内容
+        lines 可以是任意的行迭代器，切分结果边解析边返回
         """
         current_headers = {i: '' for i in range(1, 6)}  # 1-5级标题
-        chunks = []
         current_text = []
+        current_length = 0
+
+        def header_path():
+            return ' > '.join([h for h in current_headers.values() if h])
 
-        lines = text.split('\n')
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            header_match = re.match(self.header_pattern, line)
+        for line in lines:
+            # 超长行的后续片段不是新的一行，不判断标题，直接接在前一段后面
+            header_match = None if isinstance(line, LineSegment) else self.header_regex.match(line)
 
             if header_match:
                 # 遇到标题前先处理积累的文本
                 if current_text:
-                    full_text = '\n'.join(current_text)
-                    header_path = ' > '.join([h for h in current_headers.values() if h])
-                    chunks.extend(await self.split_text_with_headers(full_text, header_path))
+                    yield from self.iter_split_text('\n'.join(current_text), header_path())
                     current_text = []
+                    current_length = 0
 
                 # 更新标题层级和标题文本
                 level = len(header_match.group(1))  # # 的数量
@@ -80,25 +107,35 @@ class MarkdownParser:
 
             else:
                 # 收集普通文本
-                current_text.append(line)
-
-            i += 1
-
-            # 如果是最后一行或者下一行是标题，处理积累的文本
-            if i >= len(lines) or re.match(self.header_pattern, lines[i]):
-                if current_text:
-                    full_text = '\n'.join(current_text)
-                    header_path = ' > '.join([h for h in current_headers.values() if h])
-                    chunks.extend(await self.split_text_with_headers(full_text, header_path))
-                    current_text = []
+                if isinstance(line, LineSegment) and current_text:
+                    current_text[-1] += line
+                    current_length += len(line)
+                else:
+                    current_text.append(line)
+                    current_length += len(line) + 1
+
+                # 超长的章节先切分完整的部分，剩余的文本继续积累
+                if current_length >= self.buffer_size:
+                    text = '\n'.join(current_text)
+                    start = yield from self.iter_split_text(text, header_path(), final=False)
+                    current_text = [text[start:]]
+                    current_length = len(current_text[0])
 
         # 处理最后剩余的文本
         if current_text:
-            full_text = '\n'.join(current_text)
-            header_path = ' > '.join([h for h in current_headers.values() if h])
-            chunks.extend(await self.split_text_with_headers(full_text, header_path))
+            yield from self.iter_split_text('\n'.join(current_text), header_path())
 
-        return chunks
+    async def split_text_with_headers(self, text, header_path):
+        """
+        将文本切分成块，每块都包含完整的标题路径
+        """
+        return list(self.iter_split_text(text, header_path))
+
+    async def parse_markdown_headers(self, text):
+        """
+        解析Markdown文件的标题结构，并按标题切分文本内容
+        """
+        return list(self.iter_markdown_chunks(text.split('\n')))
 
     async def parse_file(self, file_path):
         """
@@ -108,21 +145,22 @@ class MarkdownParser:
             text = f.read()
         return text
 
-    async def parse_into_chunks(self, file_id, file_path, knowledge_id):
-        text = await self.parse_file(file_path)
-        contents = await self.parse_markdown_headers(text)
-        chunks = []
+    def iter_chunks(self, file_id, file_path, knowledge_id):
+        """逐行读取文件，边切分边返回 ChunkModel"""
         update_time = datetime.utcnow() + timedelta(hours=8)
-        for content in contents:
-            chunks.append(ChunkModel(
+        lines = iter_file_lines(file_path, self.buffer_size)
+        for content in self.iter_markdown_chunks(lines):
+            yield ChunkModel(
                 chunk_id=f"{os.path.splitext(file_path)}_{uuid4().hex}",
                 content=content,
                 file_id=file_id,
                 file_name=os.path.basename(file_path),
                 knowledge_id=knowledge_id,
                 update_time=update_time
-            ))
+            )
 
-        return chunks
+    async def parse_into_chunks(self, file_id, file_path, knowledge_id):
+        # 切分是 CPU 密集型操作，放到线程中执行，避免阻塞事件循环
+        return await asyncio.to_thread(lambda: list(self.iter_chunks(file_id, file_path, knowledge_id)))
 
-markdown_parser = MarkdownParser()
\ No newline at end of file
+markdown_parser = MarkdownParser()
@@ -1,9 +1,15 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import TextSplitter
+from deepsleep.services.rag.doc_split.text import iter_line_chunks
 
 
-def pdf_loader(path: str, text_splitter: TextSplitter):
-    loader = PyPDFLoader(path)
+def iter_pdf_pages(path: str):
+    """使用 PyMuPDF 逐页读取 PDF，同一时刻只有一页的内容在内存中"""
+    import fitz
 
-    result = loader.load_and_split(text_splitter=text_splitter)
-    return result
\ No newline at end of file
+    with fitz.open(path) as document:
+        for page in document:
+            yield page.get_text("text")
+
+
+def iter_pdf_chunks(path: str, chunk_size: int, overlap_size: int):
+    lines = (line for page in iter_pdf_pages(path) for line in page.splitlines())
+    return iter_line_chunks(lines, chunk_size, overlap_size)
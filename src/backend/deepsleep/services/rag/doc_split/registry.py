@@ -0,0 +1,96 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from loguru import logger
+from deepsleep.settings import app_settings
+from deepsleep.utils.file_utils import iter_file_lines
+from deepsleep.services.rag.doc_split.text import iter_line_chunks
+from deepsleep.services.rag.doc_split.markdown import MarkdownParser
+from deepsleep.services.rag.doc_split.pdf import iter_pdf_chunks
+from deepsleep.services.rag.doc_split.word import iter_docx_chunks
+from deepsleep.services.rag.doc_split.excel import iter_xlsx_chunks
+
+
+def iter_markdown_chunks(path: str, chunk_size: int, overlap_size: int):
+    parser = MarkdownParser(chunk_size, overlap_size)
+    return parser.iter_markdown_chunks(iter_file_lines(path, parser.buffer_size))
+
+
+def iter_text_chunks(path: str, chunk_size: int, overlap_size: int):
+    return iter_line_chunks(iter_file_lines(path, chunk_size), chunk_size, overlap_size)
+
+
+# 文件后缀 -> 流式切分函数 (path, chunk_size, overlap_size) -> Iterator[str]
+PARSER_REGISTRY = {}
+
+
+def register_parser(suffixes, parser):
+    for suffix in suffixes:
+        PARSER_REGISTRY[suffix.lower()] = parser
+
+
+register_parser(["md", "markdown"], iter_markdown_chunks)
+register_parser(["txt"], iter_text_chunks)
+register_parser(["pdf"], iter_pdf_chunks)
+register_parser(["docx"], iter_docx_chunks)
+register_parser(["xlsx"], iter_xlsx_chunks)
+
+
+def get_file_suffix(file_path):
+    return os.path.splitext(file_path)[-1].lstrip('.').lower()
+
+
+def is_supported(file_path):
+    return get_file_suffix(file_path) in PARSER_REGISTRY
+
+
+def split_file(file_path, chunk_size, overlap_size):
+    """在解析进程中执行：按文件类型切分成文本块"""
+    parser = PARSER_REGISTRY[get_file_suffix(file_path)]
+    return [content for content in parser(file_path, chunk_size, overlap_size) if content.strip()]
+
+
+class ParserPool:
+    """
+    文档解析进程池：解析是 CPU 密集型操作，放到独立的进程中执行，
+    不阻塞事件循环，多个文件可以在多个核上同时解析
+    """
+    def __init__(self):
+        self.workers = app_settings.split.get('parse_workers') or max(1, (os.cpu_count() or 2) // 2)
+        self.executor = None
+
+    def _get_executor(self):
+        if self.executor is None:
+            # 使用 spawn 避免 fork 时复制事件循环、数据库连接等线程状态
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+            logger.info(f"Parser pool start {self.workers} processes")
+        return self.executor
+
+    async def split(self, file_path, chunk_size=None, overlap_size=None):
+        if not is_supported(file_path):
+            raise ValueError(f"unsupported file type: {get_file_suffix(file_path)}, "
+                             f"supported: {sorted(PARSER_REGISTRY)}")
+
+        chunk_size = chunk_size or app_settings.split.get('chunk_size', 500)
+        overlap_size = app_settings.split.get('overlap_size', 100) if overlap_size is None else overlap_size
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), split_file, file_path, chunk_size, overlap_size)
+        except BrokenProcessPool:
+            # 解析进程异常退出（例如内存不足被杀）时重建进程池，下一个任务不受影响
+            logger.error(f"Parser pool broken while parsing {file_path}, restart pool")
+            self.shutdown()
+            raise
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+parser_pool = ParserPool()
@@ -1,56 +1,68 @@
 import os
+import asyncio
 from datetime import datetime, timedelta
 from uuid import uuid4
 
 from deepsleep.schema.chunk import ChunkModel
 from deepsleep.settings import app_settings
+from deepsleep.utils.file_utils import iter_file_lines, LineSegment
+
+def iter_line_chunks(lines, chunk_size, overlap_size):
+    """
+    按行切割文本的纯函数版本，不依赖配置，可以在解析进程中直接调用
+    LineSegment 为超长行的后续片段，直接接在前一段后面，不插入换行符
+    """
+    current_chunk = []
+    current_length = 0
+
+    for line in lines:
+        line_length = len(line)
+
+        # 如果当前 chunk 加上新行超过 chunk_size，则保存当前 chunk
+        if current_length + line_length > chunk_size:
+            if current_chunk:
+                chunk = "\n".join(current_chunk)
+                yield chunk
+                # 保留重叠部分：从当前 chunk 末尾截取 overlap_size 个字符
+                overlap = chunk[-overlap_size:] if overlap_size > 0 else ""
+                current_chunk = [overlap] if overlap else []
+                current_length = len(overlap)
+
+        # 添加行到当前 chunk；切分后的 overlap 同样来自这一行的末尾，后续片段直接拼接
+        if isinstance(line, LineSegment) and current_chunk:
+            current_chunk[-1] += line
+        else:
+            current_chunk.append(line)
+        current_length += line_length
+
+    # 处理最后一个 chunk
+    if current_chunk:
+        yield "\n".join(current_chunk)
+
 
 class TextParser:
     def __init__(self):
         self.chunk_size = app_settings.split.get('chunk_size')
         self.overlap_size = app_settings.split.get('overlap_size')
 
+    def iter_chunks_by_lines(self, lines):
+        """
+        按行切割文本，确保每个 chunk 的大小不超过 chunk_size，并保留 overlap_size 的重叠部分。
+        lines 可以是任意的行迭代器，每凑满一个 chunk 就返回，内存中只保留当前 chunk。
+        """
+        return iter_line_chunks(lines, self.chunk_size, self.overlap_size)
+
     async def split_text_into_chunks_by_lines(self, text):
         """
         按换行符切割文本，确保每个 chunk 的大小不超过 chunk_size，并保留 overlap_size 的重叠部分。
 
         参数:
             text (str): 输入的文本。
-            chunk_size (int): 每个 chunk 的最大字符数（默认500）。
-            overlap_size (int): chunks 之间的重叠字符数（默认100），需小于 chunk_size。
 
         返回:
             list: 包含按行切割的 chunks 列表。
         """
-        # 按换行符分割文本
-        lines = text.splitlines()
-        chunks = []
-        current_chunk = []
-        current_length = 0
-
-        for line in lines:
-            line_length = len(line)
-
-            # 如果当前 chunk 加上新行超过 chunk_size，则保存当前 chunk
-            if current_length + line_length > self.chunk_size:
-                if current_chunk:
-                    chunk = "\n".join(current_chunk)
-                    chunks.append(chunk)
-                    # 保留重叠部分：从当前 chunk 末尾截取 overlap_size 个字符
-                    overlap = chunk[-self.overlap_size:] if self.overlap_size > 0 else ""
-                    current_chunk = [overlap] if overlap else []
-                    current_length = len(overlap)
-
-            # 添加行到当前 chunk
-            current_chunk.append(line)
-            current_length += line_length
-
-        # 处理最后一个 chunk
-        if current_chunk:
-            chunk = "\n".join(current_chunk)
-            chunks.append(chunk)
-
-        return chunks
+        return list(self.iter_chunks_by_lines(text.splitlines()))
 
     async def parse_file(self, file_path):
         """
@@ -60,21 +72,21 @@ class TextParser:
             text = f.read()
         return text
 
-    async def parse_into_chunks(self, file_id, file_path, knowledge_id):
-        file_content = await self.parse_file(file_path)
-        contents = await self.split_text_into_chunks_by_lines(file_content)
-        chunks = []
+    def iter_chunks(self, file_id, file_path, knowledge_id):
+        """逐行读取文件，边切分边返回 ChunkModel；超过 chunk_size 的行按 chunk_size 分段读取，chunk 中不会插入原文没有的换行"""
         update_time = datetime.utcnow() + timedelta(hours=8)
-        for content in contents:
-            chunks.append(ChunkModel(
+        for content in self.iter_chunks_by_lines(iter_file_lines(file_path, self.chunk_size)):
+            yield ChunkModel(
                 chunk_id=f"{os.path.splitext(file_path)}_{uuid4().hex}",
                 content=content,
                 file_id=file_id,
                 file_name=os.path.basename(file_path),
                 knowledge_id=knowledge_id,
                 update_time=update_time
-            ))
+            )
 
-        return chunks
+    async def parse_into_chunks(self, file_id, file_path, knowledge_id):
+        # 切分是 CPU 密集型操作，放到线程中执行，避免阻塞事件循环
+        return await asyncio.to_thread(lambda: list(self.iter_chunks(file_id, file_path, knowledge_id)))
 
 text_parser = TextParser()
@@ -1,22 +1,28 @@
-from docx import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
-from langchain_community.document_loaders import UnstructuredWordDocumentLoader
+from deepsleep.services.rag.doc_split.text import iter_line_chunks
 
-def word_loader(path: str, text_splitter: TextSplitter):
-    loader = UnstructuredWordDocumentLoader(path)
 
-    result = loader.load_and_split(text_splitter=text_splitter)
-    return result
-    
-# def word_loader(path: str, text_splitter: TextSplitter):
-#     # 使用 python-docx 加载 Word 文档
-#     doc = Document(path)
+def iter_docx_paragraphs(path: str):
+    """
+    使用 python-docx 按文档顺序读取 Word 的段落和表格，表格按行输出，单元格用 | 分隔
+    按 body 中的元素顺序遍历，表格保留在原来的位置，不会被移到所有段落之后
+    """
+    from docx import Document
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
 
-#     # 读取文档内容
-#     pages = [p.text for p in doc.paragraphs]
-
-#     result = text_splitter.split_documents(pages)
-
-#     return result
+    document = Document(path)
+    for element in document.element.body.iterchildren():
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'p':
+            paragraph = Paragraph(element, document)
+            if paragraph.text.strip():
+                yield paragraph.text
+        elif tag == 'tbl':
+            for row in Table(element, document).rows:
+                cells = [cell.text.strip() for cell in row.cells]
+                if any(cells):
+                    yield " | ".join(cells)
 
 
+def iter_docx_chunks(path: str, chunk_size: int, overlap_size: int):
+    return iter_line_chunks(iter_docx_paragraphs(path), chunk_size, overlap_size)
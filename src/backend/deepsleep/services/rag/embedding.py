@@ -1,16 +1,71 @@
+from typing import List, Union
+
 from openai import AsyncOpenAI
 from deepsleep.settings import app_settings
+from deepsleep.services.rag.embedding_cache import EmbeddingCache
+from deepsleep.services.rag.embedding_batcher import EmbeddingBatcher
 
 embedding_model = app_settings.embedding.get('model_name')
+# 支持 Matryoshka 的模型可以直接指定输出维度，不配置时使用模型默认维度
+embedding_dimensions = app_settings.embedding.get('dimensions')
 embedding_client = AsyncOpenAI(base_url=app_settings.embedding.get('base_url'), api_key=app_settings.embedding.get('api_key'))
+embedding_cache = EmbeddingCache(f"{embedding_model}@{embedding_dimensions}" if embedding_dimensions else embedding_model)
+_embedding_dim = None
+
 
+async def request_embeddings(texts: List[str]) -> List[List[float]]:
+    """直接请求 Embedding 接口，返回顺序与输入顺序一致"""
+    if not texts:
+        return []
 
-async def get_embedding(query):
+    extra_params = {"dimensions": embedding_dimensions} if embedding_dimensions else {}
     response = await embedding_client.embeddings.create(
         model=embedding_model,
-        input=query,
-        encoding_format="float")
+        input=texts,
+        encoding_format="float",
+        **extra_params)
+
+    data = sorted(response.data, key=lambda item: item.index)
+    return [item.embedding for item in data]
+
+
+embedding_batcher = EmbeddingBatcher(request_embeddings)
+
+
+async def get_embeddings(texts: List[str]) -> List[List[float]]:
+    """获取多条文本的向量，优先读取缓存，只请求未命中且去重后的文本"""
+    if not texts:
+        return []
+
+    vectors = await embedding_cache.get_many(texts)
+
+    missing_texts = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    if missing_texts:
+        if app_settings.embedding.get('batching', True):
+            # 与其他会话的请求合并成批量请求
+            missing_vectors = await embedding_batcher.embed(missing_texts)
+        else:
+            missing_vectors = await request_embeddings(missing_texts)
+        await embedding_cache.set_many(missing_texts, missing_vectors)
+
+        missing_dict = dict(zip(missing_texts, missing_vectors))
+        vectors = [vector if vector is not None else missing_dict[text] for text, vector in zip(texts, vectors)]
+
+    return [vector.tolist() if hasattr(vector, 'tolist') else vector for vector in vectors]
+
+
+async def get_embedding(query: Union[str, List[str]]):
+    # 传入列表时返回所有文本的向量，传入字符串时只返回该文本的向量
+    if isinstance(query, list):
+        return await get_embeddings(query)
+
+    embeddings = await get_embeddings([query])
+    return embeddings[0]
 
-    response = response.model_dump_json()
-    return response['data'][0]['embedding']
 
+async def get_embedding_dim():
+    """向量维度：优先使用配置，否则请求一次 Embedding 接口探测模型的输出维度"""
+    global _embedding_dim
+    if _embedding_dim is None:
+        _embedding_dim = embedding_dimensions or len(await get_embedding("dimension probe"))
+    return _embedding_dim
@@ -0,0 +1,171 @@
+import asyncio
+from collections import deque
+
+from loguru import logger
+from deepsleep.settings import app_settings
+
+# 厂商文档中批量超限的错误码和错误信息（OpenAI / DashScope 兼容模式等），可以通过 embedding.batch_limit_errors 覆盖
+# 429 限流、401 鉴权、额度不足等错误不能通过拆分批次解决，不在此列
+BATCH_LIMIT_ERRORS = [
+    "array_above_max_length",
+    "too many inputs",
+    "max number of inputs",
+    "batch size is invalid",
+    "maximum context length",
+    "context_length_exceeded",
+]
+
+
+class EmbeddingBatcher:
+    """
+    Embedding 微批处理：把多个会话并发的 Embedding 请求在 max_wait_ms 内合并成一次批量请求，
+    再把向量按顺序分发回各个调用方
+    批大小采用加性增、乘性减：请求因超出厂商限制失败时拆分重试，拆分后的两半都成功才把批大小降到一半，
+    避免单条超长文本之类的偶发失败永久缩小批大小；成功时逐步增大
+    """
+    def __init__(self, request_func, max_batch_size=None, max_wait_ms=None, max_batch_tokens=None,
+                 max_concurrent_batches=None):
+        self.request_func = request_func
+        self.max_batch_size = max_batch_size or app_settings.embedding.get('batch_size', 64)
+        self.max_wait = (max_wait_ms or app_settings.embedding.get('batch_wait_ms', 5)) / 1000
+        self.max_batch_tokens = max_batch_tokens or app_settings.embedding.get('batch_max_tokens', 8192)
+        self.max_concurrent_batches = max_concurrent_batches or app_settings.embedding.get('batch_concurrency', 4)
+        self.batch_limit_errors = [error.lower() for error in
+                                   app_settings.embedding.get('batch_limit_errors') or BATCH_LIMIT_ERRORS]
+
+        self.batch_size = self.max_batch_size
+        self._pending = deque()
+        self._wakeup = None
+        self._worker = None
+        self._semaphore = None
+        self._tasks = set()
+
+        self.total_batches = 0
+        self.total_texts = 0
+        self.last_batch_size = 0
+
+    @staticmethod
+    def estimate_tokens(text: str):
+        # 粗略估计：中文约一个字一个 token，英文按字符数估计偏保守
+        return max(1, len(text))
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = asyncio.create_task(self._run())
+
+    async def embed(self, texts):
+        if not texts:
+            return []
+
+        self._ensure_worker()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._pending.append((text, future))
+            futures.append(future)
+        self._wakeup.set()
+        return await asyncio.gather(*futures)
+
+    def _take_batch(self):
+        batch = []
+        tokens = 0
+        while self._pending and len(batch) < self.batch_size:
+            text, future = self._pending[0]
+            text_tokens = self.estimate_tokens(text)
+            if batch and tokens + text_tokens > self.max_batch_tokens:
+                break
+            self._pending.popleft()
+            if future.cancelled():
+                continue
+            batch.append((text, future))
+            tokens += text_tokens
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            # 第一个请求到达后最多等待 max_wait，收集更多请求合并成一批
+            if len(self._pending) < self.batch_size:
+                await asyncio.sleep(self.max_wait)
+
+            while self._pending:
+                batch = self._take_batch()
+                if not batch:
+                    continue
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._dispatch(batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            await self._request(batch)
+        finally:
+            self._semaphore.release()
+
+    @staticmethod
+    def _fail(batch, err):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(err)
+
+    async def _request(self, batch):
+        """请求一批文本的向量，返回这一批是否全部成功"""
+        texts = [text for text, _ in batch]
+        try:
+            vectors = await self.request_func(texts)
+        except Exception as err:
+            if len(batch) > 1 and self._is_batch_limit_error(err):
+                # 超出厂商的批量限制，拆分重试
+                logger.warning(f"embedding batch of {len(batch)} rejected, split and retry: {err}")
+                middle = len(batch) // 2
+                results = await asyncio.gather(self._request(batch[:middle]), self._request(batch[middle:]))
+                if all(results) and len(batch) - middle < self.batch_size:
+                    # 两半都成功，说明确实是批大小超出了限制
+                    self.batch_size = len(batch) - middle
+                    logger.warning(f"embedding batch size shrink to {self.batch_size}")
+                return all(results)
+
+            self._fail(batch, err)
+            return False
+
+        if len(vectors) != len(batch):
+            # 返回的向量数量与输入不一致时无法确定对应关系，整批失败，避免调用方一直等待
+            self._fail(batch, ValueError(f"embedding response has {len(vectors)} vectors for {len(batch)} texts"))
+            return False
+
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+        self.total_batches += 1
+        self.total_texts += len(batch)
+        self.last_batch_size = len(batch)
+        if self.batch_size < self.max_batch_size and len(batch) >= self.batch_size:
+            self.batch_size += 1
+        return True
+
+    def _is_batch_limit_error(self, err):
+        status_code = getattr(err, 'status_code', None)
+        if status_code == 413:
+            return True
+        if status_code != 400:
+            return False
+        # 400 也可能是参数错误，只有匹配厂商的批量超限错误时才拆分
+        message = f"{getattr(err, 'code', None) or ''} {err}".lower()
+        return any(error in message for error in self.batch_limit_errors)
+
+    def stats(self):
+        return {
+            "queue_depth": len(self._pending),
+            "batch_size": self.batch_size,
+            "max_batch_size": self.max_batch_size,
+            "last_batch_size": self.last_batch_size,
+            "avg_batch_size": round(self.total_texts / self.total_batches, 2) if self.total_batches else 0,
+            "total_batches": self.total_batches
+        }
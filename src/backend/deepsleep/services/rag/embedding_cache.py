@@ -0,0 +1,153 @@
+import os
+import time
+import asyncio
+
+import numpy as np
+from loguru import logger
+from deepsleep.settings import app_settings
+from deepsleep.utils.cache import TTLLRUCache
+from deepsleep.utils.hash import sha256_hash
+
+EMBEDDING_CACHE_PREFIX = 'embedding:'
+
+
+class EmbeddingCache:
+    """
+    两级 Embedding 缓存，key 为 (model, sha256(text))
+    一级：进程内 LRU，存放 float32 向量
+    二级：多进程共享的 Redis 或者本地 mmap 文件（embedding.cache_backend 配置为 redis / disk / none）
+    Redis 按批次一次 MGET / 一次 pipeline 写入；磁盘缓存写入后定期清理过期文件，
+    文件数超过 embedding.cache_disk_max_files 时删除最久未写入的文件
+    """
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.ttl = app_settings.embedding.get('cache_ttl', 7 * 24 * 3600)
+        self.memory = TTLLRUCache(max_size=app_settings.embedding.get('cache_size', 10000), ttl=self.ttl)
+        self.backend = app_settings.embedding.get('cache_backend', 'none')
+        self.cache_dir = app_settings.embedding.get('cache_dir', 'deepsleep/data/embedding_cache')
+        self.disk_max_files = app_settings.embedding.get('cache_disk_max_files', 200000)
+        self.disk_sweep_interval = app_settings.embedding.get('cache_disk_sweep_interval', 600)
+        self._last_sweep = 0
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+        if self.backend == 'disk':
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, text: str):
+        return f"{self.model_name}:{sha256_hash(text)}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key.replace(':', '_')}.npy")
+
+    def _load_disk(self, key):
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        # 超过过期时间的文件视为未命中并删除
+        if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+            os.remove(path)
+            return None
+        return np.array(np.load(path, mmap_mode='r'), dtype=np.float32)
+
+    def _get_shared(self, keys):
+        if self.backend == 'redis':
+            from deepsleep.services.redis import redis_client
+            return redis_client.mget_values([EMBEDDING_CACHE_PREFIX + key for key in keys])
+        if self.backend == 'disk':
+            return [self._load_disk(key) for key in keys]
+        return [None] * len(keys)
+
+    def _set_shared(self, items):
+        if self.backend == 'redis':
+            from deepsleep.services.redis import redis_client
+            redis_client.set_many([(EMBEDDING_CACHE_PREFIX + key, vector) for key, vector in items],
+                                  expiration=self.ttl)
+        elif self.backend == 'disk':
+            for key, vector in items:
+                np.save(self._disk_path(key), vector)
+            if time.monotonic() - self._last_sweep >= self.disk_sweep_interval:
+                self._sweep_disk()
+
+    def _sweep_disk(self):
+        """删除过期的文件，文件数超过上限时按写入时间删除最早的文件"""
+        self._last_sweep = time.monotonic()
+        now = time.time()
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.npy'):
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if self.ttl and mtime + self.ttl < now:
+                    self._remove_file(entry.path)
+                else:
+                    files.append((mtime, entry.path))
+
+        if self.disk_max_files and len(files) > self.disk_max_files:
+            files.sort()
+            for _, path in files[:len(files) - self.disk_max_files]:
+                self._remove_file(path)
+            logger.info(f"embedding disk cache evict {len(files) - self.disk_max_files} files")
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    async def get_many(self, texts):
+        """返回与 texts 等长的列表，未命中的位置为 None"""
+        vectors = [None] * len(texts)
+        shared_lookup = []
+        for i, text in enumerate(texts):
+            key = self.make_key(text)
+            vector = self.memory.get(key)
+            if vector is not None:
+                vectors[i] = vector
+            elif self.backend != 'none':
+                shared_lookup.append((i, key))
+
+        if shared_lookup:
+            try:
+                shared_vectors = await asyncio.to_thread(self._get_shared, [key for _, key in shared_lookup])
+            except Exception as err:
+                logger.error(f"embedding shared cache lookup error: {err}")
+                shared_vectors = [None] * len(shared_lookup)
+
+            for (i, key), vector in zip(shared_lookup, shared_vectors):
+                if vector is None:
+                    self.shared_misses += 1
+                    continue
+                self.shared_hits += 1
+                vector = np.asarray(vector, dtype=np.float32)
+                self.memory.set(key, vector)
+                vectors[i] = vector
+        return vectors
+
+    async def set_many(self, texts, vectors):
+        items = []
+        for text, vector in zip(texts, vectors):
+            key = self.make_key(text)
+            vector = np.asarray(vector, dtype=np.float32)
+            self.memory.set(key, vector)
+            items.append((key, vector))
+
+        if self.backend != 'none' and items:
+            try:
+                await asyncio.to_thread(self._set_shared, items)
+            except Exception as err:
+                logger.error(f"embedding shared cache store error: {err}")
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "memory": self.memory.stats(),
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses
+        }
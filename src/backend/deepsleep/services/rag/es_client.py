@@ -1,97 +1,213 @@
 import json
-from typing import List
+import asyncio
+from typing import List, Union, Iterable, AsyncIterable
 from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_streaming_bulk
 from deepsleep.schema.chunk import ChunkModel
 from deepsleep.schema.search import SearchModel
+from deepsleep.services.rag.store import LexicalStore
 from deepsleep.settings import app_settings
 from loguru import logger
 
-class AsyncESClient:
-    def __init__(self):
-        self.client = AsyncElasticsearch(hosts=app_settings.elasticsearch.get('hosts'))
+# ES 返回这些状态码时按退避重试
+RETRY_ON_STATUS = (429, 502, 503, 504)
+
+
+def fill_template(template, **values):
+    """把模板中形如 "{name}" 的字符串替换为对应的值，模板本身不会被修改"""
+    if isinstance(template, dict):
+        return {key: fill_template(value, **values) for key, value in template.items()}
+    if isinstance(template, list):
+        return [fill_template(value, **values) for value in template]
+    if isinstance(template, str) and template.startswith('{') and template.endswith('}') \
+            and template[1:-1] in values:
+        return values[template[1:-1]]
+    return template
 
-    async def insert_documents(self, index_name, chunks: List[ChunkModel]):
-        with open(app_settings.elasticsearch.get('index_config_path'), 'r') as f:
-            index_config = json.loads(f.read())
 
+class AsyncESClient(LexicalStore):
+    """
+    进程内共享一个 AsyncElasticsearch 连接池：FastAPI 启动时 start，关闭时 close
+    检索、删除使用的查询模板只在第一次使用时读取并解析
+    """
+    def __init__(self):
+        self._client = None
+        self._index_config = None
+        self._templates = {}
+        self.search_timeout = app_settings.elasticsearch.get('search_timeout', 3)
+
+    @property
+    def client(self):
+        # 脚本等没有经过 FastAPI 启动流程的场景，第一次使用时创建
+        if self._client is None:
+            self._client = AsyncElasticsearch(
+                hosts=app_settings.elasticsearch.get('hosts'),
+                connections_per_node=app_settings.elasticsearch.get('connections_per_node', 10),
+                request_timeout=app_settings.elasticsearch.get('request_timeout', 10),
+                max_retries=app_settings.elasticsearch.get('max_retries', 3),
+                retry_on_timeout=app_settings.elasticsearch.get('retry_on_timeout', True),
+                retry_on_status=RETRY_ON_STATUS)
+            logger.info(f"Elasticsearch client start, hosts: {app_settings.elasticsearch.get('hosts')}")
+        return self._client
+
+    async def start(self):
+        return self.client
+
+    def _template(self, path_key):
+        template = self._templates.get(path_key)
+        if template is None:
+            with open(app_settings.elasticsearch.get(path_key), 'r') as f:
+                template = self._templates[path_key] = json.load(f)
+        return template
+
+    @property
+    def index_config(self):
+        # 索引配置只在第一次使用时读取
+        if self._index_config is None:
+            with open(app_settings.elasticsearch.get('index_config_path'), 'r') as f:
+                self._index_config = json.loads(f.read())
+        return self._index_config
+
+    async def create_index(self, index_name):
         if not await self.client.indices.exists(index=index_name):
 
             try:
-                await self.client.indices.create(index=index_name, body=index_config)
+                await self.client.indices.create(index=index_name, body=self.index_config)
                 logger.info(f'index name: {index_name} 创建成功')
             except Exception as e:
                 logger.error(f"index name {index_name} error: {e}")
                 raise ValueError(f"index create error")
-        try:
+
+    @staticmethod
+    async def _iter_batches(chunks: Union[Iterable[ChunkModel], AsyncIterable[ChunkModel]], batch_size):
+        """将同步或者异步的 chunk 流按 batch_size 切分成批次"""
+        batch = []
+        if hasattr(chunks, '__aiter__'):
+            async for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        else:
             for chunk in chunks:
-                await self.client.index(
-                    index=index_name,
-                    body=chunk.to_dict()
-                )
-                logger.info(f'chunk id: {chunk.chunk_id} 已存到索引中')
-        except Exception as e:
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    async def _bulk_batch(self, index_name, batch: List[ChunkModel], errors: list):
+        actions = ({"_index": index_name, "_id": chunk.chunk_id, "_source": chunk.to_dict()} for chunk in batch)
+        success = 0
+        async for ok, item in async_streaming_bulk(self.client, actions,
+                                                   chunk_size=len(batch),
+                                                   max_chunk_bytes=app_settings.elasticsearch.get('bulk_max_bytes', 10 * 1024 * 1024),
+                                                   max_retries=app_settings.elasticsearch.get('bulk_max_retries', 3),
+                                                   raise_on_error=False,
+                                                   raise_on_exception=False):
+            if ok:
+                success += 1
+            else:
+                # 记录每一条写入失败的文档
+                error = item.get('index', item)
+                errors.append({"chunk_id": error.get('_id'), "error": error.get('error', error.get('status'))})
+                logger.error(f"chunk id: {error.get('_id')} 写入索引失败: {error.get('error')}")
+        return success
+
+    async def insert_documents(self, index_name, chunks: Union[Iterable[ChunkModel], AsyncIterable[ChunkModel]]):
+        """
+        通过 _bulk 接口批量写入 chunks，chunks 可以是列表也可以是异步生成器
+        返回写入成功的数量以及失败文档的错误信息
+        """
+        await self.create_index(index_name)
+
+        batch_size = app_settings.elasticsearch.get('bulk_chunk_size', 500)
+        # 限制同时在途的批次数量，避免生产者过快导致内存堆积
+        semaphore = asyncio.Semaphore(app_settings.elasticsearch.get('bulk_max_in_flight', 2))
+        errors = []
+        tasks = []
+
+        async def run_batch(batch):
+            try:
+                return await self._bulk_batch(index_name, batch, errors)
+            finally:
+                semaphore.release()
+
+        try:
+            async for batch in self._iter_batches(chunks, batch_size):
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(run_batch(batch)))
+
+            success = sum(await asyncio.gather(*tasks))
+        except BaseException as e:
+            # 生产者或某一批失败时取消仍在途的批次，避免调用方看到失败后还在继续写入
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
             logger.error(f"索引增加数据失败：{e}")
-        finally:
-            await self.close()
+            raise
+
+        logger.info(f'index name: {index_name} bulk 写入成功 {success} 条, 失败 {len(errors)} 条')
+        return success, errors
 
     async def index_documents(self, index_name, chunks):
-        await self.insert_documents(index_name, chunks)
+        return await self.insert_documents(index_name, chunks)
+
+    @staticmethod
+    def _format_hits(response):
+        documents = []
+        for hit in response['hits']['hits']:
+            documents.append(SearchModel(score=hit['_score'], chunk_id=hit['_source']['chunk_id'], update_time=hit['_source']['update_time'],
+                                         content=hit['_source']['content'], file_name=hit['_source']['file_name'], summary=hit['_source']['summary'],
+                                         file_id=hit['_source']['file_id'], knowledge_id=hit['_source']['knowledge_id']))
+        return documents
+
+    async def _search(self, query, index_name, path_key):
+        index_search = fill_template(self._template(path_key), query=query)
+        response = await self.client.options(request_timeout=self.search_timeout).search(index=index_name,
+                                                                                         body=index_search)
+        return self._format_hits(response)
 
     async def search_documents(self, query, index_name):
-        with open(app_settings.elasticsearch.get('index_search_content_path'), 'r') as f:
-            content = f.read()
-            content = content.format(query=query)
-            index_search = json.loads(content)
-
         try:
-            response = await self.client.search(index=index_name, body=index_search)
-
-            documents = []
-            for hit in response['hits']:
-                documents.append(SearchModel(score=hit['_score'], chunk_id=hit['_source']['chunk_id'], update_time=hit['_source']['update_time'],
-                                             content=hit['_source']['content'], file_name=hit['_source']['file_name'], summary=hit['_source']['summary'],
-                                             file_id=hit['_source']['file_id'], knowledge_id=hit['_source']['knowledge_id']))
-
+            return await self._search(query, index_name, 'index_search_content_path')
         except Exception as e:
             logger.error(f'Search documents error: {e}')
-        finally:
-            await self.close()
+            return []
 
     async def search_documents_summary(self, query, index_name):
-        with open(app_settings.elasticsearch.get('index_search_summary_path'), 'r') as f:
-            content = f.read()
-            content = content.format(query=query)
-            index_search = json.loads(content)
-
         try:
-            response = await self.client.search(index=index_name, body=index_search)
-
-            documents = []
-            for hit in response['hits']:
-                documents.append(SearchModel(score=hit['_score'], chunk_id=hit['_source']['chunk_id'], update_time=hit['_source']['update_time'],
-                                             content=hit['_source']['content'], file_name=hit['_source']['file_name'], summary=hit['_source']['summary'],
-                                             file_id=hit['_source']['file_id'], knowledge_id=hit['_source']['knowledge_id']))
-
+            return await self._search(query, index_name, 'index_search_summary_path')
         except Exception as e:
             logger.error(f'Search documents summary error: {e}')
-        finally:
-            await self.close()
+            return []
 
     async def delete_documents(self, file_id, index_name):
         try:
             # 构造查询条件
-            with open(app_settings.elasticsearch.get('index_delete_path'), 'r') as f:
-                content = f.read()
-                content = content.format(file_id=file_id)
-                delete_query = json.loads(content)
-
+            delete_query = fill_template(self._template('index_delete_path'), file_id=file_id)
             await self.client.delete_by_query(index=index_name, body=delete_query)
             logger.info(f'Success delete documents in file id: {file_id}')
         except Exception as e:
             logger.error(f'Delete documents in file id error: {e}')
 
 
+    async def delete_documents_by_chunk_ids(self, chunk_ids, index_name):
+        if not chunk_ids:
+            return
+        try:
+            await self.client.delete_by_query(index=index_name,
+                                              body={"query": {"terms": {"chunk_id": list(chunk_ids)}}})
+            logger.info(f'Success delete {len(chunk_ids)} chunks in index: {index_name}')
+        except Exception as e:
+            logger.error(f'Delete chunks in index: {index_name} error: {e}')
+            raise
+
     async def close(self):
-        await self.client.close()
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            logger.info("Elasticsearch client closed")
 
 client = AsyncESClient()
\ No newline at end of file
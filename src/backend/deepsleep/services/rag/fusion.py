@@ -0,0 +1,74 @@
+from typing import List, Tuple
+
+from deepsleep.schema.search import SearchModel
+from deepsleep.utils.hash import md5_hash
+
+ES_BACKEND = "es"
+MILVUS_BACKEND = "milvus"
+
+# 分数越小越相关的后端（Milvus 使用 L2 距离）
+ASCENDING_BACKENDS = {MILVUS_BACKEND}
+
+
+def _document_key(document: SearchModel):
+    # 使用 chunk_id 去重，历史数据没有 chunk_id 时使用内容 hash
+    return document.chunk_id or md5_hash(document.content)
+
+
+def _sorted_list(backend, documents: List[SearchModel]):
+    return sorted(documents, key=lambda x: x.score, reverse=backend not in ASCENDING_BACKENDS)
+
+
+def reciprocal_rank_fusion(ranked_lists: List[Tuple[str, List[SearchModel]]], k=60, weights=None):
+    """
+    RRF 融合：score = Σ weight(backend) / (k + rank)
+    只依赖每个列表内的排名，不需要不同后端的分数在同一个量纲上
+    :param ranked_lists: [(backend, documents), ...]，每个 (查询, 知识库, 后端) 对应一个列表
+    :return: 按融合分数从高到低排序、按 chunk_id 去重后的 [(document, score), ...]
+    """
+    weights = weights or {}
+    fused = {}
+    for backend, documents in ranked_lists:
+        weight = weights.get(backend, 1.0)
+        for rank, document in enumerate(_sorted_list(backend, documents), start=1):
+            key = _document_key(document)
+            score = weight / (k + rank)
+            if key in fused:
+                fused[key][1] += score
+            else:
+                fused[key] = [document, score]
+
+    return sorted(((document, score) for document, score in fused.values()), key=lambda x: x[1], reverse=True)
+
+
+def weighted_score_fusion(ranked_lists: List[Tuple[str, List[SearchModel]]], weights=None):
+    """
+    加权分数融合：每个列表内做 min-max 归一化（L2 距离取反），再按后端权重累加
+    """
+    weights = weights or {}
+    fused = {}
+    for backend, documents in ranked_lists:
+        if not documents:
+            continue
+
+        weight = weights.get(backend, 1.0)
+        scores = [document.score for document in documents]
+        min_score, max_score = min(scores), max(scores)
+        score_range = max_score - min_score
+        for document in documents:
+            if score_range == 0:
+                normalized = 1.0
+            elif backend in ASCENDING_BACKENDS:
+                normalized = (max_score - document.score) / score_range
+            else:
+                normalized = (document.score - min_score) / score_range
+
+            key = _document_key(document)
+            if key not in fused:
+                fused[key] = [document, {}]
+            # 同一个 chunk 被同一后端的多个查询召回时取最高分，不同后端的分数再按权重累加
+            backend_scores = fused[key][1]
+            backend_scores[backend] = max(backend_scores.get(backend, 0.0), weight * normalized)
+
+    return sorted(((document, sum(backend_scores.values())) for document, backend_scores in fused.values()),
+                  key=lambda x: x[1], reverse=True)
@@ -0,0 +1,559 @@
+"""
+进程内的本地检索后端，rag.backend 为 local 时替代 Milvus 和 ES，单机部署和离线评测不需要任何外部服务：
+1. LocalVectorStore：每个集合由只追加的数据段组成，向量矩阵保存为 .npy 文件，以只读内存映射的方式打开，暴力（Flat）检索
+2. LocalLexicalStore：每个索引的文档追加写入 JSONL 文件，加载时在内存中建立 BM25 倒排表
+数据目录由 rag.local_store_dir 配置
+"""
+import os
+import re
+import json
+import math
+import heapq
+import shutil
+import asyncio
+import threading
+from collections import Counter
+
+import numpy as np
+from loguru import logger
+from deepsleep.settings import app_settings
+from deepsleep.schema.search import SearchModel
+from deepsleep.services.rag.embedding import get_embedding
+from deepsleep.services.rag.rerank import BM25RerankBackend
+from deepsleep.services.rag.store import VectorStore, LexicalStore
+
+VECTOR_FIELDS = ["embedding", "embedding_summary"]
+TEXT_FIELDS = ["content", "summary"]
+# 集合名称作为目录名，只保留安全的字符
+SAFE_NAME_PATTERN = re.compile(r'[^0-9A-Za-z_\-]')
+
+
+def _safe_name(name):
+    return SAFE_NAME_PATTERN.sub('_', name)
+
+
+def _replace_file(path, write):
+    """先写临时文件再替换，写入中途退出不会留下不完整的文件"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        write(f)
+    os.replace(temp_path, path)
+
+
+def _search_model(row, score):
+    return SearchModel(chunk_id=row["chunk_id"], content=row["content"], score=score, file_id=row["file_id"],
+                       file_name=row["file_name"], update_time=row["update_time"],
+                       knowledge_id=row["knowledge_id"], summary=row["summary"])
+
+
+def _chunk_row(chunk):
+    return {"chunk_id": chunk.chunk_id, "content": chunk.content, "summary": chunk.summary or "",
+            "file_id": chunk.file_id, "file_name": chunk.file_name, "knowledge_id": chunk.knowledge_id,
+            "update_time": chunk.update_time}
+
+
+class LocalSegment:
+    """
+    集合中的一个数据段：rows.jsonl 保存标量字段，<field>.npy 保存对应顺序的 float32 向量矩阵，写入后不再修改
+    deleted 为每行是否已删除的标记，删除时整体替换，不修改正在被检索使用的数组
+    """
+    def __init__(self, name, rows, vectors, deleted=None, norms=None):
+        self.name = name
+        self.rows = rows
+        self.vectors = vectors
+        self.norms = norms if norms is not None else \
+            {field: np.einsum('ij,ij->i', matrix, matrix) for field, matrix in vectors.items()}
+        self.deleted = deleted if deleted is not None else np.zeros(len(rows), dtype=bool)
+
+    @property
+    def live(self):
+        return len(self.rows) - int(self.deleted.sum())
+
+    @classmethod
+    def open(cls, path, name, deleted_indexes=None):
+        with open(os.path.join(path, "rows.jsonl"), 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        # 以内存映射方式打开，矩阵数据由操作系统按需换入，不常驻进程内存
+        vectors = {field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode='r') for field in VECTOR_FIELDS}
+        deleted = np.zeros(len(rows), dtype=bool)
+        if deleted_indexes:
+            deleted[deleted_indexes] = True
+        return cls(name, rows, vectors, deleted)
+
+    @classmethod
+    def write(cls, path, name, rows, vectors):
+        """先写到临时目录再改名，写入中途退出不会留下不完整的数据段"""
+        temp_path = f"{path}.tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        for field in VECTOR_FIELDS:
+            np.save(os.path.join(temp_path, f"{field}.npy"), vectors[field])
+        with open(os.path.join(temp_path, "rows.jsonl"), 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+        os.replace(temp_path, path)
+        return cls.open(path, name)
+
+    def with_deleted(self, indexes):
+        deleted = self.deleted.copy()
+        deleted[indexes] = True
+        return LocalSegment(self.name, self.rows, self.vectors, deleted, self.norms)
+
+    def live_data(self):
+        keep = np.flatnonzero(~self.deleted)
+        return [self.rows[index] for index in keep], \
+            {field: np.asarray(self.vectors[field][keep], dtype=np.float32) for field in VECTOR_FIELDS}
+
+    def search(self, query_vectors, query_norms, field, top_k):
+        """返回每条查询在本数据段中最近的 top_k 个 (距离, 行)"""
+        if not self.live:
+            return [[] for _ in query_vectors]
+
+        # ||q - x||² = ||q||² + ||x||² - 2 q·x，与 Milvus 的 L2 一样返回平方距离
+        distances = query_norms[:, None] + self.norms[field][None, :] - 2 * (query_vectors @ self.vectors[field].T)
+        distances[:, self.deleted] = np.inf
+
+        top_k = min(top_k, self.live)
+        results = []
+        for row_distances in distances:
+            indexes = np.argpartition(row_distances, top_k - 1)[:top_k]
+            results.append([(float(max(row_distances[index], 0.0)), self.rows[index]) for index in indexes])
+        return results
+
+
+class LocalCollection:
+    """
+    一个向量集合，由只追加的数据段组成，写入只新建一个数据段，不重写已有的数据：
+    1. manifest.json 记录维度和当前有效的数据段，替换 manifest 是数据段变化的提交点
+    2. 删除只在 deleted.jsonl 中追加 (数据段, 行号)
+    3. 最后两个数据段的存活行数接近时合并（类似二进制计数），数据段数和每行被重写的次数都是 O(log N)；
+       删除的行超过存活的行时整体重写成一个数据段
+    """
+    def __init__(self, path):
+        self.path = path
+        self.dim = None
+        self.next_id = 0
+        # 数据段列表整体替换，检索时一次取出保证一致
+        self.segments = []
+        # 上次提交之后新写入的数据段，合并的中间结果在提交时清理
+        self._created = []
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.path, "manifest.json")
+
+    @property
+    def _deleted_path(self):
+        return os.path.join(self.path, "deleted.jsonl")
+
+    def _segment_path(self, name):
+        return os.path.join(self.path, "segments", name)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "manifest.json")) or os.path.exists(os.path.join(path, "rows.jsonl"))
+
+    def _upgrade_legacy(self):
+        """旧版本的集合只有一个 rows.jsonl + <field>.npy，直接作为第一个数据段"""
+        name = f"{self.next_id:06d}"
+        os.makedirs(self._segment_path(name))
+        for file_name in ["rows.jsonl"] + [f"{field}.npy" for field in VECTOR_FIELDS]:
+            os.replace(os.path.join(self.path, file_name), os.path.join(self._segment_path(name), file_name))
+        self.dim = np.load(os.path.join(self._segment_path(name), "embedding.npy"), mmap_mode='r').shape[1]
+        self.next_id = 1
+        self._write_manifest([name])
+
+    def load(self):
+        if not os.path.exists(self._manifest_path):
+            self._upgrade_legacy()
+        with open(self._manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.dim, self.next_id = manifest["dim"], manifest["next_id"]
+
+        deleted = {}
+        if os.path.exists(self._deleted_path):
+            with open(self._deleted_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        deleted.setdefault(record["segment"], []).append(record["index"])
+        # 不在 manifest 中的数据段已经被合并，对应的删除记录直接忽略
+        self.segments = [LocalSegment.open(self._segment_path(name), name, deleted.get(name))
+                         for name in manifest["segments"]]
+        self._remove_orphans(manifest["segments"])
+        return self
+
+    def _remove_orphans(self, names):
+        """清理不在 manifest 中的数据段目录（写入或合并中途退出时留下的）"""
+        segments_path = os.path.join(self.path, "segments")
+        if not os.path.isdir(segments_path):
+            return
+        for name in set(os.listdir(segments_path)) - set(names):
+            shutil.rmtree(os.path.join(segments_path, name), ignore_errors=True)
+
+    def _write_manifest(self, names):
+        manifest = {"dim": self.dim, "next_id": self.next_id, "segments": names}
+        _replace_file(self._manifest_path, lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+
+    def create(self, dim):
+        os.makedirs(self.path, exist_ok=True)
+        self.dim = dim
+        self._write_manifest([])
+        return self
+
+    def _new_segment(self, rows, vectors):
+        name = f"{self.next_id:06d}"
+        self.next_id += 1
+        segment = LocalSegment.write(self._segment_path(name), name, rows, vectors)
+        self._created.append(segment)
+        return segment
+
+    def _merge(self, segments):
+        rows, vectors = [], {field: [] for field in VECTOR_FIELDS}
+        for segment in segments:
+            segment_rows, segment_vectors = segment.live_data()
+            rows.extend(segment_rows)
+            for field in VECTOR_FIELDS:
+                vectors[field].append(segment_vectors[field])
+        return self._new_segment(rows, {field: np.concatenate(vectors[field]) for field in VECTOR_FIELDS})
+
+    def _commit(self, segments):
+        """提交新的数据段列表，再清理被合并的数据段（包括合并过程中的中间数据段）和它们的删除记录"""
+        self._write_manifest([segment.name for segment in segments])
+        names = {segment.name for segment in segments}
+        obsolete = [segment for segment in self.segments + self._created if segment.name not in names]
+        self.segments = segments
+        self._created = []
+
+        for segment in obsolete:
+            shutil.rmtree(self._segment_path(segment.name), ignore_errors=True)
+        if any(segment.deleted.any() for segment in obsolete):
+            records = [{"segment": segment.name, "index": int(index)}
+                       for segment in segments for index in np.flatnonzero(segment.deleted)]
+            _replace_file(self._deleted_path, lambda f: f.writelines(
+                (json.dumps(record) + "\n").encode('utf-8') for record in records))
+
+    def iter_rows(self):
+        for segment in self.segments:
+            for index in np.flatnonzero(~segment.deleted):
+                yield segment.rows[index]
+
+    def append(self, rows, vectors):
+        for field in VECTOR_FIELDS:
+            if vectors[field].shape[1] != self.dim:
+                raise ValueError(f"vector dim {vectors[field].shape[1]} not match collection dim {self.dim}: "
+                                 f"{self.path}")
+
+        segments = self.segments + [self._new_segment(rows, vectors)]
+        while len(segments) >= 2 and segments[-2].live < 2 * segments[-1].live:
+            segments = segments[:-2] + [self._merge(segments[-2:])]
+        self._commit(segments)
+
+    def remove(self, predicate):
+        segments, records = [], []
+        for segment in self.segments:
+            indexes = [index for index, row in enumerate(segment.rows)
+                       if not segment.deleted[index] and predicate(row)]
+            if indexes:
+                segment = segment.with_deleted(indexes)
+                records.extend({"segment": segment.name, "index": index} for index in indexes)
+            segments.append(segment)
+        if not records:
+            return 0
+
+        with open(self._deleted_path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        self.segments = segments
+
+        live = sum(segment.live for segment in segments)
+        if sum(len(segment.rows) for segment in segments) - live > live:
+            self._commit([self._merge(segments)] if live else [])
+        return len(records)
+
+    def search(self, query_vectors, field, top_k):
+        segments = self.segments
+        query_norms = np.einsum('ij,ij->i', query_vectors, query_vectors)
+        candidates = [[] for _ in query_vectors]
+        for segment in segments:
+            for i, segment_results in enumerate(segment.search(query_vectors, query_norms, field, top_k)):
+                candidates[i].extend(segment_results)
+
+        return [[_search_model(row, distance) for distance, row in heapq.nsmallest(top_k, results, key=lambda x: x[0])]
+                for results in candidates]
+
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, root=None):
+        self.root = os.path.join(root or app_settings.rag.get('local_store_dir', 'deepsleep/data/local_store'),
+                                 "vectors")
+        self._collections = {}
+        self._lock = threading.RLock()
+
+    def _get(self, collection_name):
+        path = os.path.join(self.root, _safe_name(collection_name))
+        with self._lock:
+            collection = self._collections.get(collection_name)
+            if collection is None and LocalCollection.exists(path):
+                collection = self._collections[collection_name] = LocalCollection(path).load()
+            return collection
+
+    def _get_or_create(self, collection_name, dim):
+        with self._lock:
+            collection = self._get(collection_name)
+            if collection is None:
+                path = os.path.join(self.root, _safe_name(collection_name))
+                collection = self._collections[collection_name] = LocalCollection(path).create(dim)
+                logger.info(f'Successful create local collection: {collection_name}, dim: {dim}')
+            return collection
+
+    async def create_collection(self, collection_name):
+        dim = len(await get_embedding("dimension probe"))
+        await asyncio.to_thread(self._get_or_create, collection_name, dim)
+
+    async def insert(self, collection_name, chunks, flush=True):
+        # 本地集合每次写入都直接落盘，不需要单独 flush
+        rows = [_chunk_row(chunk) for chunk in chunks]
+        if not rows:
+            return
+
+        vectors = {
+            "embedding": np.asarray(await get_embedding([row["content"] for row in rows]), dtype=np.float32),
+            "embedding_summary": np.asarray(await get_embedding([row["summary"] for row in rows]), dtype=np.float32)
+        }
+
+        def insert_rows():
+            with self._lock:
+                self._get_or_create(collection_name, vectors["embedding"].shape[1]).append(rows, vectors)
+
+        await asyncio.to_thread(insert_rows)
+
+    async def search_batch(self, queries, collection_names, anns_field="embedding", top_k=10,
+                           expr=None, partition_names=None):
+        # 每个知识库是独立的集合，expr / partition_names 只为兼容 Milvus 的调用方式
+        if isinstance(collection_names, str):
+            collection_names = [collection_names]
+
+        results = {collection_name: [[] for _ in queries] for collection_name in collection_names}
+        collections = {}
+        for collection_name in collection_names:
+            collection = await asyncio.to_thread(self._get, collection_name)
+            if collection is None:
+                logger.warning(f'Local collection name: {collection_name} not exist')
+                continue
+            collections[collection_name] = collection
+
+        if not queries or not collections:
+            return results
+
+        query_vectors = np.asarray(await get_embedding(list(queries)), dtype=np.float32)
+
+        def search_all():
+            for collection_name, collection in collections.items():
+                results[collection_name] = collection.search(query_vectors, anns_field, top_k)
+
+        await asyncio.to_thread(search_all)
+        return results
+
+    async def get_chunk_ids(self, file_id, collection_name):
+        collection = await asyncio.to_thread(self._get, collection_name)
+        if collection is None:
+            return set()
+        return {row["chunk_id"] for row in collection.iter_rows() if row["file_id"] == file_id}
+
+    async def _remove(self, collection_name, predicate):
+        def remove_rows():
+            with self._lock:
+                collection = self._get(collection_name)
+                return collection.remove(predicate) if collection is not None else 0
+
+        return await asyncio.to_thread(remove_rows)
+
+    async def delete_by_file_id(self, file_id, collection_name):
+        removed = await self._remove(collection_name, lambda row: row["file_id"] == file_id)
+        logger.info(f'Successfully deleted {removed} local vectors for file_id: {file_id}')
+
+    async def delete_by_chunk_ids(self, chunk_ids, collection_name):
+        if not chunk_ids:
+            return
+        chunk_ids = set(chunk_ids)
+        removed = await self._remove(collection_name, lambda row: row["chunk_id"] in chunk_ids)
+        logger.info(f'Successfully deleted {removed} chunks in local collection: {collection_name}')
+
+    async def delete_collection(self, collection_name):
+        def drop():
+            with self._lock:
+                collection = self._get(collection_name)
+                if collection is None:
+                    return False
+                self._collections.pop(collection_name, None)
+                shutil.rmtree(collection.path)
+                return True
+
+        if await asyncio.to_thread(drop):
+            logger.info(f"本地集合 '{collection_name}' 删除成功。")
+
+
+class LexicalIndex:
+    """
+    一个词法索引：文档和删除记录追加写入 docs.jsonl，加载时重放日志并建立 content / summary 的倒排表
+    删除记录超过存活文档数时重写文件
+    """
+    def __init__(self, path, k1=1.2, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.rows = {}
+        # 字段 -> token -> {chunk_id: 词频}
+        self.postings = {field: {} for field in TEXT_FIELDS}
+        # 字段 -> {chunk_id: 文档长度}
+        self.lengths = {field: {} for field in TEXT_FIELDS}
+        self.total_lengths = {field: 0 for field in TEXT_FIELDS}
+        self.tombstones = 0
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record.get("deleted"):
+                        self._remove(record["chunk_id"])
+                        self.tombstones += 1
+                    else:
+                        self._add(record)
+        return self
+
+    def _add(self, row):
+        # 与 ES 一样按 chunk_id 覆盖写入
+        self._remove(row["chunk_id"])
+        self.rows[row["chunk_id"]] = row
+        for field in TEXT_FIELDS:
+            tokens = BM25RerankBackend.tokenize(row[field] or "")
+            for token, frequency in Counter(tokens).items():
+                self.postings[field].setdefault(token, {})[row["chunk_id"]] = frequency
+            self.lengths[field][row["chunk_id"]] = len(tokens)
+            self.total_lengths[field] += len(tokens)
+
+    def _remove(self, chunk_id):
+        row = self.rows.pop(chunk_id, None)
+        if row is None:
+            return False
+        for field in TEXT_FIELDS:
+            for token in set(BM25RerankBackend.tokenize(row[field] or "")):
+                postings = self.postings[field].get(token)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self.postings[field][token]
+            self.total_lengths[field] -= self.lengths[field].pop(chunk_id, 0)
+        return True
+
+    def _append_records(self, records):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+    def add(self, rows):
+        for row in rows:
+            self._add(row)
+        self._append_records(rows)
+
+    def remove(self, chunk_ids):
+        removed = [chunk_id for chunk_id in chunk_ids if self._remove(chunk_id)]
+        if not removed:
+            return 0
+
+        self.tombstones += len(removed)
+        if self.tombstones > len(self.rows):
+            _replace_file(self.path, lambda f: f.writelines(
+                (json.dumps(row, ensure_ascii=False) + "\n").encode('utf-8') for row in self.rows.values()))
+            self.tombstones = 0
+        else:
+            self._append_records([{"chunk_id": chunk_id, "deleted": True} for chunk_id in removed])
+        return len(removed)
+
+    def search(self, query, field, size):
+        total = len(self.rows)
+        query_tokens = set(BM25RerankBackend.tokenize(query))
+        if not total or not query_tokens:
+            return []
+
+        avg_length = self.total_lengths[field] / total or 1
+        lengths = self.lengths[field]
+        scores = Counter()
+        for token in query_tokens:
+            postings = self.postings[field].get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * lengths[chunk_id] / avg_length)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return [_search_model(self.rows[chunk_id], score) for chunk_id, score in scores.most_common(size)]
+
+
+class LocalLexicalStore(LexicalStore):
+    def __init__(self, root=None):
+        self.root = os.path.join(root or app_settings.rag.get('local_store_dir', 'deepsleep/data/local_store'),
+                                 "lexical")
+        self.size = app_settings.rag.get('local_search_size', 10)
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def _get(self, index_name):
+        with self._lock:
+            index = self._indexes.get(index_name)
+            if index is None:
+                path = os.path.join(self.root, f"{_safe_name(index_name)}.jsonl")
+                index = self._indexes[index_name] = LexicalIndex(path).load()
+            return index
+
+    async def index_documents(self, index_name, chunks):
+        rows = [_chunk_row(chunk) for chunk in chunks]
+        if not rows:
+            return 0, []
+
+        def add_rows():
+            with self._lock:
+                self._get(index_name).add(rows)
+
+        await asyncio.to_thread(add_rows)
+        logger.info(f'index name: {index_name} 本地索引写入 {len(rows)} 条')
+        return len(rows), []
+
+    async def _search(self, query, index_name, field):
+        def search():
+            with self._lock:
+                return self._get(index_name).search(query, field, self.size)
+
+        try:
+            return await asyncio.to_thread(search)
+        except Exception as e:
+            logger.error(f'Local search documents error: {e}')
+            return []
+
+    async def search_documents(self, query, index_name):
+        return await self._search(query, index_name, "content")
+
+    async def search_documents_summary(self, query, index_name):
+        return await self._search(query, index_name, "summary")
+
+    async def _remove(self, index_name, select):
+        def remove():
+            with self._lock:
+                index = self._get(index_name)
+                return index.remove(select(index))
+
+        return await asyncio.to_thread(remove)
+
+    async def delete_documents(self, file_id, index_name):
+        removed = await self._remove(index_name, lambda index: [chunk_id for chunk_id, row in index.rows.items()
+                                                                if row["file_id"] == file_id])
+        logger.info(f'Success delete {removed} local documents in file id: {file_id}')
+
+    async def delete_documents_by_chunk_ids(self, chunk_ids, index_name):
+        if not chunk_ids:
+            return
+        removed = await self._remove(index_name, lambda index: list(chunk_ids))
+        logger.info(f'Success delete {removed} chunks in local index: {index_name}')
@@ -1,86 +1,148 @@
+import asyncio
+
 from loguru import logger
 from deepsleep.settings import app_settings
-from deepsleep.services.rag.embedding import get_embedding
+from deepsleep.services.rag.embedding import get_embedding, get_embedding_dim
+from deepsleep.services.rag.vector_codec import encode_vectors, get_vector_type
 from deepsleep.schema.search import SearchModel
-from pymilvus import connections, Collection, utility, FieldSchema, DataType, CollectionSchema
+from deepsleep.services.rag.store import VectorStore
+from deepsleep.services.rag.milvus_collection import CollectionManager, MilvusTarget, LAYOUT_PARTITION, scope_expr
+from pymilvus import connections, FieldSchema, DataType, CollectionSchema
+
+VECTOR_FIELDS = ["embedding", "embedding_summary"]
 
 
-class MilvusClient:
+class MilvusClient(VectorStore):
     def __init__(self, **kwargs):
         self.milvus_host = app_settings.milvus.get('host')
         self.milvus_port = app_settings.milvus.get('port')
 
 
         connections.connect("default", host=self.milvus_host, port=self.milvus_port)
-        self.collections = self._get_collection()
+        # 集合按需获取、按需加载，不在启动时实例化所有集合
+        self.manager = CollectionManager()
 
     def _collection_exists(self, collection_name):
         """检查集合是否存在"""
-        return utility.has_collection(collection_name)
+        return self.manager.exists(collection_name)
+
+    @staticmethod
+    def _build_schema(collection_name, dim, partition_key=False):
+        """
+        向量维度与 Embedding 模型一致；milvus.vector_type 可选 FLOAT16_VECTOR / BFLOAT16_VECTOR，
+        milvus.summary_dim 配置后摘要向量只保留前 summary_dim 维（Matryoshka 截断）
+        partition_key 为 True 时 knowledge_id 作为 partition key，用于多个知识库共用的集合
+        """
+        vector_type = get_vector_type(app_settings.milvus.get('vector_type'))
+        summary_dim = min(app_settings.milvus.get('summary_dim') or dim, dim)
+        fields = [
+            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+            FieldSchema(name="chunk_id", dtype=DataType.VARCHAR, max_length=128),
+            FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=1024),
+            FieldSchema(name="embedding", dtype=vector_type, dim=dim),
+            FieldSchema(name="summary", dtype=DataType.VARCHAR, max_length=512),
+            FieldSchema(name="embedding_summary", dtype=vector_type, dim=summary_dim),
+            FieldSchema(name="file_id", dtype=DataType.VARCHAR, max_length=128),
+            FieldSchema(name="file_name", dtype=DataType.VARCHAR, max_length=128),
+            FieldSchema(name="knowledge_id", dtype=DataType.VARCHAR, max_length=128, is_partition_key=partition_key),
+            FieldSchema(name="update_time", dtype=DataType.VARCHAR, max_length=128),
+        ]
+        return CollectionSchema(fields, description=f"RAG Collection: {collection_name}")
+
+    def _ensure_target(self, knowledge_id, dim):
+        """返回知识库对应的集合，不存在时按 milvus.layout 创建"""
+        # 创建前不使用“不存在”的缓存，集合可能刚被其他进程创建
+        target = self.manager.resolve(knowledge_id, cached=False)
+        if target is not None:
+            return target
+
+        if self.manager.layout == LAYOUT_PARTITION:
+            shared_collection = self.manager.shared_collection
+            if not self.manager.exists(shared_collection, cached=False):
+                self.manager.create(shared_collection, self._build_schema(shared_collection, dim, partition_key=True),
+                                    VECTOR_FIELDS, num_partitions=app_settings.milvus.get('num_partitions', 64))
+            return MilvusTarget(shared_collection, knowledge_id)
+
+        self.manager.create(knowledge_id, self._build_schema(knowledge_id, dim), VECTOR_FIELDS)
+        return MilvusTarget(knowledge_id, None)
+
+    @staticmethod
+    async def get_dim():
+        return app_settings.milvus.get('dim') or await get_embedding_dim()
 
     async def create_collection(self, collection_name):
-        if not self._collection_exists(collection_name):
-            """创建 Milvus 集合"""
-            fields = [
-                FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-                FieldSchema(name="chunk_id", dtype=DataType.VARCHAR, max_length=128),
-                FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=1024),
-                FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=768),
-                FieldSchema(name="summary", dtype=DataType.VARCHAR, max_lenth=512),
-                FieldSchema(name="embedding_summary", dtype=DataType.FLOAT_VECTOR, dim=768),
-                FieldSchema(name="file_id", dtype=DataType.VARCHAR, max_length=128),
-                FieldSchema(name="file_name", dtype=DataType.VARCHAR, max_length=128),
-                FieldSchema(name="knowledge_id", dtype=DataType.VARCHAR, max_length=128),
-                FieldSchema(name="update_time", dtype=DataType.VARCHAR, max_length=128),
-            ]
-
-            schema = CollectionSchema(fields, description=f"RAG Collection: {collection_name}")
-            collection = Collection(collection_name, schema)
-
-            # 创建索引
-            index_params = {
-                "index_type": "IVF_FLAT",
-                "metric_type": "L2",
-                "params": {"nlist": 128}
-            }
-            collection.create_index("embedding", index_params)
-            # 为embedding_summary字段创建索引
-            collection.create_index("embedding_summary", index_params)
-            self.collections[collection_name] = collection
-            logger.info(f'Successful create milvus collection name: {collection_name}')
+        """创建 Milvus 集合（partition 布局下只需要确保共享集合存在）"""
+        dim = await self.get_dim()
+        await asyncio.to_thread(self._ensure_target, collection_name, dim)
 
-    async def search(self, query, collection_name, top_k=10):
+    async def search_batch(self, queries, collection_names, anns_field="embedding", top_k=10,
+                           expr=None, partition_names=None):
         """
-            在指定集合中搜索相似数据
-            :param collection_name: 要搜索的集合名称
-            :param query: 查询文本
-            :param top_k: 返回的结果数量
-            :return: 搜索结果
+            批量检索：N 条查询只请求一次 Embedding，并在每个集合上只发送一次多向量 search
+            :param queries: 查询文本列表
+            :param collection_names: 要搜索的集合名称列表
+            :param anns_field: 检索的向量字段，embedding 或 embedding_summary
+            :param top_k: 每条查询返回的结果数量
+            :param expr: 标量过滤表达式，共享集合中会再加上 knowledge_id 的过滤
+            :param partition_names: 只在指定的分区中检索
+            :return: {collection_name: [第 i 条查询的结果列表, ...]}
         """
-        # 获取集合实例
-        collection = self.collections.get(collection_name)
-
-        # 生成查询向量
-        query_embedding = await get_embedding(query)
-
-        # 定义搜索参数
-        search_params = {
-            "metric_type": "L2",
-            "params": {"nprobe": 16}
-        }
-
-        # 执行搜索
-        results = collection.search(
-            data=[query_embedding],
-            anns_field="embedding",  # 向量字段名
-            param=search_params,
-            limit=top_k,
-            output_fields=["content", "chunk_id", "summary", "file_id", "file_name", "knowledge_id", "update_time"]  # 返回的字段
-        )
-
+        if isinstance(collection_names, str):
+            collection_names = [collection_names]
+
+        results = {collection_name: [[] for _ in queries] for collection_name in collection_names}
+        if not queries or not collection_names:
+            return results
+
+        def resolve_targets():
+            return {collection_name: self.manager.resolve(collection_name) for collection_name in collection_names}
+
+        targets = {}
+        for collection_name, target in (await asyncio.to_thread(resolve_targets)).items():
+            if target is None:
+                logger.warning(f'Milvus collection name: {collection_name} not exist')
+                continue
+            targets[collection_name] = target
+
+        if not targets:
+            return results
+
+        # 所有查询只生成一次向量
+        query_embeddings = await get_embedding(list(queries))
+
+        def search_target(target: MilvusTarget):
+            collection = self.manager.acquire(target)
+            # 查询向量按集合字段的存储类型和维度转换
+            vector_type, dim = self.manager.vector_fields(target.collection_name)[anns_field]
+            return collection.search(
+                data=encode_vectors(query_embeddings, vector_type, dim),
+                anns_field=anns_field,  # 向量字段名
+                # 检索参数与集合实际的索引类型一致
+                param=self.manager.search_params(target.collection_name, anns_field),
+                limit=top_k,
+                expr=scope_expr(target, expr),
+                partition_names=None if target.knowledge_id else partition_names,
+                output_fields=["content", "chunk_id", "summary", "file_id", "file_name", "knowledge_id", "update_time"]  # 返回的字段
+            )
+
+        async def search_collection(collection_name, target):
+            try:
+                # pymilvus 的 search 为同步调用，放到线程中执行避免阻塞事件循环
+                hits_list = await asyncio.to_thread(search_target, target)
+                results[collection_name] = [self._format_hits(hits) for hits in hits_list]
+            except Exception as err:
+                # 单个集合检索失败不影响其他集合的结果，下次检索重新加载该集合
+                self.manager.invalidate(target)
+                logger.error(f'Milvus search collection name: {collection_name} error: {err}')
+
+        await asyncio.gather(*[search_collection(name, target) for name, target in targets.items()])
+        return results
+
+    @staticmethod
+    def _format_hits(hits):
         # 格式化结果
         documents = []
-        for hit in results[0]:
+        for hit in hits:
             documents.append(
                 SearchModel(
                     content=hit.entity.get("content", ""),  # 获取内容
@@ -91,9 +153,19 @@ class MilvusClient:
                     update_time=hit.entity.get("update_time", ""),  # 获取更新时间
                     summary=hit.entity.get("summary", ""),
                     score=hit.distance))
-
         return documents
 
+    async def search(self, query, collection_name, top_k=10):
+        """
+            在指定集合中搜索相似数据
+            :param collection_name: 要搜索的集合名称
+            :param query: 查询文本
+            :param top_k: 返回的结果数量
+            :return: 搜索结果
+        """
+        results = await self.search_batch([query], [collection_name], "embedding", top_k)
+        return results[collection_name][0]
+
     async def search_summary(self, query, collection_name, top_k=10):
         """
         在指定集合中搜索相似数据
@@ -102,73 +174,72 @@ class MilvusClient:
         :param top_k: 返回的结果数量
         :return: 搜索结果
         """
-        # 获取集合实例
-        collection = self.collections.get(collection_name)
-
-        # 生成查询向量
-        query_embedding = await get_embedding(query)
-
-        # 定义搜索参数
-        search_params = {
-            "metric_type": "L2",
-            "params": {"nprobe": 16}
-        }
-
-        # 执行搜索
-        results = collection.search(
-            data=[query_embedding],
-            anns_field="embedding_summary",  # 向量字段名
-            param=search_params,
-            limit=top_k,
-            output_fields=["content", "chunk_id", "summary", "file_id", "file_name", "knowledge_id", "update_time"]  # 返回的字段
-        )
-
-        # 格式化结果
-        documents = []
-        for hit in results[0]:
-            documents.append(
-                SearchModel(
-                    content=hit.entity.get("content", ""),  # 获取内容
-                    chunk_id=hit.entity.get("chunk_id", ""),  # 获取块 ID
-                    file_id=hit.entity.get("file_id", ""),  # 获取文件 ID
-                    file_name=hit.entity.get("file_name", ""),  # 获取文件名
-                    knowledge_id=hit.entity.get("knowledge_id", ""),  # 获取知识库 ID
-                    update_time=hit.entity.get("update_time", ""),  # 获取更新时间
-                    summary=hit.entity.get("summary", ""),
-                    score=hit.distance))
-
-        return documents
+        results = await self.search_batch([query], [collection_name], "embedding_summary", top_k)
+        return results[collection_name][0]
 
     async def delete_by_file_id(self, file_id, collection_name):
-        # 获取集合实例
-        collection = self.collections.get(collection_name)
         try:
+            target = await asyncio.to_thread(self.manager.resolve, collection_name)
+            if target is None:
+                logger.info(f'Milvus collection name: {collection_name} not exist')
+                return
+            # 按非主键的表达式删除时集合必须已加载
+            collection = await asyncio.to_thread(self.manager.acquire, target)
+
             # 构造正确的查询表达式（假设 file_id 是字符串类型）
-            query_expr = f'file_id == "{file_id}"'
-
-            # 查询符合条件的文档
-            results = collection.query(query_expr, output_fields=["id"])
-            delete_ids = [result['id'] for result in results]
-
-            # 如果找到匹配的文档，执行删除操作
-            if delete_ids:
-                # 将列表转换为 Milvus 支持的字符串格式
-                delete_expr = f"id in {delete_ids}"
-                collection.delete(delete_expr)
-                logger.info(f'Successfully deleted {len(delete_ids)} documents for file_id: {file_id}')
-            else:
-                logger.info(f'No documents found for file_id: {file_id}')
+            query_expr = scope_expr(target, f'file_id == "{file_id}"')
+
+            await asyncio.to_thread(collection.delete, query_expr)
+            logger.info(f'Successfully deleted documents for file_id: {file_id}')
         except ValueError as e:
             logger.error(f'ValueError occurred while deleting file_id:{file_id}: {e}')
         except Exception as e:
             logger.error(f'Unexpected error occurred while deleting  file_id:{file_id}: {e}')
 
 
-    async def insert(self, collection_name, chunks):
-        """插入数据到当前集合"""
-        if collection_name not in self.collections:
-            await self.create_collection(collection_name)
-            # raise ValueError("Collection is not set. Use set_collection() first.")
+    async def get_chunk_ids(self, file_id, collection_name, batch_size=1000):
+        """查询某个文件已经入库的所有 chunk_id"""
+        def query_chunk_ids():
+            chunk_ids = set()
+            target = self.manager.resolve(collection_name)
+            if target is None:
+                return chunk_ids
+
+            collection = self.manager.acquire(target)
+            iterator = collection.query_iterator(batch_size=batch_size,
+                                                 expr=scope_expr(target, f'file_id == "{file_id}"'),
+                                                 output_fields=["chunk_id"])
+            try:
+                while True:
+                    results = iterator.next()
+                    if not results:
+                        break
+                    chunk_ids.update(result['chunk_id'] for result in results)
+            finally:
+                iterator.close()
+            return chunk_ids
+
+        return await asyncio.to_thread(query_chunk_ids)
+
+    async def delete_by_chunk_ids(self, chunk_ids, collection_name):
+        if not chunk_ids:
+            return
+        target = await asyncio.to_thread(self.manager.resolve, collection_name)
+        if target is None:
+            return
+        try:
+            delete_expr = scope_expr(target, f"chunk_id in {list(chunk_ids)}")
+            # 按非主键的表达式删除时集合必须已加载
+            collection = await asyncio.to_thread(self.manager.acquire, target)
+            await asyncio.to_thread(collection.delete, delete_expr)
+            logger.info(f'Successfully deleted {len(chunk_ids)} chunks in collection: {collection_name}')
+        except Exception as e:
+            logger.error(f'Delete chunks in collection: {collection_name} error: {e}')
+            raise
+
+    async def insert(self, collection_name, chunks, flush=True):
+        """插入数据到当前集合，flush 为 False 时由调用方之后批量 flush"""
+        target = await asyncio.to_thread(self._ensure_target, collection_name, await self.get_dim())
         content_list, summary_list, chunk_id_list, file_id_list, file_name_list, update_time_list, knowledge_id_list = [], [], [], [], [], [], []
 
         for chunk in chunks:
@@ -178,12 +249,18 @@ class MilvusClient:
             file_id_list.append(chunk.file_id)
             file_name_list.append(chunk.file_name)
             update_time_list.append(chunk.update_time)
-            knowledge_id_list.append(chunk.knowledge_id)
+            # 共享集合中 knowledge_id 决定数据所在的分区，必须与集合名称（知识库 ID）一致
+            knowledge_id_list.append(target.knowledge_id or chunk.knowledge_id)
 
 
         embedding_list = await get_embedding(content_list)
         embedding_summary_list = await get_embedding(summary_list)
 
+        # 按集合字段的存储类型（FLOAT / FLOAT16 / BFLOAT16）和维度转换向量
+        vector_fields = await asyncio.to_thread(self.manager.vector_fields, target.collection_name)
+        embedding_list = encode_vectors(embedding_list, *vector_fields["embedding"])
+        embedding_summary_list = encode_vectors(embedding_summary_list, *vector_fields["embedding_summary"])
+
         # 组织数据
         data = [
             chunk_id_list,  # chunk_id
@@ -197,33 +274,43 @@ class MilvusClient:
             update_time_list  # update_time
         ]
 
-        # 获取collection_name 的对象
-        collection = self.collections.get(collection_name)
-        collection.insert(data)
-        collection.flush()
+        # 获取collection_name 的对象，partition 布局下由 knowledge_id 路由到对应的分区
+        collection = self.manager.get(target.collection_name)
+
+        def insert_data():
+            collection.insert(data)
+            if flush:
+                collection.flush()
+
+        await asyncio.to_thread(insert_data)
+
+    async def flush(self, collection_names):
+        """批量 flush：partition 布局下多个知识库共用的集合只 flush 一次"""
+        def flush_collections():
+            flushed = set()
+            for collection_name in collection_names:
+                target = self.manager.resolve(collection_name)
+                if target is None or target.collection_name in flushed:
+                    continue
+                self.manager.get(target.collection_name).flush()
+                flushed.add(target.collection_name)
+            return flushed
+
+        flushed = await asyncio.to_thread(flush_collections)
+        logger.info(f'Milvus flush {len(flushed)} collections')
 
     async def delete_collection(self, collection_name):
         """
-        删除一个集合
+        删除一个集合（partition 布局下删除共享集合中该知识库的数据）
         :param collection_name: 要删除的集合名称
         """
-        if collection_name not in self.collections:
-            print(f"集合 '{collection_name}' 不存在，无法删除。")
+        target = await asyncio.to_thread(self.manager.resolve, collection_name)
+        if target is None:
+            logger.info(f"集合 '{collection_name}' 不存在，无法删除。")
             return
 
-        # 删除集合
-        Collection(collection_name).drop()
-        print(f"集合 '{collection_name}' 删除成功。")
-
-        # 更新集合列表
-        self.collections.pop(collection_name)
-
-    # 获取单机Host中所有的集合
-    def _get_collection(self):
-        collections = {}
-        for collection in utility.list_collections():
-            collections[collection] = Collection(collection)
-        return collections
+        await asyncio.to_thread(self.manager.drop, target)
+        logger.info(f"集合 '{collection_name}' 删除成功。")
 
     def close(self):
         connections.disconnect("default")
@@ -0,0 +1,237 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+from loguru import logger
+from deepsleep.settings import app_settings
+from deepsleep.utils.cache import TTLLRUCache
+from pymilvus import Collection, utility
+
+# 索引类型 -> (建索引参数, 检索参数)
+INDEX_PRESETS = {
+    "IVF_FLAT": ({"nlist": 128}, {"nprobe": 16}),
+    # 标量量化，每维 1 字节，内存约为 IVF_FLAT 的 1/4
+    "IVF_SQ8": ({"nlist": 128}, {"nprobe": 16}),
+    "HNSW": ({"M": 16, "efConstruction": 200}, {"ef": 64}),
+    "IVF_PQ": ({"nlist": 1024, "m": 16, "nbits": 8}, {"nprobe": 32}),
+    "DISKANN": ({}, {"search_list": 100}),
+}
+
+# 每个知识库一个集合 / 多个知识库共用一个以 knowledge_id 为 partition key 的集合
+LAYOUT_COLLECTION = "collection"
+LAYOUT_PARTITION = "partition"
+
+# 知识库对应的集合，knowledge_id 为 None 时表示独立的集合，否则在共享集合中按 knowledge_id 过滤
+MilvusTarget = namedtuple("MilvusTarget", ["collection_name", "knowledge_id"])
+
+
+def scope_expr(target: MilvusTarget, expr=None):
+    """共享集合中把检索、删除限定在知识库自己的数据上，knowledge_id 为 partition key 时 Milvus 只扫描对应的分区"""
+    if target.knowledge_id is None:
+        return expr
+    knowledge_expr = f'knowledge_id == "{target.knowledge_id}"'
+    return f'({knowledge_expr}) and ({expr})' if expr else knowledge_expr
+
+
+def get_index_params(index_type=None, metric_type=None):
+    """新建集合时使用的索引参数，milvus.index_params 中的配置覆盖默认值"""
+    index_type = (index_type or app_settings.milvus.get('index_type', 'IVF_FLAT')).upper()
+    if index_type not in INDEX_PRESETS:
+        raise ValueError(f"unsupported milvus index type: {index_type}, supported: {list(INDEX_PRESETS)}")
+
+    params = dict(INDEX_PRESETS[index_type][0])
+    params.update((app_settings.milvus.get('index_params') or {}).get(index_type, {}))
+    return {
+        "index_type": index_type,
+        "metric_type": metric_type or app_settings.milvus.get('metric_type', 'L2'),
+        "params": params
+    }
+
+
+def get_search_params(index_type, metric_type):
+    """按集合实际使用的索引类型生成检索参数，milvus.search_params 中的配置覆盖默认值"""
+    index_type = (index_type or "IVF_FLAT").upper()
+    params = dict(INDEX_PRESETS.get(index_type, ({}, {}))[1])
+    params.update((app_settings.milvus.get('search_params') or {}).get(index_type, {}))
+    return {"metric_type": metric_type or "L2", "params": params}
+
+
+class CollectionManager:
+    """
+    Milvus 集合的生命周期管理：
+    1. 集合对象按需创建，启动时不再为 Host 上的每个集合实例化 Collection
+    2. 检索前才 load 集合，已加载的集合按 LRU 记录，超过 milvus.max_loaded 时 release 最久未使用的
+    3. 检索参数按集合实际的索引类型生成，新旧索引类型的集合可以共存
+    4. milvus.layout 为 partition 时，新的知识库写入以 knowledge_id 为 partition key 的共享集合，
+       不再为每个知识库创建分区，知识库数量不受 maxPartitionNum 限制；已经存在的独立集合继续使用
+    5. 集合是否存在的查询结果在进程内缓存，不存在的结果缓存 milvus.exists_cache_ttl 秒，
+       partition 布局下检索不会每次都请求 has_collection
+    load / release 在每个集合自己的锁中执行，全局锁只保护本地状态，冷集合加载时不阻塞其他集合的检索
+    所有方法都是同步调用，由调用方放到线程中执行
+    """
+    def __init__(self):
+        self.layout = app_settings.milvus.get('layout', LAYOUT_COLLECTION)
+        self.shared_collection = app_settings.milvus.get('shared_collection', 'deepsleep_shared')
+        self.max_loaded = app_settings.milvus.get('max_loaded', 64)
+        self._collections = {}
+        self._loaded = OrderedDict()
+        self._search_params = {}
+        self._vector_fields = {}
+        # 不存在的集合，key 为集合名称
+        self._missing = TTLLRUCache(max_size=10000, ttl=app_settings.milvus.get('exists_cache_ttl', 30))
+        self._load_locks = {}
+        self._lock = threading.RLock()
+
+    def exists(self, collection_name, cached=True):
+        """cached 为 False 时忽略不存在的缓存，创建集合前使用"""
+        with self._lock:
+            if collection_name in self._collections:
+                return True
+        if cached and collection_name in self._missing:
+            return False
+        if utility.has_collection(collection_name):
+            self._missing.pop(collection_name)
+            self.get(collection_name)
+            return True
+        self._missing.set(collection_name, True)
+        return False
+
+    def get(self, collection_name):
+        with self._lock:
+            collection = self._collections.get(collection_name)
+            if collection is None:
+                collection = self._collections[collection_name] = Collection(collection_name)
+            return collection
+
+    def resolve(self, knowledge_id, cached=True):
+        """返回知识库对应的 MilvusTarget，不存在时返回 None"""
+        if self.exists(knowledge_id, cached):
+            return MilvusTarget(knowledge_id, None)
+        if self.layout == LAYOUT_PARTITION and self.exists(self.shared_collection, cached):
+            return MilvusTarget(self.shared_collection, knowledge_id)
+        return None
+
+    def create(self, collection_name, schema, vector_fields, num_partitions=None):
+        """num_partitions 只用于带 partition key 的集合"""
+        kwargs = {"num_partitions": num_partitions} if num_partitions else {}
+        collection = Collection(collection_name, schema, **kwargs)
+        index_params = get_index_params()
+        for field in vector_fields:
+            collection.create_index(field, index_params)
+        with self._lock:
+            self._collections[collection_name] = collection
+        self._missing.pop(collection_name)
+        logger.info(f'Successful create milvus collection name: {collection_name}, index: {index_params}')
+        return collection
+
+    def _load_lock(self, collection_name):
+        with self._lock:
+            return self._load_locks.setdefault(collection_name, threading.Lock())
+
+    def acquire(self, target: MilvusTarget):
+        """检索、按表达式删除前调用：确保集合已加载，并更新 LRU 顺序；共享集合只加载一次"""
+        collection_name = target.collection_name
+        collection = self.get(collection_name)
+        with self._lock:
+            if collection_name in self._loaded:
+                self._loaded.move_to_end(collection_name)
+                return collection
+
+        # load 可能需要数秒，只持有该集合自己的锁，同一集合的并发请求只加载一次
+        with self._load_lock(collection_name):
+            with self._lock:
+                if collection_name in self._loaded:
+                    self._loaded.move_to_end(collection_name)
+                    return collection
+
+            collection.load()
+            logger.info(f'Load milvus collection: {collection_name}')
+
+            cold_collections = []
+            with self._lock:
+                self._loaded[collection_name] = True
+                while len(self._loaded) > self.max_loaded:
+                    cold_collection, _ = self._loaded.popitem(last=False)
+                    cold_collections.append(cold_collection)
+
+        for cold_collection in cold_collections:
+            with self._load_lock(cold_collection):
+                # 释放前可能已经被其他检索重新加载
+                with self._lock:
+                    if cold_collection in self._loaded:
+                        continue
+                self._release(cold_collection)
+        return collection
+
+    def _release(self, collection_name):
+        try:
+            self.get(collection_name).release()
+            logger.info(f'Release cold milvus collection: {collection_name}')
+        except Exception as err:
+            logger.error(f'Release milvus collection: {collection_name} error: {err}')
+
+    def invalidate(self, target: MilvusTarget):
+        """检索失败时（例如被其他进程 release）清除加载状态，下次检索重新 load"""
+        with self._lock:
+            self._loaded.pop(target.collection_name, None)
+
+    def search_params(self, collection_name, anns_field):
+        key = (collection_name, anns_field)
+        with self._lock:
+            params = self._search_params.get(key)
+        if params is not None:
+            return params
+
+        index_type, metric_type = None, None
+        for index in self.get(collection_name).indexes:
+            if index.field_name == anns_field:
+                index_type = index.params.get('index_type')
+                metric_type = index.params.get('metric_type')
+        params = get_search_params(index_type, metric_type)
+        with self._lock:
+            self._search_params[key] = params
+        return params
+
+    def vector_fields(self, collection_name):
+        """集合中向量字段的 {字段名: (类型, 维度)}，写入和检索时按字段转换向量"""
+        with self._lock:
+            fields = self._vector_fields.get(collection_name)
+        if fields is not None:
+            return fields
+
+        fields = {field.name: (field.dtype, field.params.get('dim'))
+                  for field in self.get(collection_name).schema.fields if 'dim' in field.params}
+        with self._lock:
+            self._vector_fields[collection_name] = fields
+        return fields
+
+    def forget(self, collection_name):
+        """集合在外部被删除或改名后，清除该集合的所有本地状态"""
+        self._missing.pop(collection_name)
+        with self._lock:
+            self._collections.pop(collection_name, None)
+            self._vector_fields.pop(collection_name, None)
+            self._loaded.pop(collection_name, None)
+            self._search_params = {key: value for key, value in self._search_params.items()
+                                   if key[0] != collection_name}
+
+    def drop(self, target: MilvusTarget):
+        """独立集合直接删除；共享集合中按 knowledge_id 删除该知识库的数据"""
+        if target.knowledge_id is not None:
+            # 按非主键的表达式删除时集合必须已加载
+            collection = self.acquire(target)
+            collection.delete(scope_expr(target))
+            return
+
+        with self._load_lock(target.collection_name):
+            with self._lock:
+                self._loaded.pop(target.collection_name, None)
+            self.get(target.collection_name).drop()
+            self.forget(target.collection_name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "layout": self.layout,
+                "collections": len(self._collections),
+                "loaded": list(self._loaded)
+            }
@@ -0,0 +1,117 @@
+"""
+按当前的 milvus 配置（向量类型、摘要向量维度、索引类型）重新编码已有的集合：
+新建临时集合 -> 按分区（partition key 集合整体）分批读出旧数据并转换 -> 校验条数 -> 删除旧集合并把临时集合改名为原名称
+向量直接由旧数据转换，不需要重新请求 Embedding 接口；向量维度保持与旧集合一致
+
+用法（在 src/backend 目录下执行）:
+    python -m deepsleep.services.rag.milvus_migrate --collection <集合名称>
+    python -m deepsleep.services.rag.milvus_migrate --all --keep-old
+"""
+import argparse
+
+from loguru import logger
+from deepsleep.settings import initialize_app_settings
+
+MIGRATING_SUFFIX = "_migrating"
+MIGRATE_FIELDS = ["chunk_id", "content", "embedding", "summary", "embedding_summary",
+                  "file_id", "file_name", "knowledge_id", "update_time"]
+
+
+def _convert_rows(rows, source_fields, target_fields):
+    from deepsleep.services.rag.vector_codec import decode_vector, encode_vectors
+
+    columns = {field: [row[field] for row in rows] for field in MIGRATE_FIELDS}
+    for field in ("embedding", "embedding_summary"):
+        source_type = source_fields[field][0]
+        vectors = [decode_vector(value, source_type) for value in columns[field]]
+        columns[field] = encode_vectors(vectors, *target_fields[field])
+    return [columns[field] for field in MIGRATE_FIELDS]
+
+
+def migrate_collection(collection_name, batch_size=1000, keep_old=False):
+    from pymilvus import utility
+    from deepsleep.settings import app_settings
+    from deepsleep.services.rag.milvus_client import client, MilvusClient, VECTOR_FIELDS
+
+    manager = client.manager
+    source = manager.get(collection_name)
+    source_fields = manager.vector_fields(collection_name)
+    dim = source_fields["embedding"][1]
+
+    temp_name = f"{collection_name}{MIGRATING_SUFFIX}"
+    if utility.has_collection(temp_name):
+        # 上一次迁移中断留下的临时集合
+        utility.drop_collection(temp_name)
+        manager.forget(temp_name)
+    # partition key 集合的分区由 Milvus 管理，不能手动创建或指定分区
+    partition_key = any(getattr(field, 'is_partition_key', False) for field in source.schema.fields)
+    target = manager.create(temp_name, MilvusClient._build_schema(collection_name, dim, partition_key), VECTOR_FIELDS,
+                            num_partitions=app_settings.milvus.get('num_partitions', 64) if partition_key else None)
+    target_fields = manager.vector_fields(temp_name)
+
+    source.load()
+    copied = 0
+    partition_names = [None] if partition_key else [partition.name for partition in source.partitions]
+    for partition_name in partition_names:
+        if partition_name not in (None, "_default"):
+            target.create_partition(partition_name)
+
+        iterator = source.query_iterator(batch_size=batch_size, output_fields=MIGRATE_FIELDS,
+                                         partition_names=[partition_name] if partition_name else None)
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                target.insert(_convert_rows(rows, source_fields, target_fields), partition_name=partition_name)
+                copied += len(rows)
+                logger.info(f"Migrate {collection_name}/{partition_name or ''}: {copied} rows")
+        finally:
+            iterator.close()
+    target.flush()
+
+    source_count = source.query(expr="", output_fields=["count(*)"])[0]["count(*)"]
+    if copied != source_count:
+        raise RuntimeError(f"migrate {collection_name} failed, copied {copied} rows, expected {source_count}, "
+                           f"temporary collection {temp_name} is kept for inspection")
+
+    if keep_old:
+        logger.info(f"Migrate {collection_name} finished, new collection: {temp_name}")
+        return temp_name
+
+    utility.drop_collection(collection_name)
+    utility.rename_collection(temp_name, collection_name)
+    manager.forget(collection_name)
+    manager.forget(temp_name)
+    logger.info(f"Migrate {collection_name} finished, {copied} rows, vector fields: {target_fields}")
+    return collection_name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按当前配置重新编码 Milvus 集合")
+    parser.add_argument("--config", default=None, help="配置文件路径，默认 deepsleep/config.yaml")
+    parser.add_argument("--collection", action="append", default=[], help="要迁移的集合，可以传多次")
+    parser.add_argument("--all", action="store_true", help="迁移 Host 上的所有集合")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--keep-old", action="store_true", help="保留旧集合，新集合使用 _migrating 后缀")
+    args = parser.parse_args()
+
+    # 必须在 import milvus_client 之前初始化配置
+    initialize_app_settings(args.config)
+    from pymilvus import utility
+    from deepsleep.services.rag.milvus_client import client
+
+    collections = args.collection
+    if args.all:
+        collections = [name for name in utility.list_collections() if not name.endswith(MIGRATING_SUFFIX)]
+
+    for collection_name in collections:
+        try:
+            migrate_collection(collection_name, args.batch_size, args.keep_old)
+        except Exception as err:
+            logger.error(f"Migrate {collection_name} error: {err}")
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
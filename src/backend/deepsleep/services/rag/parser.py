@@ -1,47 +1,54 @@
 import os
-import asyncio
+from datetime import datetime, timedelta
 
 from deepsleep.schema.chunk import ChunkModel
-from deepsleep.services.rag.doc_split.text import text_parser
-from deepsleep.services.rag.doc_split.markdown import markdown_parser
-from deepsleep.core.models.models import async_client
+from deepsleep.services.rag.doc_split.registry import parser_pool
+from deepsleep.services.rag.summary import summary_generator
+from deepsleep.utils.hash import sha256_hash
 
 
 class DocParser:
 
     @classmethod
-    async def parse_doc_into_chunks(cls, file_id, file_path, knowledge_id, max_concurrent_tasks=5):
-        file_suffix = file_path.split('.')[-1]
-        chunks = []
-        if file_suffix == 'md':
-            chunks = await markdown_parser.parse_into_chunks(file_id, file_path, knowledge_id)
-        elif file_suffix == 'txt':
-            chunks = await text_parser.parse_into_chunks(file_id, file_path, knowledge_id)
-        """其他文档"""
+    async def split_doc_into_chunks(cls, file_id, file_path, knowledge_id):
+        """只做文档切分，不生成摘要；按文件类型在解析进程池中切分"""
+        contents = await parser_pool.split(file_path)
+
+        update_time = datetime.utcnow() + timedelta(hours=8)
+        chunks = [ChunkModel(chunk_id="",
+                             content=content,
+                             file_id=file_id,
+                             file_name=os.path.basename(file_path),
+                             knowledge_id=knowledge_id,
+                             update_time=update_time) for content in contents]
+        return cls.fingerprint_chunks(file_id, chunks)
 
-        # 创建信号量，限制最大并发任务数
-        semaphore = asyncio.Semaphore(max_concurrent_tasks)
+    @classmethod
+    def fingerprint_chunks(cls, file_id, chunks):
+        """
+        用 chunk 内容的 hash 作为 chunk_id，相同内容重复解析得到相同的 chunk_id，
+        用于文件更新时和已入库的 chunk 做差异比较
+        """
+        occurrences = {}
+        for chunk in chunks:
+            fingerprint = sha256_hash(chunk.content)[:32]
+            # 同一个文件中内容完全相同的 chunk 用出现次数区分
+            count = occurrences.get(fingerprint, 0)
+            occurrences[fingerprint] = count + 1
+            chunk.chunk_id = f"{file_id}_{fingerprint}" if count == 0 else f"{file_id}_{fingerprint}_{count}"
+        return chunks
 
-        tasks = [asyncio.create_task(cls.generate_summary(chunk, semaphore)) for chunk in chunks]
-        chunks = asyncio.gather(*tasks)
+    @classmethod
+    async def parse_doc_into_chunks(cls, file_id, file_path, knowledge_id, max_concurrent_tasks=None):
+        chunks = await cls.split_doc_into_chunks(file_id, file_path, knowledge_id)
+
+        # 摘要按文件做 checkpoint，中断后重跑只会处理未完成的 chunk
+        chunks = await summary_generator.generate_summaries(chunks, file_id, max_concurrent_tasks)
 
         return chunks
 
     @classmethod
     async def generate_summary(cls, chunk: ChunkModel, semaphore):
-        async with semaphore:
-            prompt = f"""
-                你是一个专业的摘要生成助手，请根据以下要求为文本生成一段摘要：
-                ## 需要总结的文本：
-                {chunk.content}
-                ## 要求：
-                1. 摘要字数控制在 100 字左右。
-                2. 摘要中仅包含文字和字母，不得出现链接或其他特殊符号。
-                3. 只输出摘要部分，不准输出 `以下是文本的摘要` 等字段
-            """
-            response = async_client.ainvoke(prompt)
-            chunk.summary = response
-
-            return chunk
-
-doc_parser = DocParser()
\ No newline at end of file
+        return await summary_generator.generate_summary(chunk, semaphore)
+
+doc_parser = DocParser()
@@ -1,14 +1,47 @@
+import re
 import json
+import math
+import asyncio
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import List
 
 import aiohttp
+from loguru import logger
 from deepsleep.settings import app_settings
 from deepsleep.schema.rerank import RerankResultModel
+from deepsleep.utils.cache import TTLLRUCache
+from deepsleep.utils.hash import md5_hash
 
 
-class Reranker:
+class RerankBackend(ABC):
+    """Rerank 后端：对 (query, document) 打分，返回与 documents 等长的分数列表"""
+    name = ""
+    # 分数只和 (query, document) 有关时才能缓存
+    cacheable = True
 
-    @classmethod
-    async def request_rerank(cls, query, documents):
+    @abstractmethod
+    async def score(self, query, documents: List[str]) -> List[float]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class HttpRerankBackend(RerankBackend):
+    """远程 Rerank 接口，所有请求复用同一个连接池"""
+    name = "http"
+
+    def __init__(self):
+        self.session = None
+
+    async def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=app_settings.rerank.get('pool_size', 20))
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def request_rerank(self, query, documents):
         headers = {
             "Authorization": f"Bearer {app_settings.rerank.get('api_key')}",
             "Content-Type": "application/json"
@@ -20,30 +53,181 @@ class Reranker:
                 "documents": documents
             },
             "parameters": {
-                "return_documents": True,
-                "top_n": app_settings.rerank.get('top_n')
+                "return_documents": False,
+                # 需要所有文档的分数用于缓存，截断在合并缓存结果之后进行
+                "top_n": len(documents)
             }
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=app_settings.rerank.get('endpoint'), headers=headers, data=json.dumps(payload)) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result['result']
-                else:
-                    response.raise_for_status()
+        session = await self._get_session()
+        endpoint = app_settings.rerank.get('endpoint') or app_settings.rerank.get('base_url')
+        async with session.post(url=endpoint, headers=headers, data=json.dumps(payload)) as response:
+            if response.status == 200:
+                result = await response.json()
+                return result['output']['results'] if 'output' in result else result['result']
+            else:
+                response.raise_for_status()
+
+    async def score(self, query, documents):
+        results = await self.request_rerank(query, documents)
+        scores = [0.0] * len(documents)
+        for result in results:
+            scores[result['index']] = result['relevance_score']
+        return scores
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+
+class CrossEncoderRerankBackend(RerankBackend):
+    """本地 CPU Cross-Encoder，按批次向量化打分"""
+    name = "local"
+
+    def __init__(self):
+        self.model = None
+
+    def _load_model(self):
+        if self.model is None:
+            from sentence_transformers import CrossEncoder
+
+            self.model = CrossEncoder(app_settings.rerank.get('local_model', 'BAAI/bge-reranker-base'),
+                                      max_length=app_settings.rerank.get('max_length', 512),
+                                      device='cpu')
+            logger.info(f"Load local rerank model: {app_settings.rerank.get('local_model')}")
+        return self.model
+
+    def _predict(self, query, documents):
+        model = self._load_model()
+        pairs = [(query, document) for document in documents]
+        # 单标签模型默认经过 sigmoid，分数落在 0~1 之间
+        scores = model.predict(pairs, batch_size=app_settings.rerank.get('batch_size', 32))
+        return [float(score) for score in scores]
+
+    async def score(self, query, documents):
+        # 模型推理是 CPU 密集型操作，放到线程中执行
+        return await asyncio.to_thread(self._predict, query, documents)
+
+
+class BM25RerankBackend(RerankBackend):
+    """词法 BM25 打分，不依赖任何外部服务，作为兜底方案"""
+    name = "bm25"
+    # BM25 的 idf 和归一化依赖同一批文档，分数不能跨请求缓存
+    cacheable = False
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    @staticmethod
+    def tokenize(text):
+        text = text.lower()
+        try:
+            import jieba
+            return [token for token in jieba.lcut_for_search(text) if token.strip()]
+        except ImportError:
+            # 没有 jieba 时英文按单词切分，中文按单字切分
+            return re.findall(r'[a-z0-9]+|[一-鿿]', text)
+
+    def _score(self, query, documents):
+        tokenized_documents = [self.tokenize(document) for document in documents]
+        query_tokens = set(self.tokenize(query))
+        if not tokenized_documents or not query_tokens:
+            return [0.0] * len(documents)
+
+        avg_length = sum(len(tokens) for tokens in tokenized_documents) / len(tokenized_documents) or 1
+        document_frequency = Counter()
+        for tokens in tokenized_documents:
+            document_frequency.update(set(tokens))
+
+        scores = []
+        total = len(tokenized_documents)
+        for tokens in tokenized_documents:
+            term_frequency = Counter(tokens)
+            score = 0.0
+            for token in query_tokens:
+                if token not in term_frequency:
+                    continue
+                idf = math.log(1 + (total - document_frequency[token] + 0.5) / (document_frequency[token] + 0.5))
+                tf = term_frequency[token]
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * len(tokens) / avg_length))
+            scores.append(score)
+
+        # 归一化到 0~1，便于和其他后端共用 min_score 阈值
+        max_score = max(scores)
+        return [score / max_score if max_score > 0 else 0.0 for score in scores]
+
+    async def score(self, query, documents):
+        return self._score(query, documents)
+
+
+class Reranker:
+    backends = {
+        HttpRerankBackend.name: HttpRerankBackend(),
+        CrossEncoderRerankBackend.name: CrossEncoderRerankBackend(),
+        BM25RerankBackend.name: BM25RerankBackend()
+    }
+    # key: (backend, query, md5(document))
+    score_cache = TTLLRUCache(max_size=app_settings.rerank.get('cache_size', 50000),
+                              ttl=app_settings.rerank.get('cache_ttl', 3600))
+
+    @classmethod
+    def get_backend(cls, name=None):
+        name = name or app_settings.rerank.get('backend', HttpRerankBackend.name)
+        return cls.backends[name]
+
+    @classmethod
+    async def _score_with_cache(cls, backend: RerankBackend, query, documents):
+        if not backend.cacheable:
+            return await asyncio.wait_for(backend.score(query, documents), app_settings.rerank.get('timeout', 5))
+
+        scores = [None] * len(documents)
+        keys = [(backend.name, query, md5_hash(document)) for document in documents]
+        missing = []
+        for i, key in enumerate(keys):
+            score = cls.score_cache.get(key)
+            if score is None:
+                missing.append(i)
+            else:
+                scores[i] = score
+
+        if missing:
+            missing_documents = [documents[i] for i in missing]
+            missing_scores = await asyncio.wait_for(backend.score(query, missing_documents),
+                                                    app_settings.rerank.get('timeout', 5))
+            for i, score in zip(missing, missing_scores):
+                scores[i] = score
+                cls.score_cache.set(keys[i], score)
+        return scores
+
+    @classmethod
+    async def score_documents(cls, query, documents):
+        backend = cls.get_backend()
+        try:
+            return await cls._score_with_cache(backend, query, documents)
+        except Exception as err:
+            fallback = cls.get_backend(app_settings.rerank.get('fallback', BM25RerankBackend.name))
+            if fallback is backend:
+                raise
+            # 主后端超时或者失败时使用兜底后端，保证 RAG 可用
+            logger.warning(f"rerank backend {backend.name} error, fallback to {fallback.name}: {err!r}")
+            return await cls._score_with_cache(fallback, query, documents)
 
     @classmethod
     async def rerank_documents(cls, query, documents):
-        final_documents = []
-        original_documents = documents
+        if not documents:
+            return []
 
-        results = await cls.request_rerank(query, documents)
+        scores = await cls.score_documents(query, documents)
 
-        for result in results:
-            result['document'] = original_documents[result['index']]
+        final_documents = [RerankResultModel(query=query, content=document, score=score, index=index)
+                           for index, (document, score) in enumerate(zip(documents, scores))]
+        final_documents.sort(key=lambda x: x.score, reverse=True)
 
-            final_documents.append(RerankResultModel(query=query, content=result['document'],
-                                                     score=result['relevance_score'], index=result['index']))
-        return final_documents
+        top_n = app_settings.rerank.get('top_n')
+        return final_documents[:top_n] if top_n else final_documents
 
+    @classmethod
+    async def close(cls):
+        for backend in cls.backends.values():
+            await backend.close()
@@ -0,0 +1,179 @@
+import asyncio
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from loguru import logger
+from deepsleep.settings import app_settings
+from deepsleep.services.rag.embedding import get_embedding
+from deepsleep.utils.cache import TTLLRUCache
+
+GENERATION_PREFIX = 'semantic_cache:generation:'
+
+# lookup 的结果，store 时使用 lookup 时的 key（包含当时的知识库版本）写入
+SemanticCacheProbe = namedtuple("SemanticCacheProbe", ["key", "query", "vector"])
+
+
+class SemanticCacheBucket:
+    """同一组知识库、同一组召回参数下的缓存，向量按行存放，使用内积做暴力近邻检索"""
+    def __init__(self):
+        self.vectors = None
+        self.queries = []
+        self.answers = []
+        self.expire_at = []
+
+    def search(self, vector, threshold):
+        if self.vectors is None or not len(self.answers):
+            return None, 0.0
+
+        now = time.monotonic()
+        similarities = self.vectors @ vector
+        for i in np.argsort(-similarities):
+            if similarities[i] < threshold:
+                break
+            if self.expire_at[i] >= now:
+                return self.answers[i], float(similarities[i])
+        return None, 0.0
+
+    def add(self, query, vector, answer, ttl, max_entries):
+        now = time.monotonic()
+        # 先清理过期条目，再按写入顺序淘汰最早的条目
+        alive = [i for i, expire_at in enumerate(self.expire_at) if expire_at >= now]
+        keep = alive[max(0, len(alive) - max_entries + 1):]
+        self.queries = [self.queries[i] for i in keep] + [query]
+        self.answers = [self.answers[i] for i in keep] + [answer]
+        self.expire_at = [self.expire_at[i] for i in keep] + [now + ttl]
+        vectors = self.vectors[keep] if self.vectors is not None and keep else np.empty((0, len(vector)), dtype=np.float32)
+        self.vectors = np.vstack([vectors, vector[np.newaxis, :]])
+
+
+class SemanticCache:
+    """
+    RAG 召回结果的语义缓存
+    key 为 (知识库ID集合, 各知识库的版本号, 召回参数)，相同 key 下查询向量的余弦相似度超过阈值时直接返回缓存的召回文本
+    知识库内容变化时递增该知识库的版本号，旧版本的缓存不会再被命中；
+    rag.semantic_cache_backend 为 redis 时版本号保存在 Redis 中，多个 worker 之间同步失效
+    """
+    def __init__(self):
+        self.enabled = app_settings.rag.get('semantic_cache', True)
+        self.threshold = app_settings.rag.get('semantic_cache_threshold', 0.95)
+        self.ttl = app_settings.rag.get('semantic_cache_ttl', 3600)
+        self.max_entries = app_settings.rag.get('semantic_cache_entries', 1000)
+        self.max_buckets = app_settings.rag.get('semantic_cache_buckets', 1000)
+        self.backend = app_settings.rag.get('semantic_cache_backend', 'none')
+        # 从 Redis 读取的版本号在进程内缓存很短的时间，避免每次检索都请求 Redis
+        self.generations = TTLLRUCache(max_size=max(self.max_buckets, 10000),
+                                       ttl=app_settings.rag.get('semantic_cache_generation_ttl', 1)
+                                       if self.backend == 'redis' else None)
+        self.buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _get_shared_generations(knowledges_id):
+        from deepsleep.services.redis import redis_client
+        values = redis_client.mget([GENERATION_PREFIX + knowledge_id for knowledge_id in knowledges_id])
+        return [int(value) if value else 0 for value in values]
+
+    @staticmethod
+    def _incr_shared_generation(knowledge_id):
+        from deepsleep.services.redis import redis_client
+        # 版本号不设置过期时间，过期后回到 0 可能重新命中旧版本的缓存
+        return redis_client.incr(GENERATION_PREFIX + knowledge_id, expiration=None)
+
+    async def get_generations(self, knowledges_id):
+        generations = {knowledge_id: self.generations.get(knowledge_id) for knowledge_id in knowledges_id}
+        missing = [knowledge_id for knowledge_id, generation in generations.items() if generation is None]
+        if missing and self.backend == 'redis':
+            values = await asyncio.to_thread(self._get_shared_generations, missing)
+            for knowledge_id, generation in zip(missing, values):
+                self.generations.set(knowledge_id, generation)
+                generations[knowledge_id] = generation
+        return tuple(generations[knowledge_id] or 0 for knowledge_id in knowledges_id)
+
+    @staticmethod
+    def make_key(knowledges_id, generations, **params):
+        return tuple(knowledges_id), tuple(generations), tuple(sorted(params.items()))
+
+    @staticmethod
+    async def _embed(query):
+        vector = np.asarray(await get_embedding(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def lookup(self, query, knowledges_id, **params):
+        if not self.enabled:
+            return None, None
+
+        knowledges_id = sorted([knowledges_id] if isinstance(knowledges_id, str) else knowledges_id)
+        try:
+            generations, vector = await asyncio.gather(self.get_generations(knowledges_id), self._embed(query))
+        except Exception as err:
+            logger.error(f"semantic cache lookup error: {err}")
+            return None, None
+        key = self.make_key(knowledges_id, generations, **params)
+
+        with self._lock:
+            bucket = self.buckets.get(key)
+            answer, similarity = bucket.search(vector, self.threshold) if bucket else (None, 0.0)
+            if bucket:
+                self.buckets.move_to_end(key)
+
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            logger.info(f"semantic cache hit, similarity: {similarity:.4f}, knowledges id: {key[0]}")
+        return answer, SemanticCacheProbe(key, query, vector)
+
+    def store(self, probe, answer):
+        """probe 为 lookup 返回的结果；检索期间知识库发生变化时写入的是旧版本的 key，不会被之后的查询命中"""
+        if not self.enabled or probe is None:
+            return
+
+        key = probe.key
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = SemanticCacheBucket()
+            bucket.add(probe.query, probe.vector, answer, self.ttl, self.max_entries)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+
+    async def invalidate(self, knowledge_id):
+        """知识库内容变化时递增版本号，并删除本进程中所有包含该知识库的缓存"""
+        if self.backend == 'redis':
+            try:
+                generation = await asyncio.to_thread(self._incr_shared_generation, knowledge_id)
+            except Exception as err:
+                # 版本号没有更新时，其他 worker 的缓存只能等待过期
+                logger.error(f"semantic cache invalidate knowledge id: {knowledge_id} error: {err}")
+                generation = None
+            if generation is None:
+                self.generations.pop(knowledge_id)
+            else:
+                self.generations.set(knowledge_id, generation)
+        else:
+            self.generations.set(knowledge_id, (self.generations.get(knowledge_id) or 0) + 1)
+
+        with self._lock:
+            keys = [key for key in self.buckets if knowledge_id in key[0]]
+            for key in keys:
+                self.buckets.pop(key, None)
+        if keys:
+            logger.info(f"semantic cache invalidate {len(keys)} buckets for knowledge id: {knowledge_id}")
+
+    def stats(self):
+        return {
+            "buckets": len(self.buckets),
+            "entries": sum(len(bucket.answers) for bucket in self.buckets.values()),
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+semantic_cache = SemanticCache()
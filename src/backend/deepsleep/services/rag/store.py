@@ -0,0 +1,79 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Set
+
+from deepsleep.schema.search import SearchModel
+
+
+class VectorStore(ABC):
+    """
+    向量检索后端：每个知识库对应一个集合，集合中保存 chunk 的内容向量和摘要向量
+    检索结果的 score 为距离，越小越相关（与 Milvus 的 L2 距离一致）
+    后端缺少任意一个抽象方法时在实例化时报错
+    """
+
+    @abstractmethod
+    async def create_collection(self, collection_name):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def insert(self, collection_name, chunks, flush=True):
+        """flush 为 False 时写入的数据可能还不可见，需要之后调用 flush"""
+        raise NotImplementedError
+
+    async def flush(self, collection_names):
+        """让之前 flush=False 写入的数据可见并持久化"""
+
+    @abstractmethod
+    async def search_batch(self, queries, collection_names, anns_field="embedding", top_k=10,
+                           expr=None, partition_names=None) -> Dict[str, List[List[SearchModel]]]:
+        """返回 {collection_name: [第 i 条查询的结果列表, ...]}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_chunk_ids(self, file_id, collection_name) -> Set[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_by_file_id(self, file_id, collection_name):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_by_chunk_ids(self, chunk_ids, collection_name):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_collection(self, collection_name):
+        raise NotImplementedError
+
+
+class LexicalStore(ABC):
+    """
+    词法检索后端：每个知识库对应一个索引，按 content 或 summary 字段做全文检索
+    检索结果的 score 为相关性分数，越大越相关（与 ES 的 BM25 分数一致）
+    """
+
+    async def start(self):
+        """应用启动时调用，建立连接池等"""
+
+    async def close(self):
+        """应用关闭时调用，释放连接"""
+
+    @abstractmethod
+    async def index_documents(self, index_name, chunks):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def search_documents(self, query, index_name) -> List[SearchModel]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def search_documents_summary(self, query, index_name) -> List[SearchModel]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_documents(self, file_id, index_name):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_documents_by_chunk_ids(self, chunk_ids, index_name):
+        raise NotImplementedError
@@ -0,0 +1,141 @@
+import os
+import json
+import asyncio
+from typing import List
+
+from loguru import logger
+from deepsleep.schema.chunk import ChunkModel
+from deepsleep.settings import app_settings
+from deepsleep.core.models.models import async_client
+from deepsleep.prompts.user import user_chunk_summary
+from deepsleep.utils.cache import TTLLRUCache
+from deepsleep.utils.hash import sha256_hash
+from deepsleep.utils.rate_limiter import AsyncRateLimiter
+
+# Milvus 中 summary 字段为 VARCHAR(512)，按字节计算长度
+SUMMARY_MAX_BYTES = 512
+
+
+class SummaryGenerator:
+    """
+    为 chunks 批量生成摘要
+    - 并发数和 RPM / TPM 限流可配置
+    - 请求失败按指数退避重试，最终失败的 chunk 使用正文截断作为摘要，不影响其他 chunk
+    - 摘要按 chunk 内容的 hash 缓存，并按文件写入 checkpoint，重跑时只处理新增或变更的 chunk
+    """
+    def __init__(self):
+        self.concurrency = app_settings.split.get('summary_concurrency', 5)
+        self.max_retries = app_settings.split.get('summary_max_retries', 3)
+        self.retry_delay = app_settings.split.get('summary_retry_delay', 1)
+        self.checkpoint_dir = app_settings.split.get('summary_checkpoint_dir', 'deepsleep/data/summary_checkpoint')
+        self.rate_limiter = AsyncRateLimiter(rpm=app_settings.split.get('summary_rpm'),
+                                             tpm=app_settings.split.get('summary_tpm'))
+        self.cache = TTLLRUCache(max_size=app_settings.split.get('summary_cache_size', 10000))
+
+    @staticmethod
+    def truncate_bytes(text, max_bytes=SUMMARY_MAX_BYTES):
+        """按 UTF-8 字节数截断文本，不截断半个字符"""
+        return (text or '').encode('utf-8')[:max_bytes].decode('utf-8', errors='ignore')
+
+    @staticmethod
+    def chunk_hash(chunk: ChunkModel):
+        return sha256_hash(chunk.content)
+
+    def _checkpoint_path(self, file_id):
+        return os.path.join(self.checkpoint_dir, f"{file_id}.jsonl")
+
+    def _load_checkpoint(self, file_id):
+        path = self._checkpoint_path(file_id)
+        if not os.path.exists(path):
+            return {}
+
+        summaries = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    summaries[record['hash']] = record['summary']
+                except (ValueError, KeyError):
+                    # 进程中断时最后一行可能不完整，直接跳过
+                    continue
+        return summaries
+
+    def _write_checkpoint(self, checkpoint_file, content_hash, summary):
+        checkpoint_file.write(json.dumps({"hash": content_hash, "summary": summary}, ensure_ascii=False) + "\n")
+        checkpoint_file.flush()
+
+    def clear_checkpoint(self, file_id):
+        path = self._checkpoint_path(file_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    async def _request_summary(self, content):
+        prompt = user_chunk_summary.format(content=content)
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                # prompt 和输出的 token 数粗略按字符数估计
+                await self.rate_limiter.acquire(tokens=len(prompt) + 200)
+                return await async_client.ainvoke(prompt)
+            except Exception as err:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"generate summary error, retry {attempt + 1}/{self.max_retries} after {delay}s: {err}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def generate_summary(self, chunk: ChunkModel, semaphore, checkpoint_file=None, checkpoint=None):
+        content_hash = self.chunk_hash(chunk)
+
+        summary = (checkpoint or {}).get(content_hash) or self.cache.get(content_hash)
+        if summary:
+            # 旧的 checkpoint 中可能有未截断的摘要
+            chunk.summary = self.truncate_bytes(summary)
+            return chunk
+
+        async with semaphore:
+            try:
+                summary = await self._request_summary(chunk.content)
+            except Exception as err:
+                logger.error(f"chunk id: {chunk.chunk_id} generate summary failed: {err}")
+                # 摘要生成失败时使用正文开头代替，避免摘要为空，按字节截断以符合 Milvus 字段长度
+                chunk.summary = self.truncate_bytes(chunk.content)
+                return chunk
+
+        # 模型输出可能超过提示的长度，写入 Milvus 前统一按字节截断
+        summary = self.truncate_bytes(summary)
+        chunk.summary = summary
+        self.cache.set(content_hash, summary)
+        if checkpoint_file is not None:
+            self._write_checkpoint(checkpoint_file, content_hash, summary)
+        return chunk
+
+    async def generate_summaries(self, chunks: List[ChunkModel], file_id=None, concurrency=None, on_progress=None):
+        """
+        :param on_progress: 每完成一个 chunk 调用一次 on_progress(done, total)
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+        done = 0
+
+        async def run(chunk, *args):
+            nonlocal done
+            chunk = await self.generate_summary(chunk, semaphore, *args)
+            done += 1
+            if on_progress is not None:
+                on_progress(done, len(chunks))
+            return chunk
+
+        if file_id is None:
+            return list(await asyncio.gather(*[run(chunk) for chunk in chunks]))
+
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        checkpoint = self._load_checkpoint(file_id)
+        cached = sum(1 for chunk in chunks if self.chunk_hash(chunk) in checkpoint)
+        logger.info(f"file id: {file_id} summary checkpoint hit {cached}/{len(chunks)} chunks")
+
+        with open(self._checkpoint_path(file_id), 'a', encoding='utf-8') as checkpoint_file:
+            tasks = [run(chunk, checkpoint_file, checkpoint) for chunk in chunks]
+            return list(await asyncio.gather(*tasks))
+
+
+summary_generator = SummaryGenerator()
@@ -0,0 +1,63 @@
+import numpy as np
+from pymilvus import DataType
+
+# 支持的向量存储类型，FLOAT16 / BFLOAT16 每维 2 字节，内存占用为 FLOAT 的一半
+VECTOR_TYPES = {
+    "FLOAT_VECTOR": DataType.FLOAT_VECTOR,
+    "FLOAT16_VECTOR": DataType.FLOAT16_VECTOR,
+    "BFLOAT16_VECTOR": DataType.BFLOAT16_VECTOR,
+}
+
+
+def get_vector_type(name):
+    name = (name or "FLOAT_VECTOR").upper()
+    if name not in VECTOR_TYPES:
+        raise ValueError(f"unsupported milvus vector type: {name}, supported: {list(VECTOR_TYPES)}")
+    return VECTOR_TYPES[name]
+
+
+def truncate_vectors(vectors, dim):
+    """
+    Matryoshka 截断：只保留前 dim 维并重新做 L2 归一化
+    只适用于按 Matryoshka 方式训练的模型，前几维包含了主要的语义信息
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dim or vectors.shape[-1] <= dim:
+        return vectors
+    vectors = vectors[..., :dim]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _bfloat16_dtype():
+    try:
+        from ml_dtypes import bfloat16
+    except ImportError:
+        raise ValueError("BFLOAT16_VECTOR requires ml_dtypes, please install it with: pip install ml-dtypes")
+    return bfloat16
+
+
+def encode_vectors(vectors, vector_type, dim=None):
+    """
+    把 float32 向量转换成集合字段的存储类型和维度，写入和检索时都需要调用
+    2 字节类型返回对应 dtype 的 ndarray：pymilvus 按 ndarray 的 dtype 区分检索数据的类型，
+    bytes 会被当作二进制向量（BINARY_VECTOR）
+    """
+    vectors = truncate_vectors(vectors, dim)
+    if vector_type == DataType.FLOAT16_VECTOR:
+        return [np.asarray(vector, dtype=np.float16) for vector in vectors]
+    if vector_type == DataType.BFLOAT16_VECTOR:
+        bfloat16 = _bfloat16_dtype()
+        return [np.asarray(vector, dtype=bfloat16) for vector in vectors]
+    return [vector.tolist() for vector in vectors]
+
+
+def decode_vector(value, vector_type):
+    """把 Milvus 返回的向量（float 列表、2 字节类型的 bytes 或 ndarray）转换成 float32"""
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], (bytes, bytearray)):
+        value = value[0]
+    if isinstance(value, (bytes, bytearray)):
+        if vector_type == DataType.BFLOAT16_VECTOR:
+            return (np.frombuffer(value, dtype=np.uint16).astype(np.uint32) << 16).view(np.float32)
+        return np.frombuffer(value, dtype=np.float16).astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
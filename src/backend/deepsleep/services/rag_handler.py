@@ -1,10 +1,13 @@
+import asyncio
+
 from loguru import logger
 from deepsleep.services.rag.parser import doc_parser
 from deepsleep.services.retrieval import MixRetrival
 from deepsleep.services.rewrite.query_write import query_rewriter
-from deepsleep.services.rag.es_client import client as es_client
-from deepsleep.services.rag.milvus_client import client as milvus_client
+from deepsleep.services.rag.backend import get_vector_store, get_lexical_store
 from deepsleep.services.rag.rerank import Reranker
+from deepsleep.services.rag.fusion import reciprocal_rank_fusion, weighted_score_fusion
+from deepsleep.services.rag.semantic_cache import semantic_cache
 from deepsleep.settings import app_settings
 
 class RagHandler:
@@ -17,23 +20,108 @@ class RagHandler:
     @classmethod
     async def index_milvus_documents(cls, collection_name, file_id, file_path, knowledge_id):
         chunks = await doc_parser.parse_doc_into_chunks(file_id, file_path, knowledge_id)
-        await milvus_client.insert(collection_name, chunks)
+        await get_vector_store().insert(collection_name, chunks)
 
     @classmethod
     async def index_es_documents(cls, index_name, file_id, file_path, knowledge_id):
         chunks = await doc_parser.parse_doc_into_chunks(file_id, file_path, knowledge_id)
-        await es_client.index_documents(index_name, chunks)
+        await get_lexical_store().index_documents(index_name, chunks)
 
     @classmethod
-    async def mix_retrival_documents(cls, query_list, knowledges_id, search_field="summary"):
-        es_documents, milvus_documents = await MixRetrival.mix_retrival_documents(query_list, knowledges_id, search_field)
+    async def index_documents(cls, knowledge_id, chunks):
+        """解析好的 chunks 同时写入 ES 和 Milvus，文件只需要解析一次"""
+        await asyncio.gather(get_lexical_store().index_documents(knowledge_id, chunks),
+                             get_vector_store().insert(knowledge_id, chunks))
+
+    @classmethod
+    async def diff_documents(cls, knowledge_id, file_id, chunks):
+        """
+        和已入库的 chunk_id 做比较，返回需要新增的 chunks 以及需要删除的 chunk_id
+        """
+        existing_chunk_ids = await get_vector_store().get_chunk_ids(file_id, knowledge_id)
+        new_chunk_ids = {chunk.chunk_id for chunk in chunks}
+
+        added_chunks = [chunk for chunk in chunks if chunk.chunk_id not in existing_chunk_ids]
+        removed_chunk_ids = existing_chunk_ids - new_chunk_ids
+        logger.info(f"file id: {file_id} diff result, add: {len(added_chunks)}, remove: {len(removed_chunk_ids)}, "
+                    f"unchanged: {len(chunks) - len(added_chunks)}")
+        return added_chunks, removed_chunk_ids
 
-        es_documents.sort(key=lambda x: x.score, reverse=True)
-        milvus_documents.sort(key=lambda x: x.score, reverse=True)
+    @classmethod
+    async def update_documents(cls, knowledge_id, added_chunks, removed_chunk_ids):
+        """只写入新增的 chunks，只删除已经不存在的 chunks"""
+        tasks = []
+        if added_chunks:
+            tasks.append(cls.index_documents(knowledge_id, added_chunks))
+        if removed_chunk_ids:
+            tasks.append(get_lexical_store().delete_documents_by_chunk_ids(removed_chunk_ids, knowledge_id))
+            tasks.append(get_vector_store().delete_by_chunk_ids(removed_chunk_ids, knowledge_id))
+        await asyncio.gather(*tasks)
+        await semantic_cache.invalidate(knowledge_id)
+
+    @classmethod
+    def fuse_documents(cls, ranked_lists, candidate_budget=None):
+        """
+        将多个查询、多个后端的召回结果融合成一个去重后的候选列表
+        rag.fusion 为 rrf（默认）时按排名融合，为 weighted 时按归一化后的分数加权融合
+        """
+        if candidate_budget is None:
+            candidate_budget = app_settings.rag.get('candidate_budget', 10)
+        weights = app_settings.rag.get('fusion_weights')
+
+        if app_settings.rag.get('fusion', 'rrf') == 'weighted':
+            fused = weighted_score_fusion(ranked_lists, weights)
+        else:
+            fused = reciprocal_rank_fusion(ranked_lists, app_settings.rag.get('rrf_k', 60), weights)
 
-        documents = es_documents[:5] + milvus_documents[:5]
+        documents = []
+        for document, score in fused[:candidate_budget]:
+            document.score = score
+            documents.append(document)
         return documents
 
+    @classmethod
+    async def mix_retrival_documents(cls, query_list, knowledges_id, search_field="summary"):
+        ranked_lists = await MixRetrival.retrival_ranked_lists(query_list, knowledges_id, search_field)
+        return cls.fuse_documents(ranked_lists)
+
+    @classmethod
+    async def speculative_retrival_documents(cls, query, knowledges_id, search_field="summary"):
+        """
+        推测检索：改写进行中先用原始查询检索，改写完成后再检索改写出的查询，两路结果一起融合
+        改写超时或者失败时只使用原始查询的结果，改写不再阻塞检索
+        """
+        async def retrival_rewritten():
+            queries = await asyncio.wait_for(asyncio.shield(cls.query_rewrite(query)),
+                                             app_settings.rewrite.get('timeout', 3))
+            queries = [rewritten_query for rewritten_query in queries if rewritten_query != query]
+            if not queries:
+                return []
+            return await MixRetrival.retrival_ranked_lists(queries, knowledges_id, search_field)
+
+        raw_lists, rewritten_lists = await asyncio.gather(
+            MixRetrival.retrival_ranked_lists([query], knowledges_id, search_field),
+            retrival_rewritten(), return_exceptions=True)
+
+        if isinstance(raw_lists, BaseException):
+            raise raw_lists
+        if isinstance(rewritten_lists, BaseException):
+            logger.warning(f"speculative rewrite skipped: {rewritten_lists!r}")
+            rewritten_lists = []
+        return cls.fuse_documents(raw_lists + rewritten_lists)
+
+    @classmethod
+    async def recall_documents(cls, query, knowledges_id, search_field, needs_query_rewrite=True):
+        # 短查询、关键词、实体查询不需要改写
+        if not needs_query_rewrite or not query_rewriter.needs_rewrite(query):
+            return await cls.mix_retrival_documents([query], knowledges_id, search_field)
+
+        if app_settings.rewrite.get('speculative', True):
+            return await cls.speculative_retrival_documents(query, knowledges_id, search_field)
+
+        rewritten_queries = await cls.query_rewrite(query)
+        return await cls.mix_retrival_documents(rewritten_queries, knowledges_id, search_field)
+
     @classmethod
     async def rag_query_summary(cls, query, knowledges_id, min_score: float=None,
                                 top_k: int=None, needs_query_rewrite: bool=True):
@@ -42,14 +130,14 @@ class RagHandler:
         if top_k is None:
             top_k = app_settings.rag.get('top_k')
 
-        # 查询重写
-        if needs_query_rewrite:
-            rewritten_queries = await cls.query_rewrite(query)
-        else:
-            rewritten_queries = [query]
+        # 语义缓存：相近的问题直接返回缓存的召回结果
+        cache_params = dict(field="summary", min_score=min_score, top_k=top_k)
+        cached_result, cache_probe = await semantic_cache.lookup(query, knowledges_id, **cache_params)
+        if cached_result is not None:
+            return cached_result
 
-        # 文档检索
-        retrieved_documents = await cls.mix_retrival_documents(rewritten_queries, knowledges_id, "summary")
+        # 查询重写 + 文档检索
+        retrieved_documents = await cls.recall_documents(query, knowledges_id, "summary", needs_query_rewrite)
 
         # 准备重排序的文档内容
         documents_to_rerank = [doc.content for doc in retrieved_documents]
@@ -65,6 +153,7 @@ class RagHandler:
                     filtered_results.append(doc)
             # 拼接最终结果
             final_result = "\n".join(result.content for result in filtered_results)
+            semantic_cache.store(cache_probe, final_result)
             return final_result
         else:
             logger.info(f"Recall for summary Field numbers < top k, Start recall use content Field")
@@ -91,14 +180,13 @@ class RagHandler:
         if top_k is None:
             top_k = app_settings.rag.get('top_k')
 
-        # 查询重写
-        if needs_query_rewrite:
-            rewritten_queries = await cls.query_rewrite(query)
-        else:
-            rewritten_queries = [query]
+        cache_params = dict(field="content", min_score=min_score, top_k=top_k)
+        cached_result, cache_probe = await semantic_cache.lookup(query, knowledges_id, **cache_params)
+        if cached_result is not None:
+            return cached_result
 
-        # 文档检索
-        retrieved_documents = await cls.mix_retrival_documents(rewritten_queries, knowledges_id, "content")
+        # 查询重写 + 文档检索
+        retrieved_documents = await cls.recall_documents(query, knowledges_id, "content", needs_query_rewrite)
 
         # 准备重排序的文档内容
         documents_to_rerank = [doc.content for doc in retrieved_documents]
@@ -119,9 +207,11 @@ class RagHandler:
 
         # 拼接最终结果
         final_result = "\n".join(result.content for result in filtered_results)
+        semantic_cache.store(cache_probe, final_result)
         return final_result
 
     @classmethod
     async def delete_documents_es_milvus(cls, file_id, knowledge_id):
-        await es_client.delete_documents(file_id, knowledge_id)
-        await milvus_client.delete_by_file_id(file_id, knowledge_id)
+        await get_lexical_store().delete_documents(file_id, knowledge_id)
+        await get_vector_store().delete_by_file_id(file_id, knowledge_id)
+        await semantic_cache.invalidate(knowledge_id)
@@ -99,6 +99,28 @@ class RedisClient:
         finally:
             self.close()
 
+    def mget(self, keys):
+        try:
+            return self.connection.mget(keys)
+        finally:
+            self.close()
+
+    def mget_values(self, keys):
+        """批量读取 set / set_many 写入的值，未命中的位置为 None"""
+        return [pickle.loads(value) if value else None for value in self.mget(keys)]
+
+    def set_many(self, items, expiration=3600):
+        """通过 pipeline 批量写入，一次往返写入所有 (key, value)"""
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            for key, value in items:
+                pipeline.setex(key, expiration, pickle.dumps(value))
+            return pipeline.execute()
+        except TypeError as exc:
+            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+        finally:
+            self.close()
+
     def incr(self, key, expiration=3600):
         try:
             value = self.connection.incr(key)
@@ -108,6 +130,13 @@ class RedisClient:
         finally:
             self.close()
 
+    def eval(self, script, keys, args):
+        # Lua 脚本在 Redis 中原子执行，多个 key 需要在同一个 slot
+        try:
+            return self.connection.eval(script, len(keys), *keys, *args)
+        finally:
+            self.close()
+
     def close(self):
         self.connection.close()
 
@@ -1,39 +1,128 @@
-from deepsleep.services.rag.es_client import client as es_client
-from deepsleep.services.rag.milvus_client import client as milvus_client
-from deepsleep.services.rewrite.query_write import query_rewriter
+import asyncio
+import time
+
+from loguru import logger
+from deepsleep.services.rag.backend import get_vector_store, get_lexical_store
+from deepsleep.services.rag.fusion import ES_BACKEND, MILVUS_BACKEND
+from deepsleep.settings import app_settings
+
+
+class RetrievalLeg:
+    """一次检索子任务：(后端, 查询列表, 知识库列表)"""
+    def __init__(self, backend, queries, knowledges_id, search_field):
+        self.backend = backend
+        self.queries = queries
+        self.knowledges_id = knowledges_id
+        self.search_field = search_field
+        # 每个 (query, knowledge_id) 对应一个按相关性排好序的结果列表
+        self.results = []
+        self.status = "pending"
+        self.latency = 0.0
+
+    def to_dict(self):
+        return {
+            "backend": self.backend,
+            "queries": self.queries,
+            "knowledges_id": self.knowledges_id,
+            "search_field": self.search_field,
+            "status": self.status,
+            "latency": round(self.latency * 1000, 2),
+            "documents": len(self.documents)
+        }
 
 
 class MixRetrival:
 
     @classmethod
-    async def retrival_milvus_documents(cls, query, knowledges_id, search_field):
-        documents = []
+    async def retrival_milvus_documents(cls, query_list, knowledges_id, search_field):
+        # 所有查询、所有知识库只需要一次 Embedding 请求，每个集合只需要一次多向量检索
+        anns_field = "embedding_summary" if search_field == "summary" else "embedding"
+        results = await get_vector_store().search_batch(query_list, knowledges_id, anns_field)
+
+        ranked_lists = []
+        for knowledge_id in knowledges_id:
+            for query, documents in zip(query_list, results.get(knowledge_id, [])):
+                ranked_lists.append((query, knowledge_id, documents))
+        return ranked_lists
+
+    @classmethod
+    async def retrival_es_documents(cls, query_list, knowledges_id, search_field):
+        query, knowledge_id = query_list[0], knowledges_id[0]
         if search_field == "summary":
-            for knowledge_id in knowledges_id:
-                documents += await milvus_client.search_summary(query, knowledge_id)
+            documents = await get_lexical_store().search_documents_summary(query, knowledge_id)
         else:
-            for knowledge_id in knowledges_id:
-                documents += await milvus_client.search(query, knowledge_id)
-        return documents
+            documents = await get_lexical_store().search_documents(query, knowledge_id)
+        return [(query, knowledge_id, documents or [])]
 
     @classmethod
-    async def retrival_es_documents(cls, query, knowledges_id, search_field):
-        documents = []
-        if search_field == "summary":
+    def _build_legs(cls, query_list, knowledges_id, search_field):
+        # 兼容只传入单个知识库ID（例如历史记录检索时传入的dialog_id）
+        if isinstance(knowledges_id, str):
+            knowledges_id = [knowledges_id]
+
+        legs = []
+        for query in query_list:
             for knowledge_id in knowledges_id:
-                documents += await es_client.search_documents_summary(query, knowledge_id)
+                legs.append(RetrievalLeg(ES_BACKEND, [query], [knowledge_id], search_field))
+        if query_list and knowledges_id:
+            legs.append(RetrievalLeg(MILVUS_BACKEND, list(query_list), list(knowledges_id), search_field))
+        return legs
+
+    @classmethod
+    async def _run_leg(cls, leg: RetrievalLeg, semaphore):
+        if leg.backend == ES_BACKEND:
+            search_func = cls.retrival_es_documents
+            timeout = app_settings.rag.get('es_timeout', 3)
         else:
-            for knowledge_id in knowledges_id:
-                documents += await es_client.search_documents(query, knowledge_id)
+            search_func = cls.retrival_milvus_documents
+            timeout = app_settings.rag.get('milvus_timeout', 3)
 
-        return documents
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                leg.results = await asyncio.wait_for(search_func(leg.queries, leg.knowledges_id, leg.search_field), timeout)
+                leg.status = "success"
+            except asyncio.TimeoutError:
+                leg.status = "timeout"
+                logger.warning(f"{leg.backend} search timeout after {timeout}s, knowledges id: {leg.knowledges_id}")
+            except Exception as err:
+                leg.status = "error"
+                logger.error(f"{leg.backend} search error, knowledges id: {leg.knowledges_id}: {err}")
+            finally:
+                leg.latency = time.perf_counter() - start
+        return leg
 
     @classmethod
-    async def mix_retrival_documents(cls, query_list, knowledges_id, search_field):
-        es_documents = []
-        milvus_documents = []
-        for query in query_list:
-            es_documents += await cls.retrival_es_documents(query, knowledges_id, search_field)
-            milvus_documents += await cls.retrival_milvus_documents(query, knowledges_id, search_field)
+    async def run_legs(cls, query_list, knowledges_id, search_field):
+        """
+        并发执行所有检索任务：ES 按 (查询 × 知识库) 拆分，Milvus 合并为一次批量检索
+        单个任务超时或者失败只会丢弃该任务的结果，不影响其余结果返回
+        """
+        legs = cls._build_legs(query_list, knowledges_id, search_field)
+        if not legs:
+            return legs
+
+        semaphore = asyncio.Semaphore(app_settings.rag.get('retrieval_concurrency', 16))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[cls._run_leg(leg, semaphore) for leg in legs])
+        total = time.perf_counter() - start
+
+        for leg in legs:
+            logger.debug(f"retrieval leg: {leg.to_dict()}")
+        slowest = max(legs, key=lambda leg: leg.latency)
+        failed = sum(1 for leg in legs if leg.status != "success")
+        logger.info(f"Retrieval {len(legs)} legs finished in {total * 1000:.2f}ms, failed: {failed}, "
+                    f"slowest: {slowest.backend}/{slowest.knowledges_id} {slowest.latency * 1000:.2f}ms")
+        return legs
+
+    @classmethod
+    async def retrival_ranked_lists(cls, query_list, knowledges_id, search_field):
+        """返回 [(backend, documents), ...]，每个 (查询, 知识库, 后端) 一个排序列表，用于融合排序"""
+        legs = await cls.run_legs(query_list, knowledges_id, search_field)
 
-        return es_documents, milvus_documents
+        ranked_lists = []
+        for leg in legs:
+            for _, _, documents in leg.results:
+                ranked_lists.append((leg.backend, documents))
+        return ranked_lists
@@ -1,18 +1,89 @@
 import asyncio
 import re
 import os
+import io
+import json
 import base64
+import hashlib
 
+import aiofiles
+from PIL import Image
 from loguru import logger
 from openai import AsyncOpenAI
 from urllib.parse import urljoin
 from deepsleep.settings import app_settings
 
+IMAGE_MIME_TYPES = {"jpg": "jpeg", "jpeg": "jpeg", "png": "png", "webp": "webp", "gif": "gif", "bmp": "bmp"}
+
+
+class ImageInfo:
+    def __init__(self, content_hash, perceptual_hash, base64_image, mime_type, size=None):
+        self.content_hash = content_hash
+        self.perceptual_hash = perceptual_hash
+        self.base64_image = base64_image
+        self.mime_type = mime_type
+        self.size = size
+
+    @property
+    def dedupe_key(self):
+        # 同一文档中重新编码过的同一张图片内容 hash 不同，但感知 hash 和尺寸相同；
+        # 64 位的感知 hash 容易撞上外观相近的不同图表，只和尺寸一起用于文档内去重，不作为持久化缓存的 key
+        return (self.perceptual_hash, self.size) if self.perceptual_hash else self.content_hash
+
+
+class CaptionCache:
+    """图片描述的持久化缓存，只按图片内容 hash 索引，追加写入 JSONL 文件"""
+    def __init__(self, path):
+        self.path = path
+        self.captions = None
+
+    def load(self):
+        if self.captions is not None:
+            return
+        self.captions = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('content_hash'):
+                    self.captions[record['content_hash']] = record['caption']
+
+    def get(self, content_hashes):
+        self.load()
+        for content_hash in content_hashes:
+            if content_hash in self.captions:
+                return self.captions[content_hash]
+        return None
+
+    async def set(self, content_hashes, caption):
+        self.load()
+        content_hashes = [content_hash for content_hash in content_hashes if content_hash not in self.captions]
+        if not content_hashes:
+            return
+        for content_hash in content_hashes:
+            self.captions[content_hash] = caption
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        async with aiofiles.open(self.path, 'a', encoding='utf-8') as f:
+            await f.write("".join(json.dumps({"content_hash": content_hash, "caption": caption},
+                                             ensure_ascii=False) + "\n" for content_hash in content_hashes))
+
+
 class MarkdownRewrite:
     def __init__(self, **kwargs):
 
         # LLM 的配置可以放到配置文件config中
         self.client = AsyncOpenAI(api_key=app_settings.qw_vl.get("api_key"), base_url=app_settings.qw_vl.get("endpoint"))
+        self.concurrency = app_settings.qw_vl.get("concurrency", 8)
+        self.max_image_side = app_settings.qw_vl.get("max_image_side", 1024)
+        self.image_quality = app_settings.qw_vl.get("image_quality", 85)
+        self.caption_cache = CaptionCache(app_settings.qw_vl.get("caption_cache_path",
+                                                                 "deepsleep/data/caption_cache.jsonl"))
+        self.semaphore = None
 
     async def _get_image_dict(self, markdown_path):
         # 获取Md文件的上层目录路径
@@ -32,44 +103,97 @@ class MarkdownRewrite:
         with open(markdown_path, 'r', encoding='utf-8') as file:
             return file.read()
 
-    async def request_vl(self, image_path):
+    @staticmethod
+    def perceptual_hash(image: Image.Image):
+        """dHash：缩放成 9x8 灰度图，比较相邻像素的明暗，纯色或过小的图片不参与感知去重"""
+        if min(image.size) < 16:
+            return None
+        pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+        bits = [pixels[row * 9 + col] > pixels[row * 9 + col + 1] for row in range(8) for col in range(8)]
+        if all(bits) or not any(bits):
+            return None
+        return "dhash:" + f"{int(''.join('1' if bit else '0' for bit in bits), 2):016x}"
+
+    def load_image(self, image_path):
+        """读取图片、计算 hash，超过 max_image_side 的图片等比缩小并重新编码为 JPEG"""
+        with open(image_path, "rb") as image_file:
+            data = image_file.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+        mime_type = IMAGE_MIME_TYPES.get(image_path.split('.')[-1].lower(), "jpeg")
+
+        with Image.open(io.BytesIO(data)) as image:
+            size = image.size
+            perceptual_hash = self.perceptual_hash(image)
+            if max(image.size) > self.max_image_side:
+                image.thumbnail((self.max_image_side, self.max_image_side))
+                buffer = io.BytesIO()
+                image.convert("RGB").save(buffer, format="JPEG", quality=self.image_quality)
+                data = buffer.getvalue()
+                mime_type = "jpeg"
+
+        return ImageInfo(content_hash, perceptual_hash, base64.b64encode(data).decode("utf-8"), mime_type, size)
+
+    async def request_vl(self, image: ImageInfo):
         # 将本地图片转成 base64进行解析描述
-        image_type = image_path.split('.')[-1]
-        base64_image = await MarkdownRewrite.encode_image(image_path)
-        completion = await self.client.chat.completions.create(
-            model=app_settings.qw_vl.get("model_name"),
-            messages=[
-                    {
-                        "role": "system",
-                        "content": [{"type": "text", "text": "You are a helpful assistant."}]},
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                # 需要注意，传入BASE64，图像格式（即image/{format}）需要与支持的图片列表中的Content Type保持一致。"f"是字符串格式化的方法。
-                                # PNG图像：  f"data:image/png;base64,{base64_image}"
-                                # JPEG图像： f"data:image/jpeg;base64,{base64_image}"
-                                # WEBP图像： f"data:image/webp;base64,{base64_image}"
-                                "image_url": {"url": f"data:image/{image_type};base64,{base64_image}"},
-                            },
-                            {"type": "text", "text": "图中描绘的是什么景象?"},
-                        ],
-                    }
-                ],
-            )
-        logger.debug(f"{image_path} 中的描述信息为 {completion.choices[0].message.content}")
+        async with self.semaphore:
+            completion = await self.client.chat.completions.create(
+                model=app_settings.qw_vl.get("model_name"),
+                messages=[
+                        {
+                            "role": "system",
+                            "content": [{"type": "text", "text": "You are a helpful assistant."}]},
+                        {
+                            "role": "user",
+                            "content": [
+                                {
+                                    "type": "image_url",
+                                    # 需要注意，传入BASE64，图像格式（即image/{format}）需要与支持的图片列表中的Content Type保持一致。
+                                    # PNG图像：  f"data:image/png;base64,{base64_image}"
+                                    # JPEG图像： f"data:image/jpeg;base64,{base64_image}"
+                                    # WEBP图像： f"data:image/webp;base64,{base64_image}"
+                                    "image_url": {"url": f"data:image/{image.mime_type};base64,{image.base64_image}"},
+                                },
+                                {"type": "text", "text": "图中描绘的是什么景象?"},
+                            ],
+                        }
+                    ],
+                )
         return completion.choices[0].message.content
 
-    async def async_request_vl(self, image, image_path):
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, self.request_vl, image_path)
-        return image, result
+    async def async_request_vl(self, image_names, image: ImageInfo, content_hashes):
+        # content_hashes 为同一组去重图片的所有内容 hash，任意一个命中缓存即可在本文档内共用
+        description = self.caption_cache.get(content_hashes)
+        if description is None:
+            description = await self.request_vl(image)
+            # 感知 hash 可能碰撞，只持久化真正被描述的那张图片的内容 hash
+            await self.caption_cache.set([image.content_hash], description)
+            logger.debug(f"{image_names} 中的描述信息为 {description}")
+        return image_names, description
 
     async def get_image_description(self, image_path_dict):
         # 获得每张图片的描述信息
-        # 采用的是异步调用，只需要一次请求模型的时间
-        tasks = [self.async_request_vl(image, image_path) for image, image_path in image_path_dict.items()]
+        # 读取、缩放图片在线程中执行；内容相同的图片只请求一次，已经描述过的图片直接使用缓存
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        await asyncio.to_thread(self.caption_cache.load)
+        names = list(image_path_dict.keys())
+        images = await asyncio.gather(*[asyncio.to_thread(self.load_image, image_path_dict[name]) for name in names],
+                                      return_exceptions=True)
+
+        groups = {}
+        for name, image in zip(names, images):
+            if isinstance(image, Exception):
+                logger.error(f'图片读取出现错误: {name}, {image}')
+                continue
+            if image.dedupe_key not in groups:
+                groups[image.dedupe_key] = ([], image, [])
+            groups[image.dedupe_key][0].append(name)
+            if image.content_hash not in groups[image.dedupe_key][2]:
+                groups[image.dedupe_key][2].append(image.content_hash)
+
+        tasks = [self.async_request_vl(image_names, image, content_hashes)
+                 for image_names, image, content_hashes in groups.values()]
         results = await asyncio.gather(*tasks, return_exceptions=True)
 
         image_desc_dict = {}
@@ -78,8 +202,10 @@ class MarkdownRewrite:
                 logger.error(f'图片描述信息出现错误: {result}')
                 continue
 
-            image, desc = result
-            image_desc_dict[image] = desc
+            image_names, desc = result
+            for image in image_names:
+                image_desc_dict[image] = desc
+        logger.info(f"图片描述完成，图片数: {len(names)}，去重后请求数: {len(groups)}")
         return image_desc_dict
 
 
@@ -91,8 +217,11 @@ class MarkdownRewrite:
             alt_text = match.group(0)  # 提取图片的alt文本
             image_url = match.group(1)  # 提取图片的URL
             image_oss_object_name = image_oss_dict.get(os.path.basename(image_url))
-            image_desc = image_desc_dict.get(os.path.basename(image_url))
+            image_desc = image_desc_dict.get(os.path.basename(image_url), "")
 
+            # 没有上传到 OSS 的图片保留原始链接
+            if image_oss_object_name is None:
+                return f'![{image_desc}]({image_url})'
             return f'![{image_desc}]({urljoin(app_settings.oss.get("base_url"), image_oss_object_name)})'
 
         # 使用re.sub进行替换
@@ -116,10 +245,11 @@ class MarkdownRewrite:
 
     @staticmethod
     async def encode_image(image_path):
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode("utf-8")
-
+        def read():
+            with open(image_path, "rb") as image_file:
+                return base64.b64encode(image_file.read()).decode("utf-8")
 
-rewrite_client = MarkdownRewrite()
+        return await asyncio.to_thread(read)
 
 
+rewrite_client = MarkdownRewrite()
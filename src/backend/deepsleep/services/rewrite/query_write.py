@@ -1,28 +1,114 @@
+import re
 import json
+import asyncio
 
 from loguru import logger
 from deepsleep.core.models.models import AsyncChatClient
 from deepsleep.settings import app_settings
 from deepsleep.prompts.system import system_query_rewrite
 from deepsleep.prompts.user import user_query_write
+from deepsleep.utils.cache import TTLLRUCache
+
+# 疑问词、句式标记，出现时说明是自然语言问题而不是实体查询
+QUESTION_PATTERN = re.compile(r'[?？]|什么|怎么|怎样|如何|为什么|为何|哪|吗|呢|是否|能否|区别|'
+                              r'\b(what|how|why|which|when|where|who|whom|whose|is|are|can|does|do|should)\b',
+                              re.IGNORECASE)
+CJK_PATTERN = re.compile(r'[一-鿿]')
+WORD_PATTERN = re.compile(r'[A-Za-z]+')
+# 编号、版本号、路径、型号等标识符
+IDENTIFIER_PATTERN = re.compile(r'^[\w\-./:#@]+$', re.ASCII)
+
 
 class QueryRewrite:
     def __init__(self):
         self.client = AsyncChatClient(model_name=app_settings.llm.get('model_name'),
                                       base_url=app_settings.llm.get('base_url'),
                                       api_key=app_settings.llm.get('api_key'))
+        self.min_length = app_settings.rewrite.get('min_length', 6)
+        self.max_length = app_settings.rewrite.get('max_length', 200)
+        self.entity_max_length = app_settings.rewrite.get('entity_max_length', 8)
+        self.cache = TTLLRUCache(max_size=app_settings.rewrite.get('cache_size', 10000),
+                                 ttl=app_settings.rewrite.get('cache_ttl', 24 * 3600))
+        # 相同查询并发改写时只请求一次大模型
+        self._inflight = {}
 
-    async def rewrite(self, user_input):
-        rewrite_prompt = user_query_write.format(user_input=user_input)
-        response = self.client.ainvoke(rewrite_prompt, system_query_rewrite)
+    @staticmethod
+    def normalize(user_input):
+        return " ".join(user_input.split()).lower()
+
+    @staticmethod
+    def query_length(user_input):
+        # 中文按字计算，其他语言按单词计算
+        return len(CJK_PATTERN.findall(user_input)) + len(WORD_PATTERN.findall(user_input))
+
+    def is_entity_lookup(self, user_input):
+        """不含疑问句式的短查询：标识符、专有名词、关键词组合，改写不会带来新的召回"""
+        if QUESTION_PATTERN.search(user_input):
+            return False
+        if IDENTIFIER_PATTERN.match(user_input):
+            return True
+        cjk_count = len(CJK_PATTERN.findall(user_input))
+        if cjk_count:
+            return cjk_count <= self.entity_max_length
+        return len(user_input.split()) <= 3
+
+    def needs_rewrite(self, user_input):
+        """
+        判断查询是否值得改写：
+        1. 过短的查询是关键词，过长的查询已经足够具体
+        2. 不含中文或英文的查询（代码、数字等）改写没有意义
+        3. 实体查询直接检索即可
+        """
+        user_input = user_input.strip()
+        length = self.query_length(user_input)
+        if length == 0:
+            return False
+        if length < self.min_length or len(user_input) > self.max_length:
+            return False
+        return not self.is_entity_lookup(user_input)
+
+    @staticmethod
+    def parse_response(response, user_input):
         cleaned_response = response.replace("```json", "")
         cleaned_response = cleaned_response.replace("```", "").strip()
 
         try:
             result = json.loads(cleaned_response)
-            return result
         except Exception as e:
             logger.info(f"json loads error: {e}")
             return [user_input]
 
-query_rewriter = QueryRewrite()
\ No newline at end of file
+        # 兼容提示词中 {"original_query": ..., "variations": [...]} 的输出格式
+        if isinstance(result, dict):
+            result = result.get('variations') or []
+        queries = [query.strip() for query in result if isinstance(query, str) and query.strip()]
+        return queries or [user_input]
+
+    async def _request_rewrite(self, user_input):
+        rewrite_prompt = user_query_write.format(user_input=user_input)
+        response = await self.client.ainvoke(rewrite_prompt, system_query_rewrite)
+        queries = self.parse_response(response, user_input)
+        # 解析失败时不缓存，下次重新改写；推测模式下调用方超时放弃等待，结果仍然写入缓存
+        if queries != [user_input]:
+            self.cache.set(self.normalize(user_input), queries)
+        return queries
+
+    async def rewrite(self, user_input):
+        key = self.normalize(user_input)
+        queries = self.cache.get(key)
+        if queries is not None:
+            return list(queries)
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._request_rewrite(user_input))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        try:
+            queries = await asyncio.shield(task)
+        except Exception as e:
+            logger.error(f"query rewrite error: {e}")
+            return [user_input]
+        return list(queries)
+
+query_rewriter = QueryRewrite()
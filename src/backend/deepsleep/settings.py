@@ -5,15 +5,20 @@ from pydantic.v1 import BaseSettings
 class Settings(BaseSettings):
     llm: dict = {}
     oss: dict = {}
+    qw_vl: dict = {}
     rag: dict = {}
     logo: dict = {}
     redis: dict = {}
     mysql: dict = {}
     milvus: dict = {}
+    mineru: dict = {}
     rerank: dict = {}
+    rewrite: dict = {}
     server: dict = {}
     split: dict = {}
     embedding: dict = {}
+    history: dict = {}
+    context: dict = {}
     langfuse: dict = {}
     elasticsearch: dict = {}
     tool_delivery: dict = {}
@@ -0,0 +1,123 @@
+"""
+检查聊天记录的批量写入在停止或被取消时不丢消息：正在写入 MySQL 的批次写完后仍然会建索引，
+写入失败的批次放回缓冲区
+MySQL / ES / Milvus 都替换成内存中的实现，在 src/backend 目录下执行：
+    python -m pytest deepsleep/test/test_history_writer.py
+"""
+import asyncio
+
+import pytest
+
+from deepsleep.settings import initialize_app_settings
+
+# 必须在 import history_writer 之前初始化配置
+initialize_app_settings()
+history_writer_module = pytest.importorskip("deepsleep.services.history_writer")
+HistoryWriter = history_writer_module.HistoryWriter
+
+
+class FakeStore:
+    def __init__(self):
+        self.chunks = []
+
+    async def index_documents(self, index_name, chunks):
+        self.chunks.extend(chunks)
+
+    async def insert(self, collection_name, chunks, flush=True):
+        self.chunks.extend(chunks)
+
+    async def flush(self, collection_names):
+        pass
+
+
+@pytest.fixture
+def stores(monkeypatch):
+    lexical, vector = FakeStore(), FakeStore()
+    monkeypatch.setattr(history_writer_module, "get_lexical_store", lambda: lexical)
+    monkeypatch.setattr(history_writer_module, "get_vector_store", lambda: vector)
+
+    async def invalidate(dialog_id):
+        pass
+
+    monkeypatch.setattr(history_writer_module.semantic_cache, "invalidate", invalidate)
+    return lexical, vector
+
+
+def patch_insert(monkeypatch, started, release, fail=False):
+    written = []
+
+    async def create_histories(histories):
+        started.set()
+        await release.wait()
+        if fail:
+            raise ValueError("mysql unavailable")
+        written.extend(histories)
+
+    monkeypatch.setattr(history_writer_module.HistoryDao, "async_create_histories", create_histories)
+    return written
+
+
+def test_cancel_in_the_middle_of_a_batch_keeps_messages(monkeypatch, stores):
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+        written = patch_insert(monkeypatch, started, release)
+        writer = HistoryWriter()
+        await writer.enqueue("user", "hello", "dialog")
+        writer._wakeup.set()
+        await started.wait()
+
+        writer._task.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(writer._task, return_exceptions=True)
+        writer._task = None
+        await writer.stop()
+        return writer, written
+
+    writer, written = asyncio.run(run())
+    lexical, vector = stores
+    assert [history.content for history in written] == ["hello"]
+    assert len(lexical.chunks) == 1 and len(vector.chunks) == 1
+    assert not writer.pending and not writer._failed_index
+
+
+def test_cancel_failed_insert_returns_batch_to_pending(monkeypatch, stores):
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+        patch_insert(monkeypatch, started, release, fail=True)
+        writer = HistoryWriter()
+        await writer.enqueue("user", "hello", "dialog")
+        writer._wakeup.set()
+        await started.wait()
+
+        writer._task.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(writer._task, return_exceptions=True)
+        return writer
+
+    writer = asyncio.run(run())
+    assert [history.content for history in writer.pending] == ["hello"]
+
+
+def test_stop_waits_for_the_current_batch(monkeypatch, stores):
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+        written = patch_insert(monkeypatch, started, release)
+        writer = HistoryWriter()
+        await writer.enqueue("user", "hello", "dialog")
+        await writer.enqueue("assistant", "hi", "dialog")
+        writer._wakeup.set()
+        await started.wait()
+
+        stop = asyncio.create_task(writer.stop())
+        await asyncio.sleep(0)
+        release.set()
+        await stop
+        return writer, written
+
+    writer, written = asyncio.run(run())
+    lexical, _ = stores
+    assert [history.content for history in written] == ["hello", "hi"]
+    assert len(lexical.chunks) == 2
+    assert not writer.pending
@@ -0,0 +1,65 @@
+"""
+检查本地向量集合的数据段追加、合并、删除和重新加载，合并过程中的中间数据段不能残留在磁盘上
+在 src/backend 目录下执行：
+    python -m pytest deepsleep/test/test_local_store.py
+"""
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+local_store = pytest.importorskip("deepsleep.services.rag.local_store")
+LocalCollection = local_store.LocalCollection
+
+DIM = 4
+
+
+def make_rows(start, count, file_id="file"):
+    rows = [{"chunk_id": f"chunk_{i}", "content": f"content {i}", "summary": "", "file_id": file_id,
+             "file_name": f"{file_id}.md", "knowledge_id": "knowledge", "update_time": ""}
+            for i in range(start, start + count)]
+    vectors = {field: np.full((count, DIM), start, dtype=np.float32) + np.arange(count, dtype=np.float32)[:, None]
+               for field in local_store.VECTOR_FIELDS}
+    return rows, vectors
+
+
+def segment_dirs(collection):
+    return sorted(os.listdir(os.path.join(collection.path, "segments")))
+
+
+def test_append_merge_keeps_only_committed_segments(tmp_path):
+    collection = LocalCollection(str(tmp_path / "collection")).create(DIM)
+    for i in range(6):
+        collection.append(*make_rows(i, 1))
+
+    names = [segment.name for segment in collection.segments]
+    assert segment_dirs(collection) == sorted(names)
+    assert sum(segment.live for segment in collection.segments) == 6
+
+
+def test_remove_and_reload(tmp_path):
+    path = str(tmp_path / "collection")
+    collection = LocalCollection(path).create(DIM)
+    collection.append(*make_rows(0, 4, file_id="a"))
+    collection.append(*make_rows(4, 2, file_id="b"))
+
+    # 删除的行超过存活的行时整体重写成一个数据段
+    assert collection.remove(lambda row: row["file_id"] == "a") == 4
+    assert segment_dirs(collection) == [segment.name for segment in collection.segments]
+
+    reloaded = LocalCollection(path).load()
+    assert sorted(row["chunk_id"] for row in reloaded.iter_rows()) == ["chunk_4", "chunk_5"]
+
+    results = reloaded.search(np.full((1, DIM), 5, dtype=np.float32), "embedding", top_k=1)
+    assert results[0][0].chunk_id == "chunk_5"
+
+
+def test_load_removes_orphan_segments(tmp_path):
+    path = str(tmp_path / "collection")
+    collection = LocalCollection(path).create(DIM)
+    collection.append(*make_rows(0, 2))
+    # 写入数据段后、提交 manifest 前退出
+    collection._new_segment(*make_rows(2, 1))
+
+    reloaded = LocalCollection(path).load()
+    assert segment_dirs(reloaded) == [segment.name for segment in reloaded.segments]
@@ -0,0 +1,57 @@
+"""
+检查 FLOAT16 / BFLOAT16 集合的写入和检索：查询向量必须按字段类型编码成对应 dtype 的 ndarray，
+编码成 bytes 时 pymilvus 会当作二进制向量发送，检索直接失败
+需要一个可以连接的 Milvus（默认 localhost:19530，可以通过 MILVUS_HOST / MILVUS_PORT 修改），在 src/backend 目录下执行：
+    python -m pytest deepsleep/test/test_milvus_float16.py
+"""
+import os
+from uuid import uuid4
+
+import numpy as np
+import pytest
+from pymilvus import connections, utility, Collection, CollectionSchema, FieldSchema, DataType
+
+from deepsleep.services.rag.vector_codec import encode_vectors
+
+DIM = 32
+
+
+@pytest.fixture(scope="module")
+def milvus():
+    try:
+        connections.connect("default", host=os.getenv("MILVUS_HOST", "localhost"),
+                            port=os.getenv("MILVUS_PORT", "19530"), timeout=5)
+    except Exception as err:
+        pytest.skip(f"milvus not available: {err}")
+    yield
+    connections.disconnect("default")
+
+
+def test_encode_float16_as_ndarray():
+    vectors = encode_vectors(np.random.rand(2, DIM), DataType.FLOAT16_VECTOR)
+    assert all(isinstance(vector, np.ndarray) and vector.dtype == np.float16 for vector in vectors)
+
+
+@pytest.mark.parametrize("vector_type", [DataType.FLOAT16_VECTOR, DataType.BFLOAT16_VECTOR])
+def test_search_half_precision_collection(milvus, vector_type):
+    collection_name = f"test_{vector_type.name.lower()}_{uuid4().hex[:8]}"
+    schema = CollectionSchema([
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+        FieldSchema(name="chunk_id", dtype=DataType.VARCHAR, max_length=128),
+        FieldSchema(name="embedding", dtype=vector_type, dim=DIM),
+    ])
+    collection = Collection(collection_name, schema)
+    try:
+        vectors = np.random.rand(16, DIM).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.insert([[f"chunk_{i}" for i in range(len(vectors))], encode_vectors(vectors, vector_type)])
+        collection.flush()
+        collection.create_index("embedding", {"index_type": "IVF_FLAT", "metric_type": "L2", "params": {"nlist": 16}})
+        collection.load()
+
+        hits = collection.search(data=encode_vectors(vectors[:2], vector_type), anns_field="embedding",
+                                 param={"metric_type": "L2", "params": {"nprobe": 16}}, limit=1,
+                                 output_fields=["chunk_id"])
+        assert [hit[0].entity.get("chunk_id") for hit in hits] == ["chunk_0", "chunk_1"]
+    finally:
+        utility.drop_collection(collection_name)
@@ -17,7 +17,7 @@ def load_file_to_obj(filepath):
 async def save_upload_file(upload_file):
     # 创建临时文件夹
     temp = tempfile.mkdtemp()
-    file_name = os.path.basename(upload_file.file_name)
+    file_name = os.path.basename(upload_file.filename)
     file_path = os.path.join(temp, file_name)
     async with aiofiles.open(file_path, 'wb') as file:
         content = await upload_file.read()
@@ -34,4 +34,22 @@ async def get_oss_object_name(file_path, knowledge_id):
 async def read_upload_file(file_path):
     async with aiofiles.open(file_path, 'r') as file:
         content = await file.read()
-    return content
\ No newline at end of file
+    return content
+
+class LineSegment(str):
+    """超长行拆分后的后续片段，与前一段属于原文的同一行，拼接时不能加换行符"""
+
+
+def iter_file_lines(file_path, max_line_length=None, encoding='utf-8'):
+    """
+    逐行读取文本文件，不保留换行符，内存占用与文件大小无关
+    :param max_line_length: 单行的最大字符数，超长的行会被拆成多段返回，避免没有换行的大文件一次读入内存；
+                            第一段之后的片段以 LineSegment 返回
+    """
+    limit = max_line_length or -1
+    continued = False
+    with open(file_path, 'r', encoding=encoding) as file:
+        for line in iter(lambda: file.readline(limit), ''):
+            text = line[:-1] if line.endswith('\n') else line
+            yield LineSegment(text) if continued else text
+            continued = not line.endswith('\n')
@@ -3,4 +3,16 @@ import hashlib
 def md5_hash(original_string: str):
     md5 = hashlib.md5()
     md5.update(original_string.encode('utf-8'))
-    return md5.hexdigest()
\ No newline at end of file
+    return md5.hexdigest()
+
+def sha256_hash(original_string: str):
+    sha256 = hashlib.sha256()
+    sha256.update(original_string.encode('utf-8'))
+    return sha256.hexdigest()
+
+def sha256_file(file_path: str, block_size: int = 1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
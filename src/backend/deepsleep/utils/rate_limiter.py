@@ -0,0 +1,50 @@
+import time
+import asyncio
+
+
+class AsyncRateLimiter:
+    """
+    基于令牌桶的异步限流器，同时限制每分钟请求数（RPM）和每分钟 token 数（TPM）
+    rpm / tpm 为 None 或 0 时不做对应的限制
+    """
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._request_tokens = float(rpm or 0)
+        self._tpm_tokens = float(tpm or 0)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        if self.rpm:
+            self._request_tokens = min(self.rpm, self._request_tokens + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tpm_tokens = min(self.tpm, self._tpm_tokens + elapsed * self.tpm / 60)
+
+    def _wait_time(self, tokens):
+        wait = 0.0
+        if self.rpm and self._request_tokens < 1:
+            wait = max(wait, (1 - self._request_tokens) * 60 / self.rpm)
+        if self.tpm:
+            # 单次请求超过 TPM 上限时按上限计算，避免永远等待
+            tokens = min(tokens, self.tpm)
+            if self._tpm_tokens < tokens:
+                wait = max(wait, (tokens - self._tpm_tokens) * 60 / self.tpm)
+        return wait
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.rpm:
+                self._request_tokens -= 1
+            if self.tpm:
+                self._tpm_tokens -= min(tokens, self.tpm)